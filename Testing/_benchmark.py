@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from time import time as _time
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if len(ordered) == 0:
+        return float('NaN')
+    position = int(round(fraction*(len(ordered)-1)))
+    return ordered[position]
+
+
+def summary(samples):
+    """
+    Latency summary in micro seconds of a list of samples in seconds.
+    """
+    if len(samples) == 0:
+        return {'count': 0}
+    return {'count': len(samples),
+            'min_us': min(samples)*1e6,
+            'mean_us': sum(samples)/len(samples)*1e6,
+            'p50_us': percentile(samples, .5)*1e6,
+            'p99_us': percentile(samples, .99)*1e6,
+            'max_us': max(samples)*1e6}
+
+
+def print_summary(tag, samples, length=20):
+    stats = summary(samples)
+    if stats['count'] == 0:
+        print("{0:{1}} no samples".format(tag, length))
+        return
+    print("{0:{1}} {2:6d} samples: min {3:9.1f} us p50 {4:9.1f} us "
+          "p99 {5:9.1f} us max {6:9.1f} us (mean {7:9.1f} us)"
+          "".format(tag, length, stats['count'], stats['min_us'],
+                    stats['p50_us'], stats['p99_us'], stats['max_us'],
+                    stats['mean_us']))
+
+
+def recv_answer(sock, bufsize=65536):
+    """
+    Receive from the socket until the answer terminator.
+    """
+    answer = b''
+    while not answer.endswith(b'\r\n'):
+        chunk = sock.recv(bufsize)
+        if not chunk:
+            break
+        answer += chunk
+    return answer
+
+
+def round_trips(sock, query, samples):
+    """
+    Send the query as many times as samples and collect the time from the
+    send to the complete answer.
+    """
+    times = []
+    for i in range(samples):
+        t_0 = _time()
+        sock.sendall(query)
+        recv_answer(sock)
+        times.append(_time()-t_0)
+    return times
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _printing import print_header as _print_header
+from scpilib import scpi
+from scpilib.logger import timeit, trace, scpi_timeit_collection
+from time import time as _time
+
+
+_flag = False
+
+
+def _flag_checked(method):
+    # how the decorators were before: always a wrapper checking a flag
+    def wrapper(*args, **kwargs):
+        if _flag:
+            pass
+        answer = method(*args, **kwargs)
+        if _flag:
+            pass
+        return answer
+    return wrapper
+
+
+class _Methods(object):
+    def bare(self, value):
+        return value
+
+    @_flag_checked
+    @_flag_checked
+    def flag_checked(self, value):
+        return value
+
+    @timeit
+    @trace
+    def instrumented(self, value):
+        return value
+
+
+def _per_call(method, calls, *args):
+    t_0 = _time()
+    for i in range(calls):
+        method(*args)
+    return (_time()-t_0)/calls*1e9
+
+
+def _report(tag, ns):
+    print("{0:30} {1:9.1f} ns/call".format(tag, ns))
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--calls", type="int", default=500000,
+                      help="Number of calls per case")
+    (options, args) = parser.parse_args()
+    _print_header("Cost of the instrumentation decorators")
+    methods = _Methods()
+    _report("bare method", _per_call(methods.bare, options.calls, 1))
+    _report("flag checking wrappers",
+            _per_call(methods.flag_checked, options.calls, 1))
+    _report("@timeit @trace disabled",
+            _per_call(methods.instrumented, options.calls, 1))
+    scpi_timeit_collection(True)
+    _report("@timeit @trace timeit enabled",
+            _per_call(methods.instrumented, options.calls, 1))
+    scpi_timeit_collection(False)
+    calls = max(options.calls//10, 100)
+    with scpi(local=True, services=0, log2file=False) as instrument:
+        _report("scpi.input('*IDN?')",
+                _per_call(instrument.input, calls, '*IDN?'))
+        scpi_timeit_collection(True)
+        _report("scpi.input('*IDN?') timeit",
+                _per_call(instrument.input, calls, '*IDN?'))
+        scpi_timeit_collection(False)
+
+
+if __name__ == '__main__':
+    main()
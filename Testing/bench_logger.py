@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _printing import print_header as _print_header
+from scpilib.logger import Logger, logger_INFO, logger_WARNING
+from time import time as _time
+
+
+class _Baseline(object):
+    def _info(self, msg, *args):
+        pass
+
+
+def _per_call(method, calls, *args):
+    t_0 = _time()
+    for i in range(calls):
+        method("received from {0}: {1:d} bytes {2!r}", *args)
+    return (_time()-t_0)/calls*1e9
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--calls", type="int", default=200000,
+                      help="Number of log calls per case")
+    parser.add_option('', "--payload", type="int", default=64*1024,
+                      help="Bytes of the logged payload")
+    (options, args) = parser.parse_args()
+    _print_header("Cost of a log call: level enabled, disabled or queued")
+    payload = b'x'*options.payload
+    arguments = ('127.0.0.1:5025', len(payload), payload)
+    logger = Logger(name="bench")
+    logger.enable_log(False)
+    cases = [("empty method", _Baseline()._info),
+             ("debug disabled", logger._debug)]
+    for tag, method in cases:
+        print("{0:20} {1:9.1f} ns/call".format(
+            tag, _per_call(method, options.calls, *arguments)))
+    logger.log_level = logger_WARNING
+    print("{0:20} {1:9.1f} ns/call".format(
+        "info disabled", _per_call(logger._info, options.calls, *arguments)))
+    logger.log_level = logger_INFO
+    calls = max(options.calls//100, 100)
+    print("{0:20} {1:9.1f} ns/call (payload truncated)".format(
+        "info enabled", _per_call(logger._info, calls, *arguments)))
+    logger.enable_log_queue(size=calls)
+    print("{0:20} {1:9.1f} ns/call (written in background)".format(
+        "info queued", _per_call(logger._info, calls, *arguments)))
+    logger.disable_log_queue()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _benchmark import recv_answer
+from _objects import ArrayTest
+from _printing import print_header as _print_header
+from multiprocessing import cpu_count as _cpu_count
+from multiprocessing import Pool as _Pool
+from scpilib import scpi
+import socket as _socket
+from time import sleep as _sleep
+from time import time as _time
+
+
+def _client(args):
+    port, queries = args
+    client = _socket.create_connection(('127.0.0.1', port))
+    for i in range(queries):
+        client.sendall(b'ARRAy?\n')
+        recv_answer(client)
+    client.close()
+    return queries
+
+
+def bench_workers(n_workers, port, clients, queries, length):
+    array = ArrayTest(length)
+    with scpi(local=True, port=port, workers=n_workers) as scpi_obj:
+        scpi_obj.add_command('ARRAy', read_cb=array.readTest)
+        _sleep(0.5)
+        pool = _Pool(clients)
+        t_0 = _time()
+        done = sum(pool.map(_client, [(port, queries)]*clients))
+        elapsed = _time()-t_0
+        pool.close()
+        pool.join()
+    print("{0:2d} workers: {1:6d} queries in {2:7.3f} s: {3:9.1f} queries/s"
+          "".format(n_workers, done, elapsed, done/elapsed))
+    return done/elapsed
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--port", type="int", default=5050,
+                      help="Port where the scpi object listens")
+    parser.add_option('', "--workers", type="int", default=_cpu_count(),
+                      help="Maximum number of worker processes")
+    parser.add_option('', "--clients", type="int", default=2*_cpu_count(),
+                      help="Number of concurrent client processes")
+    parser.add_option('', "--queries", type="int", default=500,
+                      help="Queries per client")
+    parser.add_option('', "--length", type="int", default=1000,
+                      help="Elements in the array answer")
+    (options, args) = parser.parse_args()
+    _print_header("Read only query scaling with prefork workers")
+    reference = None
+    for n_workers in range(1, options.workers+1):
+        rate = bench_workers(n_workers, options.port+n_workers,
+                             options.clients, options.queries, options.length)
+        if reference is None:
+            reference = rate
+        print("\tspeedup {0:.2f}".format(rate/reference))
+
+
+if __name__ == '__main__':
+    main()
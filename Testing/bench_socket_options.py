@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _benchmark import print_summary, round_trips
+from _printing import print_header as _print_header
+from scpilib import scpi
+from scpilib.tcpListener import SOCKET_PROFILES
+import socket as _socket
+from time import sleep as _sleep
+
+
+def _small_answer():
+    return 1
+
+
+def _big_answer(size):
+    answer = 'x'*size
+
+    def read():
+        return answer
+    return read
+
+
+def bench_profile(profile, port, samples, block_size):
+    with scpi(local=True, port=port, socket_options=profile) as scpi_obj:
+        scpi_obj.add_command('SMALl', read_cb=_small_answer)
+        scpi_obj.add_command('BLOCk', read_cb=_big_answer(block_size))
+        _sleep(0.5)
+        client = _socket.create_connection(('127.0.0.1', port))
+        # the same client for all the profiles: only the server changes
+        client.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+        small = round_trips(client, b'SMAL?\n', samples)
+        block = round_trips(client, b'BLOC?\n', max(samples//100, 10))
+        client.close()
+    print_summary("{0} query".format(profile), small, length=28)
+    print_summary("{0} {1} B block".format(profile, block_size), block,
+                  length=28)
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--port", type="int", default=5030,
+                      help="Port where the scpi object listens")
+    parser.add_option('', "--samples", type="int", default=10000,
+                      help="Number of round trips per profile")
+    parser.add_option('', "--block-size", dest="block_size", type="int",
+                      default=4*1024*1024, help="Bytes of the block answer")
+    (options, args) = parser.parse_args()
+    _print_header("Round trip per socket options profile")
+    for i, profile in enumerate(sorted(SOCKET_PROFILES.keys())):
+        bench_profile(profile, options.port+i, options.samples,
+                      options.block_size)
+
+
+if __name__ == '__main__':
+    main()
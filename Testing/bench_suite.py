@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _benchmark import percentile, recv_answer
+from _printing import print_header as _print_header
+import gc as _gc
+from itertools import repeat as _repeat
+import json as _json
+import platform as _platform
+from scpilib import scpi
+from scpilib.commands import DictKey, get_id
+from scpilib.latency import perf_counter_ns
+from scpilib.scpi import split_params, DATA_FORMATS
+from scpilib.version import version as _version
+import socket as _socket
+import sys as _sys
+import threading as _threading
+from time import sleep as _sleep
+from time import strftime as _strftime
+from time import time as _time
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+
+# The workloads are pinned: the same commands, arguments, arrays (from a
+# fixed seed) and number of calls on each run, so that the results of two
+# runs (in the same machine) can be compared.
+_LEVELS = ['ALPHa', 'BRAVo', 'CHARlie', 'DELTa', 'ECHO', 'FOXTrot', 'GOLF']
+_DEPTHS = range(2, 9)
+_MULTI_COMMANDS = [1, 4, 16]
+_CHANNELS = 16
+_ARRAY_SIZES = [10, 1000, 100000]
+_ARRAY_SEED = 0
+_TCP_CLIENTS = [1, 10, 100]
+_TCP_ROUND_TRIPS = 2000  # in total, split between the clients
+_PARAMS = {'query': 'SOUR:CURR:UPPE?',
+           'write': 'SOUR:CURR:UPPE 10',
+           'arguments': 'CHAN03:MEAS:VALU? 1,2,3'}
+# calls per round
+_NUMBER_PARSE = 100000
+_NUMBER_INPUT = 5000
+_ELEMENTS_ARRAY = 2000000  # elements converted per round
+
+_TOLERANCE = 0.1
+
+
+def _tree_command(depth):
+    return ":".join([name[:4] for name in _LEVELS[:depth-1]] + ['VALU?'])
+
+
+def _value():
+    return 1
+
+
+def _channel_value(ch, value=None):
+    return ch
+
+
+def _build_instrument():
+    instrument = scpi(local=True, services=0, log2file=False)
+    for depth in _DEPTHS:
+        instrument.add_command(":".join(_LEVELS[:depth-1] + ['VALue']),
+                               read_cb=_value)
+    channel = instrument.add_channel('CHANnel', _CHANNELS,
+                                     instrument.command_tree)
+    measure = instrument.add_component('MEASure', channel)
+    instrument.add_attribute('VALue', measure, _channel_value,
+                             _channel_value)
+    return instrument
+
+
+def _measure(function, args, number, repeats):
+    """
+    Nanoseconds per call of the function, the median (and minimum) of the
+    rounds. Like timeit, the garbage collector doesn't run in the rounds.
+    """
+    function(*args)
+    rounds = []
+    gc_enabled = _gc.isenabled()
+    _gc.disable()
+    try:
+        for i in range(repeats):
+            t_0 = perf_counter_ns()
+            for j in _repeat(None, number):
+                function(*args)
+            rounds.append((perf_counter_ns()-t_0)/float(number))
+    finally:
+        if gc_enabled:
+            _gc.enable()
+    return {'ns': percentile(rounds, .5), 'min_ns': min(rounds),
+            'number': number, 'repeats': repeats}
+
+
+def _cases(instrument, scale):
+    """
+    The in-process workloads: (name, function, args, calls per round).
+    """
+    parse = max(int(_NUMBER_PARSE*scale), 1)
+    inputs = max(int(_NUMBER_INPUT*scale), 1)
+    key = DictKey('CURRent')
+    yield 'get_id', get_id, ('CURRent', 4), parse
+    yield 'DictKey/new', DictKey, ('CURRent',), parse//10 or 1
+    yield 'DictKey/eq', key.__eq__, ('CURR',), parse
+    for depth in _DEPTHS:
+        yield ("tree/depth={0:d}".format(depth), instrument.input,
+               (_tree_command(depth),), inputs)
+    for name in sorted(_PARAMS):
+        yield ("split_params/{0}".format(name), split_params,
+               (_PARAMS[name],), parse)
+    for commands in _MULTI_COMMANDS:
+        line = ";".join([_tree_command(2)]*commands)
+        yield ("input/commands={0:d}".format(commands), instrument.input,
+               (line,), max(inputs//commands, 1))
+    yield 'channel/read', instrument.input, ('CHAN03:MEAS:VALU?',), inputs
+    yield 'channel/write', instrument.input, ('CHAN03:MEAS:VALU 5',), inputs
+    if _np is None:
+        print("numpy not available: no convert_array workloads")
+        return
+    attribute = instrument.add_attribute('ARRAy', instrument.command_tree,
+                                         _value)
+    random = _np.random.RandomState(_ARRAY_SEED)
+    arrays = dict((size, random.random_sample(size))
+                  for size in _ARRAY_SIZES)
+    for data_format in DATA_FORMATS:
+        for size in _ARRAY_SIZES:
+            name = "convert_array/{0}/size={1:d}".format(data_format, size)
+            number = max(int(_ELEMENTS_ARRAY*scale)//size, 1)
+            if data_format == 'ASCII':
+                # the text conversion is two orders of magnitude slower
+                number = max(number//100, 1)
+            yield (name, _convert_array, (instrument, attribute, data_format,
+                                          arrays[size]), number)
+
+
+def _convert_array(instrument, attribute, data_format, array):
+    if instrument.data_format() != data_format:
+        instrument.data_format(data_format)
+    return attribute._convert_array(array)
+
+
+def _tcp_client(port, trips, start, times):
+    client = _socket.create_connection(('127.0.0.1', port))
+    client.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+    try:
+        client.sendall(b'ALPH:VALU?\n')
+        recv_answer(client)
+        start.wait()
+        for i in range(trips):
+            t_0 = perf_counter_ns()
+            client.sendall(b'ALPH:VALU?\n')
+            recv_answer(client)
+            times.append(perf_counter_ns()-t_0)
+    finally:
+        client.close()
+
+
+def _tcp_case(port, clients, scale):
+    """
+    Round trips of the clients at the same time: the ns per round trip of
+    the throughput, and the percentiles of the latency of each one.
+    """
+    trips = max(int(_TCP_ROUND_TRIPS*scale)//clients, 1)
+    with scpi(local=True, port=port, max_clients=clients,
+              log2file=False) as instrument:
+        instrument.add_command('ALPHa:VALue', read_cb=_value)
+        _sleep(0.5)
+        start = _threading.Event()
+        times = []
+        threads = [_threading.Thread(target=_tcp_client,
+                                     args=(port, trips, start, times))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        # let them connect before they start together
+        _sleep(0.2 + 0.01*clients)
+        t_0 = perf_counter_ns()
+        start.set()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter_ns()-t_0
+    if len(times) == 0:
+        return None
+    return {'ns': elapsed/float(len(times)), 'p50_ns': percentile(times, .5),
+            'p99_ns': percentile(times, .99), 'number': len(times),
+            'clients': clients}
+
+
+def run(selection=None, repeats=5, scale=1.0, port=5040, tcp=True):
+    """
+    Run the workloads whose names contain some of the selection (all by
+    default).
+    :return: dict with the 'meta' information and the 'results' by name
+    """
+    def selected(name):
+        return selection is None or \
+            any([piece in name for piece in selection])
+    results = {}
+    instrument = _build_instrument()
+    try:
+        for name, function, args, number in _cases(instrument, scale):
+            if selected(name):
+                results[name] = _measure(function, args, number, repeats)
+                _print_result(name, results[name])
+    finally:
+        instrument.close()
+    for i, clients in enumerate(_TCP_CLIENTS):
+        name = "tcp/clients={0:d}".format(clients)
+        if tcp and selected(name):
+            result = _tcp_case(port+i, clients, scale)
+            if result is None:
+                print("{0:36} failed".format(name))
+                continue
+            results[name] = result
+            _print_result(name, result)
+    return {'meta': {'date': _strftime("%Y-%m-%d %H:%M:%S"),
+                     'python': _platform.python_version(),
+                     'platform': _platform.platform(),
+                     'scpilib': _version(), 'numpy': _np is not None,
+                     'repeats': repeats, 'scale': scale},
+            'results': results}
+
+
+def _print_result(name, result):
+    extra = ""
+    if 'p50_ns' in result:
+        extra = " (p50 {0:.1f} us p99 {1:.1f} us)".format(
+            result['p50_ns']/1e3, result['p99_ns']/1e3)
+    print("{0:36} {1:12.1f} ns/op{2}".format(name, result['ns'], extra))
+
+
+def compare(current, baseline, tolerance=_TOLERANCE):
+    """
+    Compare the results with the ones of the baseline: a regression is
+    being slower by more than the tolerance (a fraction).
+    :return: list of (name, baseline ns, current ns, ratio, verdict)
+    """
+    rows = []
+    for name in sorted(current['results']):
+        now = current['results'][name]['ns']
+        if name not in baseline['results']:
+            rows.append((name, None, now, None, 'new'))
+            continue
+        before = baseline['results'][name]['ns']
+        ratio = now/before if before else float('inf')
+        if ratio > 1+tolerance:
+            verdict = 'REGRESSION'
+        elif ratio < 1-tolerance:
+            verdict = 'faster'
+        else:
+            verdict = 'ok'
+        rows.append((name, before, now, ratio, verdict))
+    return rows
+
+
+def _print_comparison(rows, baseline):
+    _print_header("Compared with the baseline of {0} (python {1})"
+                  "".format(baseline['meta']['date'],
+                            baseline['meta']['python']))
+    for name, before, now, ratio, verdict in rows:
+        if before is None:
+            print("{0:36} {1:>12} {2:12.1f} ns/op {3:>7} {4}"
+                  "".format(name, '-', now, '-', verdict))
+        else:
+            print("{0:36} {1:12.1f} {2:12.1f} ns/op {3:6.2f}x {4}"
+                  "".format(name, before, now, ratio, verdict))
+
+
+def _save(results, path):
+    with open(path, 'w') as output:
+        _json.dump(results, output, indent=1, sort_keys=True)
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--filter", default=None,
+                      help="Comma separated pieces of the workload names "
+                           "to run (all by default)")
+    parser.add_option('', "--repeats", type="int", default=5,
+                      help="Rounds per workload (the median is reported)")
+    parser.add_option('', "--scale", type="float", default=1.0,
+                      help="Multiplier of the calls per round")
+    parser.add_option('', "--port", type="int", default=5040,
+                      help="First port for the tcp workloads")
+    parser.add_option('', "--no-tcp", dest="tcp", action="store_false",
+                      default=True, help="Skip the tcp workloads")
+    parser.add_option('', "--output", default=None,
+                      help="Write the results (json) in this file")
+    parser.add_option('', "--save-baseline", dest="save_baseline",
+                      default=None, help="Write the results as the baseline "
+                                         "in this file")
+    parser.add_option('', "--compare", default=None,
+                      help="Compare with the baseline in this file")
+    parser.add_option('', "--tolerance", type="float", default=_TOLERANCE,
+                      help="Slowdown fraction considered a regression")
+    (options, args) = parser.parse_args()
+    baseline = None
+    if options.compare is not None:
+        # before running, to fail early if it is not there
+        with open(options.compare) as baseline_file:
+            baseline = _json.load(baseline_file)
+    selection = None
+    if options.filter is not None:
+        selection = options.filter.split(',')
+    _print_header("Benchmark suite of scpilib {0}".format(_version()))
+    t_0 = _time()
+    results = run(selection, options.repeats, options.scale, options.port,
+                  options.tcp)
+    print("\n{0:d} workloads in {1:.1f} s".format(len(results['results']),
+                                                   _time()-t_0))
+    for path in [options.output, options.save_baseline]:
+        if path is not None:
+            _save(results, path)
+            print("Results written in {0}".format(path))
+    if baseline is None:
+        return 0
+    rows = compare(results, baseline, options.tolerance)
+    _print_comparison(rows, baseline)
+    regressions = [row[0] for row in rows if row[4] == 'REGRESSION']
+    if regressions:
+        print("\n{0:d} regressions (more than {1:.0%} slower): {2}"
+              "".format(len(regressions), options.tolerance,
+                        ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    _sys.exit(main())
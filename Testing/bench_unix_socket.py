@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+__author__ = "Sergi Blanch-Torné"
+__copyright__ = "Copyright 2016, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+
+from _benchmark import print_summary, round_trips
+from _printing import print_header as _print_header
+from scpilib import scpi
+import os as _os
+import socket as _socket
+import tempfile as _tempfile
+from time import sleep as _sleep
+from time import time as _time
+
+
+def _big_answer(size):
+    answer = 'x'*size
+
+    def read():
+        return answer
+    return read
+
+
+def _connect(transport, port, path):
+    if transport == 'tcp':
+        client = _socket.create_connection(('127.0.0.1', port))
+        client.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+    else:
+        client = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        client.connect(path)
+    return client
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('', "--port", type="int", default=5040,
+                      help="Port where the scpi object listens")
+    parser.add_option('', "--samples", type="int", default=10000,
+                      help="Number of round trips per transport")
+    parser.add_option('', "--block-size", dest="block_size", type="int",
+                      default=4*1024*1024, help="Bytes of the block answer")
+    (options, args) = parser.parse_args()
+    path = _os.path.join(_tempfile.mkdtemp(), 'scpi.sock')
+    _print_header("Round trip and throughput: unix domain socket vs tcp")
+    with scpi(local=True, port=options.port, unix_socket=path,
+              socket_options='low-latency') as scpi_obj:
+        scpi_obj.add_command('SMALl', read_cb=lambda: 1)
+        scpi_obj.add_command('BLOCk', read_cb=_big_answer(options.block_size))
+        _sleep(0.5)
+        for transport in ['tcp', 'unix']:
+            client = _connect(transport, options.port, path)
+            small = round_trips(client, b'SMAL?\n', options.samples)
+            n_blocks = max(options.samples//100, 10)
+            t_0 = _time()
+            block = round_trips(client, b'BLOC?\n', n_blocks)
+            elapsed = _time()-t_0
+            client.close()
+            print_summary("{0} query".format(transport), small)
+            print_summary("{0} block".format(transport), block)
+            print("{0:20} {1:9.1f} MB/s".format(
+                "{0} throughput".format(transport),
+                n_blocks*options.block_size/elapsed/1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+from bench_suite import compare, run
+
+
+def test_filtered_run():
+    results = run(['get_id', 'split_params/query'], repeats=1, scale=0.01,
+                  tcp=False)
+    assert sorted(results['results']) == ['get_id', 'split_params/query']
+    assert results['results']['get_id']['ns'] > 0
+    assert results['meta']['repeats'] == 1
+
+
+def test_compare_with_baseline():
+    baseline = {'meta': {}, 'results': {'a': {'ns': 100.0},
+                                        'b': {'ns': 100.0},
+                                        'c': {'ns': 100.0}}}
+    current = {'meta': {}, 'results': {'a': {'ns': 105.0},
+                                       'b': {'ns': 150.0},
+                                       'c': {'ns': 50.0},
+                                       'd': {'ns': 10.0}}}
+    verdicts = dict((row[0], row[4]) for row in compare(current, baseline))
+    assert verdicts == {'a': 'ok', 'b': 'REGRESSION', 'c': 'faster',
+                        'd': 'new'}
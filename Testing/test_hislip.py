@@ -0,0 +1,136 @@
+import socket
+import struct
+from time import sleep
+
+from scpilib.hislip import (HiSLIPListener, HEADER, INITIALIZE,
+                            INITIALIZE_RESPONSE, ASYNC_INITIALIZE,
+                            ASYNC_INITIALIZE_RESPONSE, DATA_END,
+                            ASYNC_MAXIMUM_MESSAGE_SIZE,
+                            ASYNC_MAXIMUM_MESSAGE_SIZE_RESPONSE,
+                            ASYNC_LOCK, ASYNC_LOCK_RESPONSE,
+                            ASYNC_STATUS_QUERY, ASYNC_STATUS_RESPONSE, ERROR,
+                            header)
+
+
+class HiSLIPClient(object):
+    """
+        Minimal HiSLIP client: one synchronous and one asynchronous channel.
+    """
+    def __init__(self, port, overlap=True):
+        self.sync_channel = socket.create_connection(('127.0.0.1', port), 2)
+        self.sync_channel.sendall(header(INITIALIZE, int(overlap),
+                                 (0x0100 << 16) | 0x5059, b'hislip0'))
+        message_type, control, parameter, _ = self.receive(self.sync_channel)
+        assert message_type == INITIALIZE_RESPONSE
+        self.overlap = bool(control)
+        self.session_id = parameter & 0xFFFF
+        self.async_channel = socket.create_connection(('127.0.0.1', port), 2)
+        self.async_channel.sendall(header(ASYNC_INITIALIZE,
+                                  parameter=self.session_id))
+        assert self.receive(self.async_channel)[0] == ASYNC_INITIALIZE_RESPONSE
+        self.message_id = 0xFFFFFF00
+
+    def _recv(self, sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            assert chunk, "connection closed"
+            data += chunk
+        return data
+
+    def receive(self, sock):
+        prologue, message_type, control, parameter, length = \
+            HEADER.unpack(self._recv(sock, HEADER.size))
+        assert prologue == b'HS'
+        return message_type, control, parameter, self._recv(sock, length)
+
+    def write(self, data):
+        self.sync_channel.sendall(header(DATA_END, parameter=self.message_id,
+                                 payload=data + b'\n'))
+        self.message_id = (self.message_id + 2) & 0xFFFFFFFF
+
+    def query(self, data):
+        message_id = self.message_id
+        self.write(data)
+        message_type, _, parameter, payload = self.receive(self.sync_channel)
+        assert message_type == DATA_END and parameter == message_id
+        return payload
+
+    def close(self):
+        self.async_channel.close()
+        self.sync_channel.close()
+
+
+def test_hislip_session():
+    received = []
+
+    def callback(line):
+        received.append(line)
+        if line.endswith(b'?'):
+            return b'#15\r\n\x00\x01\r\n'
+        return b'ACK\r\n'
+
+    listener = HiSLIPListener(callback=callback, port=5670, ipv6=False,
+                              max_message_size=1024)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = HiSLIPClient(5670)
+        assert client.overlap
+        assert listener.sessions == 1
+        client.async_channel.sendall(header(ASYNC_MAXIMUM_MESSAGE_SIZE,
+                                    payload=struct.pack('!Q', 4096)))
+        message_type, _, _, payload = client.receive(client.async_channel)
+        assert message_type == ASYNC_MAXIMUM_MESSAGE_SIZE_RESPONSE
+        assert struct.unpack('!Q', payload)[0] == 1024
+        client.write(b'SOUR:CURR 1')
+        # the binary block answer is not scanned for terminators
+        assert client.query(b'DATA?') == b'#15\r\n\x00\x01\n'
+        assert received == [b'SOUR:CURR 1', b'DATA?']
+        # out of band requests while the synchronous channel is idle
+        client.async_channel.sendall(header(ASYNC_STATUS_QUERY))
+        assert client.receive(client.async_channel)[0] == \
+            ASYNC_STATUS_RESPONSE
+        client.async_channel.sendall(header(ASYNC_LOCK, 1, 1000, b''))
+        assert client.receive(client.async_channel)[:2] == \
+            (ASYNC_LOCK_RESPONSE, 1)
+        other = HiSLIPClient(5670)
+        other.async_channel.sendall(header(ASYNC_LOCK, 1, 0, b''))
+        assert other.receive(other.async_channel)[:2] == \
+            (ASYNC_LOCK_RESPONSE, 0)
+        # the lock is exclusive: the other session is not executed
+        other.write(b'SOUR:CURR 2')
+        assert other.query(b'DATA?') == b'NotAllow\n'
+        assert received == [b'SOUR:CURR 1', b'DATA?']
+        client.async_channel.sendall(header(ASYNC_LOCK, 0, 0, b''))
+        assert client.receive(client.async_channel)[:2] == \
+            (ASYNC_LOCK_RESPONSE, 1)
+        assert other.query(b'DATA?') == b'#15\r\n\x00\x01\n'
+        del received[-1]
+        other.close()
+        # a too large message is rejected without breaking the framing
+        client.write(b'X' * 2048)
+        assert client.receive(client.sync_channel)[0] == ERROR
+        assert client.query(b'DATA?') == b'#15\r\n\x00\x01\n'
+        client.close()
+    finally:
+        listener.close()
+    assert listener.sessions == 0
+
+
+def test_hislip_session_ids():
+    listener = HiSLIPListener(callback=lambda line: b'ACK\r\n', port=5673,
+                              ipv6=False)
+    listener.listen()
+    sleep(0.1)
+    try:
+        first = HiSLIPClient(5673)
+        # the identifiers wrap around at 16 bits, to the one in use
+        listener._session_counter = iter([first.session_id + 0x10000,
+                                          first.session_id + 1])
+        second = HiSLIPClient(5673)
+        assert second.session_id == first.session_id + 1
+        first.close()
+        second.close()
+    finally:
+        listener.close()
@@ -0,0 +1,72 @@
+import socket
+import threading
+from time import sleep, time
+
+from scpilib.hooks import ConnectionHooks, OVERFLOW_DROP, OVERFLOW_BLOCK
+from scpilib.tcpListener import TcpListener
+
+
+def test_async_hooks_do_not_delay_the_answer():
+    released = threading.Event()
+    seen = []
+    listener = TcpListener(callback=lambda line: line + b'\r\n', port=5690,
+                           ipv6=False)
+    listener.add_connection_hook(lambda name, data: released.wait(2))
+    listener.add_connection_hook(lambda name, data: seen.append(data),
+                                 sync=True)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = socket.create_connection(('127.0.0.1', 5690), timeout=2)
+        t_0 = time()
+        client.sendall(b'VALU?\n')
+        assert client.recv(64) == b'VALU?\r\n'
+        assert time() - t_0 < 0.5
+        assert seen == [b'VALU?\n']
+        released.set()
+        client.close()
+    finally:
+        listener.close()
+    statistics = listener.hook_statistics()
+    # the end of the connection is also given to the hooks
+    assert seen == [b'VALU?\n', b'']
+    assert statistics['sync']['calls'] == 2
+    assert statistics['async']['calls'] == 2
+    assert statistics['async']['max_latency'] > 0
+
+
+def test_hooks_overflow():
+    released = threading.Event()
+    hooks = ConnectionHooks(queue_size=2, overflow=OVERFLOW_DROP)
+    hooks.add(lambda name, data: released.wait(2))
+    for i in range(10):
+        hooks('client', b'data')
+    # one taken by the consumer, two in the queue and the rest dropped
+    assert hooks.statistics()['async']['dropped'] >= 7
+    released.set()
+    hooks.close()
+    calls = []
+    hooks = ConnectionHooks(queue_size=1, overflow=OVERFLOW_BLOCK)
+    hooks.add(lambda name, data: calls.append(data))
+    for i in range(10):
+        hooks('client', i)
+    hooks.close()
+    assert calls == list(range(10))
+    assert hooks.statistics()['async']['dropped'] == 0
+
+
+def test_close_with_a_stuck_hook():
+    released = threading.Event()
+    for overflow in [OVERFLOW_DROP, OVERFLOW_BLOCK]:
+        hooks = ConnectionHooks(queue_size=1, overflow=overflow)
+        hooks.add(lambda name, data: released.wait(5))
+        hooks('client', b'taken by the consumer')
+        sleep(0.05)
+        hooks('client', b'fills the queue')
+        t_0 = time()
+        hooks.close()
+        # what comes after the close is dropped, not waiting for room
+        hooks('client', b'after the close')
+        assert time() - t_0 < 1.5
+        assert hooks.statistics()['async']['dropped'] == 1
+    released.set()
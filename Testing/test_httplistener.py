@@ -0,0 +1,89 @@
+import gzip
+import io
+import json
+import numpy
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+from scpilib import scpi
+from scpilib.httpListener import HttpListener
+
+
+def test_http_gateway():
+    scpi_obj = scpi(local=True, port=None, http_port=5680)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    scpi_obj.add_command('TEXT', read_cb=lambda: 'a;b')
+    scpi_obj.add_command('ARRay', read_cb=lambda: numpy.arange(1000.))
+    scpi_obj.open()
+    try:
+        # all the requests reuse the same (keep-alive) connection
+        client = HTTPConnection('127.0.0.1', 5680, timeout=2)
+        client.request('GET', '/scpi?cmd=VALU?')
+        response = client.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read().decode()) == \
+            {'answer': '1', 'answers': ['1']}
+        client.request('POST', '/scpi', body=json.dumps(['VALU?', 'VALU?']),
+                       headers={'Content-Type': 'application/json'})
+        response = client.getresponse()
+        assert json.loads(response.read().decode()) == \
+            {'answer': '1;1', 'answers': ['1', '1']}
+        # an answer with a ';' inside cannot be split by command
+        client.request('GET', '/scpi?cmd=TEXT?&cmd=VALU?')
+        response = client.getresponse()
+        assert response.status == 502
+        assert json.loads(response.read().decode())['answer'] == 'a;b;1'
+        client.request('GET', '/scpi?cmd=ARRA?',
+                       headers={'Accept-Encoding': 'gzip'})
+        response = client.getresponse()
+        assert response.getheader('Content-Encoding') == 'gzip'
+        body = gzip.GzipFile(fileobj=io.BytesIO(response.read())).read()
+        answer = json.loads(body.decode())['answer']
+        assert len(answer.split(',')) == 1000
+        client.request('POST', '/scpi', body='not json')
+        response = client.getresponse()
+        assert response.status == 400
+        response.read()
+        client.close()
+    finally:
+        scpi_obj.close()
+
+
+def test_http_binary_array():
+    scpi_obj = scpi(local=True, port=None, http_port=5684)
+    scpi_obj.add_command('ARRay', read_cb=lambda: numpy.arange(100.))
+    scpi_obj.open()
+    try:
+        assert scpi_obj.input('DataFormat DOUBLE') == 'ACK\r\n'
+        expected = scpi_obj.input('ARRA?').rstrip('\r\n')
+        client = HTTPConnection('127.0.0.1', 5684, timeout=2)
+        client.request('GET', '/scpi?cmd=ARRA?')
+        response = client.getresponse()
+        assert response.status == 200
+        answer = json.loads(response.read().decode())['answer']
+        assert answer.encode('latin-1') == \
+            (expected if isinstance(expected, bytes)
+             else expected.encode('latin-1'))
+        client.close()
+    finally:
+        scpi_obj.close()
+
+
+def test_http_failure_is_a_reply():
+    def callback(line):
+        raise ValueError("failing callback")
+
+    listener = HttpListener(callback=callback, port=5685)
+    listener.listen()
+    try:
+        client = HTTPConnection('127.0.0.1', 5685, timeout=2)
+        client.request('GET', '/scpi?cmd=VALU?')
+        response = client.getresponse()
+        assert response.status == 500
+        assert 'failing callback' in \
+            json.loads(response.read().decode())['error']
+        client.close()
+    finally:
+        listener.close()
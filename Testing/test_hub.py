@@ -0,0 +1,103 @@
+import socket
+import threading
+from time import sleep, time
+
+from scpilib import scpi
+from scpilib.hub import ServiceHub
+
+
+def _query(port, query):
+    client = socket.create_connection(('127.0.0.1', port), timeout=2)
+    client.sendall(query)
+    answer = b''
+    while not answer.endswith(b'\n'):
+        answer += client.recv(1024)
+    client.close()
+    return answer
+
+
+def test_many_instruments_in_one_hub():
+    hub = ServiceHub()
+    hub.listen()
+    threads = threading.active_count()
+    instruments = []
+    try:
+        for i in range(8):
+            # 8 instruments in their own port and 8 in a shared one
+            for port, prefix in [(5700+i, None), (5710, 'PSU{0}'.format(i))]:
+                instrument = scpi(port=port, hub=hub, hub_prefix=prefix)
+                instrument.add_command('VALue', read_cb=lambda i=i: i)
+                instrument.open()
+                instruments.append(instrument)
+        assert hub.instruments == 16
+        sleep(0.1)
+        for i in range(8):
+            assert _query(5700+i, b'VALU?\n') == '{0}\r\n'.format(i).encode()
+            assert _query(5710, 'PSU{0}:VALU?\n'.format(i).encode()) == \
+                '{0}\r\n'.format(i).encode()
+        assert _query(5710, b'PSU9:VALU?\n') == b'NOK\r\n'
+        assert threading.active_count() == threads
+        instruments[0].close()
+        assert hub.instruments == 15
+        sleep(0.1)
+        try:
+            _query(5700, b'VALU?\n')
+            assert False, "the port should be closed"
+        except socket.error:
+            pass
+    finally:
+        for instrument in instruments:
+            instrument.close()
+        hub.close()
+    assert not hub.is_alive()
+
+
+def test_hub_stops_reading_a_client_that_does_not_read():
+    hub = ServiceHub(output_buffer=256*1024)
+    hub.listen()
+    instrument = scpi(port=5720, hub=hub)
+    instrument.add_command('BLOCk', read_cb=lambda: 'x'*100000)
+    instrument.open()
+    try:
+        sleep(0.1)
+        client = socket.create_connection(('127.0.0.1', 5720), timeout=2)
+        client.sendall(b'BLOCk?\n'*200)
+        sleep(0.3)
+        pending = [len(connection.pending)
+                   for connection in list(hub._connections.values())]
+        # bounded by the mark plus the answer that crossed it
+        assert len(pending) == 1 and pending[0] <= 256*1024 + 100002
+        received = 0
+        while received < 200*100002:
+            received += len(client.recv(1024*1024))
+        assert received == 200*100002
+        client.close()
+    finally:
+        instrument.close()
+        hub.close()
+
+
+def test_hub_does_not_wait_for_a_throttled_client():
+    hub = ServiceHub()
+    hub.listen()
+    instrument = scpi(port=5721, hub=hub, rate_limit=(4, 1))
+    instrument.add_command('VALue', read_cb=lambda: 1)
+    instrument.open()
+    try:
+        sleep(0.1)
+        client = socket.create_connection(('127.0.0.1', 5721), timeout=2)
+        client.sendall(b'VALU?\n'*4)
+        sleep(0.1)
+        t_0 = time()
+        assert _query(5721, b'VALU?\n') == b'1\r\n'
+        # the throttled lines are given again later, not waited in the loop
+        assert time() - t_0 < 0.1
+        answer = b''
+        while answer.count(b'\n') < 4:
+            answer += client.recv(1024)
+        assert answer == b'1\r\n'*4
+        assert time() - t_0 >= 0.5
+        client.close()
+    finally:
+        instrument.close()
+        hub.close()
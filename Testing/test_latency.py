@@ -0,0 +1,36 @@
+import random
+
+from numpy import array, percentile
+
+from scpilib.latency import StreamingStatistics, perf_counter_ns
+
+
+def test_streaming_statistics():
+    random.seed(0)
+    values = [int(random.lognormvariate(11, 1)) for i in range(20000)]
+    stats = StreamingStatistics()
+    for value in values:
+        stats.add(value)
+    reference = array(values)
+    assert len(stats) == len(values)
+    assert stats.min == reference.min()
+    assert stats.max == reference.max()
+    assert abs(stats.mean - reference.mean()) < 1e-6 * reference.mean()
+    assert abs(stats.std - reference.std()) < 1e-6 * reference.std()
+    for fraction in (0.5, 0.99, 0.999):
+        expected = percentile(reference, fraction * 100)
+        assert abs(stats.percentile(fraction) - expected) < 0.07 * expected
+    summary = stats.summary(scale=1e-9)
+    assert summary['count'] == len(values)
+    assert summary['p50'] <= summary['p99'] <= summary['p999']
+    stats.reset()
+    assert stats.summary() == {'count': 0}
+
+
+def test_small_values_and_clock():
+    stats = StreamingStatistics()
+    for value in range(8):
+        stats.add(value)
+    assert stats.percentile(0.5) == 3
+    t_0 = perf_counter_ns()
+    assert perf_counter_ns() >= t_0
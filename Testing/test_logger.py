@@ -0,0 +1,106 @@
+import logging
+import threading
+
+from scpilib.logger import Logger, logger_INFO, logger_WARNING
+from scpilib.logger import timeit, deprecated, timeit_collection
+from scpilib.logger import deprecation_collection, scpi_timeit_collection
+
+
+class _Unformattable(object):
+    def __format__(self, spec):
+        raise AssertionError("formatted when the level is disabled")
+
+
+class _Collector(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_format_only_when_emitted():
+    logger = Logger(name="test", logger_name="SCPI-test")
+    collector = _Collector()
+    logger.add_handler(collector)
+    try:
+        logger.log_level = logger_WARNING
+        logger._info("{0}", _Unformattable())
+        assert collector.messages == []
+        logger.log_level = logger_INFO
+        logger._info("received {0!r}", b'x'*100000)
+        assert len(collector.messages) == 1
+        assert len(collector.messages[0]) < 300
+        assert b'...' in collector.messages[0].encode()
+    finally:
+        logger.remove_handler(collector)
+
+
+def test_log_queue():
+    logger = Logger(name="test", logger_name="SCPI-queue")
+    collector = _Collector()
+    logger.add_handler(collector)
+    logger.enable_log_queue(size=10)
+    try:
+        assert logger.logger_obj.handlers[0] is not collector
+        for i in range(5):
+            logger._warning("message {0}", i)
+        logger.flush_log_queue()
+        assert len(collector.messages) == 5
+        assert logger.log_queue_dropped == 0
+    finally:
+        logger.disable_log_queue()
+    assert collector in logger.logger_obj.handlers
+    logger.remove_handler(collector)
+
+
+def test_log_queue_drops():
+    release = threading.Event()
+
+    class _Blocking(logging.Handler):
+        def emit(self, record):
+            release.wait(2)
+
+    logger = Logger(name="test", logger_name="SCPI-drops")
+    blocking = _Blocking()
+    logger.add_handler(blocking)
+    logger.enable_log_queue(size=2)
+    try:
+        for i in range(10):
+            logger._warning("message {0}", i)
+        # one being written, two in the queue
+        assert logger.log_queue_dropped >= 7
+        release.set()
+    finally:
+        logger.disable_log_queue()
+        logger.remove_handler(blocking)
+
+
+class _Instrumented(object):
+    def __init__(self):
+        self._value = 0
+
+    @timeit
+    def measured(self):
+        return 1
+
+    @deprecated
+    @property
+    def oldValue(self):
+        return self._value
+
+
+def test_instrumentation_swapped():
+    original = _Instrumented.__dict__['measured']
+    assert original.__code__ is _Instrumented.measured.__code__
+    scpi_timeit_collection(True)
+    try:
+        assert _Instrumented.__dict__['measured'] is not original
+        assert _Instrumented().measured() == 1
+        assert len(timeit_collection['_Instrumented']['measured']) == 1
+    finally:
+        scpi_timeit_collection(False)
+    assert _Instrumented.__dict__['measured'] is original
+    assert _Instrumented().oldValue == 0
+    assert deprecation_collection['_Instrumented']['oldValue'] == 1
@@ -0,0 +1,107 @@
+import socket
+from time import sleep
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+from scpilib import scpi
+from scpilib.metrics import MetricsRegistry, command_label, answer_error
+
+
+def test_registry_render():
+    registry = MetricsRegistry()
+    registry.observe_command('SOURce:CURRent?', '1.0', 0.0002)
+    registry.observe_command('SOUR:CURR?', float('NaN'), 0.002)
+    registry.observe_command('SOURce:CURRent 2', 'NOK', 0.0001)
+    registry.add_gauge('scpi_active_connections', "Connections.",
+                       lambda: 3, listener='test')
+    text = registry.render()
+    assert 'scpi_commands_total{command="SOUR:CURR?"} 2' in text
+    assert 'scpi_commands_total{command="SOUR:CURR"} 1' in text
+    assert 'scpi_command_errors_total{command="SOUR:CURR?",error="NaN"} 1' \
+        in text
+    assert 'scpi_command_duration_seconds_bucket{command="SOUR:CURR?",' \
+           'le="0.00025"} 1' in text
+    assert 'scpi_command_duration_seconds_bucket{command="SOUR:CURR?",' \
+           'le="+Inf"} 2' in text
+    assert 'scpi_active_connections{listener="test"} 3' in text
+    registry.remove_gauges(listener='test')
+    assert 'scpi_active_connections' not in registry.render()
+    assert command_label('*IDN?') == '*IDN?'
+    assert answer_error('NotAllow') == 'NotAllow'
+    assert answer_error('1.0') is None
+
+
+def test_metrics_endpoint():
+    scpi_obj = scpi(local=True, port=5681, metrics_port=9181)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    scpi_obj.open()
+    sleep(0.1)
+    try:
+        client = socket.create_connection(('127.0.0.1', 5681), timeout=2)
+        client.sendall(b'VALU?;FOO?\n')
+        assert client.recv(64) == b'1;NOK\r\n'
+        connection = HTTPConnection('127.0.0.1', 9181, timeout=2)
+        connection.request('GET', '/metrics')
+        response = connection.getresponse()
+        assert response.status == 200
+        text = response.read().decode()
+        connection.close()
+        client.close()
+        assert 'scpi_commands_total{command="VALU?"} 1' in text
+        assert 'scpi_command_errors_total{command="FOO?",error="NOK"} 1' \
+            in text
+        assert 'scpi_attribute_duration_seconds_count{operation="read"} 1' \
+            in text
+        assert 'scpi_received_bytes_total{listener="TcpListener"} 11' in text
+        assert 'scpi_sent_bytes_total{listener="TcpListener"} 7' in text
+        assert 'scpi_active_connections{listener="TcpListener"} 1' in text
+        assert 'scpi_buffered_bytes{listener="TcpListener"} 0' in text
+    finally:
+        scpi_obj.close()
+
+
+def test_statistics_subtree():
+    scpi_obj = scpi(local=True, port=None, metrics=True)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    for i in range(10):
+        assert scpi_obj.input('VALU?') == '1\r\n'
+    assert scpi_obj.input('FOO?') == 'NOK\r\n'
+    assert scpi_obj.input('SYSTem:STATistics:COMMands?') == '11\r\n'
+    assert scpi_obj.input('SYST:STAT:ERRO?') == '1\r\n'
+    assert float(scpi_obj.input('SYST:STAT:RATE?')) > 0
+    latencies = scpi_obj.input('SYST:STAT:LATE?').strip().split(',')
+    assert 'VALU?' in latencies
+    position = latencies.index('VALU?')
+    assert 0 < float(latencies[position+1]) <= float(latencies[position+2])
+    assert scpi_obj.input('SYST:STAT:CONN?;SYST:STAT:REJE?') == '0;0\r\n'
+    assert scpi_obj.input('SYST:STAT:BUFF?') == '0\r\n'
+    assert scpi_obj.input('SYST:STAT:RESE') == 'ACK\r\n'
+    # the reset itself is accounted after it
+    assert scpi_obj.input('SYST:STAT:COMM?') == '1\r\n'
+
+
+def test_rejected_survive_the_rebuild_of_the_listeners():
+    scpi_obj = scpi(local=True, port=5683, metrics=True, max_clients=1)
+    scpi_obj.open()
+    try:
+        kept = socket.create_connection(('127.0.0.1', 5683), timeout=1)
+        sleep(0.1)
+        refused = socket.create_connection(('127.0.0.1', 5683), timeout=1)
+        refused.recv(1024)
+        refused.close()
+        kept.close()
+        assert scpi_obj.input('SYST:STAT:REJE?') == '1\r\n'
+        # the new listener starts its own counter from zero
+        scpi_obj.close()
+        scpi_obj.open()
+        assert scpi_obj.input('SYST:STAT:REJE?') == '1\r\n'
+        assert scpi_obj.input('SYST:STAT:RESE') == 'ACK\r\n'
+        scpi_obj.close()
+        scpi_obj.open()
+        assert scpi_obj.input('SYST:STAT:REJE?') == '0\r\n'
+        assert 'scpi_rejected_connections_total' in \
+            scpi_obj.metrics.render()
+    finally:
+        scpi_obj.close()
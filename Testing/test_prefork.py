@@ -0,0 +1,76 @@
+import os
+import socket
+from time import sleep, time
+
+from scpilib import scpi
+from scpilib.prefork import is_read_only
+
+
+def test_read_only_classification():
+    assert is_read_only('SOUR:CURR?;SOUR:VOLT? 1,2')
+    assert not is_read_only('SOUR:CURR 1')
+    assert not is_read_only('SOUR:CURR?;SOUR:VOLT 1')
+    assert not is_read_only('*RST')
+    assert not is_read_only('*IDN?')
+    assert not is_read_only('SYST:LOCK:REQ?')
+    assert not is_read_only('SOUR:CURR?;:VOLT?')
+
+
+def _client(port):
+    deadline = time() + 2
+    while True:
+        try:
+            return socket.create_connection(('127.0.0.1', port), timeout=2)
+        except socket.error:
+            if time() > deadline:
+                raise
+            sleep(0.01)
+
+
+def _ask(client, query):
+    client.sendall(query)
+    return client.recv(1024)
+
+
+def test_prefork_routing():
+    authority = os.getpid()
+    scpi_obj = scpi(local=True, port=5680, workers=2)
+    scpi_obj.add_command('PID', read_cb=os.getpid, write_cb=lambda v: None)
+    scpi_obj.open()
+    try:
+        first = _client(5680)
+        second = _client(5680)
+        read = int(_ask(first, b'PID?\n'))
+        assert read != authority
+        assert _ask(first, b'PID 1\n') == b'ACK\r\n'
+        assert _ask(first, b'SYST:LOCK:REQU?\n') == b'True\r\n'
+        # with the lock taken, the requests go to the authoritative process
+        assert _ask(second, b'PID?\n') == b'NotAllow\r\n'
+        assert int(_ask(first, b'PID?\n')) == authority
+        assert _ask(first, b'SYST:LOCK:RELE?\n') == b'True\r\n'
+        assert int(_ask(second, b'PID?\n')) != authority
+        assert _ask(first, b'DATA DOUBLE\n') == b'ACK\r\n'
+        assert _ask(second, b'DATA?\n') == b'DOUBLE\r\n'
+        first.close()
+        second.close()
+    finally:
+        scpi_obj.close()
+
+
+def test_prefork_release_on_disconnect():
+    authority = os.getpid()
+    scpi_obj = scpi(local=True, port=5682, workers=2)
+    scpi_obj.add_command('PID', read_cb=os.getpid)
+    scpi_obj.open()
+    try:
+        first = _client(5682)
+        second = _client(5682)
+        assert _ask(first, b'SYST:LOCK:REQU?\n') == b'True\r\n'
+        assert _ask(second, b'PID?\n') == b'NotAllow\r\n'
+        # the owner goes away without releasing the lock
+        first.close()
+        sleep(0.2)
+        assert int(_ask(second, b'PID?\n')) != authority
+        second.close()
+    finally:
+        scpi_obj.close()
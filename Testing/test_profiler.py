@@ -0,0 +1,91 @@
+import os
+import pstats
+import tempfile
+import threading
+from time import sleep
+
+from scpilib import scpi
+
+
+def _busy():
+    return sum(range(1000))
+
+
+def test_cprofile():
+    directory = tempfile.mkdtemp()
+    scpi_obj = scpi(local=True, port=None, profiling=True,
+                    profile_directory=directory)
+    scpi_obj.add_command('BUSY', read_cb=_busy)
+    assert scpi_obj.input('SYST:PROF:STAT?') == 'OFF\r\n'
+    assert scpi_obj.input('SYST:PROF:STAR cprofile') == 'ACK\r\n'
+    assert scpi_obj.input('SYST:PROF:STAT?') == 'CPROFILE\r\n'
+    for i in range(10):
+        scpi_obj.input('BUSY?')
+    path = scpi_obj.input('SYST:PROF:STOP? ../busy.pstats').strip()
+    assert path == os.path.join(directory, 'busy.pstats')
+    stats = pstats.Stats(path)
+    assert any([function == '_busy' and calls[0] == 10
+                for (filename, line, function), calls
+                in stats.stats.items()])
+    assert scpi_obj.input('SYST:PROF:STOP?') == 'NOK\r\n'
+
+
+def test_sampling():
+    scpi_obj = scpi(local=True, port=None)
+    scpi_obj.profile_start('sampling', interval=0.001)
+    sleep(0.1)
+    path = scpi_obj.profile_stop(os.path.join(tempfile.mkdtemp(), 'folded'))
+    with open(path) as collapsed:
+        lines = collapsed.readlines()
+    assert len(lines) > 0
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any(['MainThread;' in line for line in lines])
+
+
+def test_stop_waits_for_the_commands_being_profiled():
+    entered, released = threading.Event(), threading.Event()
+
+    def _slow():
+        entered.set()
+        released.wait(2)
+        return _busy()
+
+    scpi_obj = scpi(local=True, port=None)
+    scpi_obj.add_command('SLOW', read_cb=_slow)
+    scpi_obj.profile_start('cprofile')
+    command = threading.Thread(target=scpi_obj.input, args=('SLOW?',))
+    command.start()
+    assert entered.wait(2)
+    paths = []
+    stopper = threading.Thread(target=lambda: paths.append(
+        scpi_obj.profile_stop(os.path.join(tempfile.mkdtemp(), 'slow'))))
+    stopper.start()
+    sleep(0.1)
+    assert stopper.is_alive()
+    released.set()
+    stopper.join(2)
+    command.join(2)
+    stats = pstats.Stats(paths[0])
+    assert any([function == '_slow' and calls[0] == 1
+                for (filename, line, function), calls
+                in stats.stats.items()])
+
+
+def test_concurrent_starts():
+    scpi_obj = scpi(local=True, port=None)
+    errors = []
+
+    def _start():
+        try:
+            scpi_obj.profile_start('sampling', interval=0.01)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=_start) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    assert len(errors) == 7
+    scpi_obj.profile_stop(os.path.join(tempfile.mkdtemp(), 'folded'))
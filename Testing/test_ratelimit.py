@@ -0,0 +1,59 @@
+import threading
+from time import sleep, time
+
+from scpilib import scpi
+from scpilib.ratelimit import (TokenBucket, RateLimiter, subtree_key,
+                               RATE_LIMIT_REJECT)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(10, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 0.1
+    sleep(0.1)
+    assert bucket.take() == 0
+
+
+def test_subtree_limits():
+    assert subtree_key(':SOURce:CURRent? 1') == ('SOUR', 'CURR')
+    limiter = RateLimiter(subtrees={'*IDN': (1, 1)}, policy=RATE_LIMIT_REJECT)
+    assert limiter.acquire('client', '*IDN?')
+    assert not limiter.acquire('client', '*IDN?')
+    assert limiter.acquire('other', '*IDN?')
+    assert limiter.acquire('client', 'SOUR:CURR?')
+    counters = limiter.statistics()['client']
+    assert counters['commands'] == 3 and counters['rejected'] == 1
+
+
+def test_scpi_rate_limit():
+    scpi_obj = scpi(port=None, rate_limit=(20, 1))
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    t_0 = time()
+    for i in range(5):
+        assert scpi_obj.input('VALU?') == '1\r\n'
+    assert time() - t_0 >= 0.15
+    counters = scpi_obj.rate_limit_statistics()
+    assert counters[threading.current_thread().name]['throttled'] == 4
+
+
+def test_throttled_client_does_not_hold_the_dispatcher():
+    scpi_obj = scpi(port=None, rate_limit=(4, 1), dispatch_workers=1)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+
+    def throttled():
+        for i in range(4):
+            scpi_obj.input('VALU?')
+
+    client = threading.Thread(name='throttled', target=throttled)
+    try:
+        client.start()
+        sleep(0.1)
+        t_0 = time()
+        assert scpi_obj.input('VALU?') == '1\r\n'
+        # the throttled client waits in its own thread, not in the worker
+        assert time() - t_0 < 0.1
+        client.join()
+        assert scpi_obj.rate_limit_statistics()['throttled']['throttled'] == 3
+    finally:
+        scpi_obj.close()
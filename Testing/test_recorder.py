@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from scpilib import scpi
+from scpilib.recorder import CommandRecorder, read_records
+from scpilib.recorder import HEADER_SIZE, RECORD
+
+
+def test_ring_buffer_wraps():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.trace')
+    recorder = CommandRecorder(path, capacity=4)
+    for i in range(6):
+        recorder.record('127.0.0.1:5000', 'VALU{0}?'.format(i), '1', 1000+i)
+    recorder.record('127.0.0.1:5000', 'FOO?', 'NOK', 2000)
+    recorder.record('127.0.0.1:5000', 'X'*200, float('NaN'), 3000)
+    recorder.close()
+    records = read_records(path)
+    assert [record['command'][:5] for record in records] == \
+        ['VALU4', 'VALU5', 'FOO?', 'X'*5]
+    assert records[0]['latency'] == 1004
+    assert records[0]['answer_size'] == 1
+    assert records[2]['status'] == 'NOK'
+    assert records[3]['status'] == 'NaN'
+    assert records[3]['truncated']
+
+
+def test_scpi_trace_and_decoder():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.trace')
+    with scpi(local=True, port=None, trace_path=path) as scpi_obj:
+        scpi_obj.add_command('VALue', read_cb=lambda: 1)
+        scpi_obj.input('VALU?;VALU?')
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'scpilib.recorder', '--format', 'json', path],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    records = json.loads(output.decode())
+    assert [record['command'] for record in records] == ['VALU?', 'VALU?']
+    assert all([record['connection'] == 'MainThread' for record in records])
+
+
+def test_existing_trace_is_continued():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.trace')
+    recorder = CommandRecorder(path, capacity=4)
+    recorder.record('127.0.0.1:5000', 'FIRS?', '1', 1000)
+    recorder.close()
+    recorder = CommandRecorder(path, capacity=4)
+    recorder.record('127.0.0.1:5000', 'SECO?', '1', 1000)
+    recorder.close()
+    records = read_records(path)
+    assert [(record['sequence'], record['command'])
+            for record in records] == [(0, 'FIRS?'), (1, 'SECO?')]
+    # another capacity is another trace: the old one is kept aside
+    recorder = CommandRecorder(path, capacity=8)
+    recorder.close()
+    assert read_records(path) == []
+    assert len(read_records(path + '.old')) == 2
+
+
+def test_records_in_the_order_of_their_slots():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.trace')
+    recorder = CommandRecorder(path, capacity=4)
+    recorder.record('127.0.0.1:5000', 'FIRS?', '1', 1000)
+    recorder.record('127.0.0.1:5000', 'SECO?', '1', 1000)
+    # as if the clock had gone backwards between both records
+    first = RECORD.unpack_from(recorder._map, HEADER_SIZE)
+    second = list(RECORD.unpack_from(recorder._map,
+                                      HEADER_SIZE + RECORD.size))
+    second[1] = first[1] - 1
+    RECORD.pack_into(recorder._map, HEADER_SIZE + RECORD.size, *second)
+    recorder.close()
+    assert [record['command'] for record in read_records(path)] == \
+        ['FIRS?', 'SECO?']
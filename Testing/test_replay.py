@@ -0,0 +1,84 @@
+import os
+import tempfile
+
+import pytest
+
+from scpilib import scpi
+from scpilib.recorder import CommandRecorder
+from scpilib.replay import Replay, load_session
+
+
+def _current_instrument(**kwargs):
+    values = {'': 0, 'LOWE': -1, 'UPPE': 1}
+
+    def reader(key):
+        return lambda: values[key]
+
+    def writer(key):
+        def write(value):
+            values[key] = int(value)
+        return write
+
+    scpi_obj = scpi(local=True, write_lock=True, **kwargs)
+    scpi_obj.add_command('SOURce:CURRent:LOWEr', read_cb=reader('LOWE'),
+                         write_cb=writer('LOWE'))
+    scpi_obj.add_command('SOURce:CURRent:UPPEr', read_cb=reader('UPPE'),
+                         write_cb=writer('UPPE'))
+    scpi_obj.add_command('SOURce:CURRent:VALue', read_cb=reader(''),
+                         default=True)
+    return scpi_obj
+
+
+def test_lock_scenario():
+    # the LockThreadedTest of scpiObj, as a captured session
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'lock_scenario.csv')
+    with _current_instrument(port=None) as scpi_obj:
+        # the answers depend on the order of both clients, not on the time
+        report = Replay(load_session(path), scpi_obj.input, rate=1,
+                        ordered=True).run()
+    assert report['clients'] == 2
+    assert report['commands'] == 12
+    assert report['failed'] == 0
+    assert report['differences'] == 0, report['examples']
+
+
+def test_ordered_replay_of_merged_connections():
+    records = [{'connection': name, 'command': 'SOUR:CURR:UPPE?',
+                'timestamp': None} for name in ('a', 'b', 'c')]
+    replay = Replay(records, lambda line: '1\r\n', rate=0, clients=2,
+                    ordered=True)
+    assert replay.run()['commands'] == 3
+    with pytest.raises(ValueError):
+        Replay(records, lambda line: '1\r\n', rate=0, clients=6,
+               ordered=True)
+
+
+def test_text_capture_over_tcp():
+    path = os.path.join(tempfile.mkdtemp(), 'session.txt')
+    with open(path, 'w') as capture:
+        capture.write("# a client reading\n"
+                      "SOUR:CURR:UPPE?\n"
+                      "SOUR:CURR:LOWE?\n"
+                      "FOO?\n")
+    with _current_instrument(port=5691):
+        report = Replay(load_session(path), ('127.0.0.1', 5691), rate=0,
+                        clients=3).run()
+    assert report['clients'] == 3
+    assert report['commands'] == 9
+    assert report['differences'] == 0
+    assert report['latency']['p50'] > 0
+
+
+def test_recorded_trace():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.trace')
+    recorder = CommandRecorder(path, capacity=8)
+    recorder.record('client', 'SOUR:CURR:UPPE?', '1', 1000)
+    recorder.record('client', 'SOUR:CURR:UPPE 5', 'NOK', 1000)
+    recorder.close()
+    with _current_instrument(port=None) as scpi_obj:
+        report = Replay(load_session(path), scpi_obj.input, rate=0).run()
+    assert report['commands'] == 2
+    # the write was refused when recorded, but now it is accepted
+    assert report['differences'] == 1
+    assert report['examples'][0]['replayed'] == 'OK'
@@ -0,0 +1,121 @@
+import threading
+from time import sleep
+
+from scpilib import scpi
+from scpilib.scheduler import (Dispatcher, PRIORITY_HIGH, PRIORITY_NORMAL,
+                               PRIORITY_LOW)
+
+
+def test_dispatcher_round_robin():
+    order = []
+    release = threading.Event()
+    dispatcher = Dispatcher(workers=1)
+
+    def job(value):
+        release.wait(2)
+        order.append(value)
+
+    threads = [threading.Thread(target=dispatcher.submit,
+                                args=('busy', job, 'busy'))]
+    # a noisy client queues many jobs before the quiet one
+    for i in range(3):
+        threads.append(threading.Thread(target=dispatcher.submit,
+                                        args=('noisy', job, 'noisy')))
+    threads.append(threading.Thread(target=dispatcher.submit,
+                                    args=('quiet', job, 'quiet')))
+    for thread in threads:
+        thread.start()
+        sleep(0.02)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    dispatcher.close()
+    assert order.index('quiet') < 3
+    assert dispatcher.saturated == 4
+
+
+def test_dispatcher_priorities():
+    order = []
+    release = threading.Event()
+    dispatcher = Dispatcher(workers=1)
+
+    def job(value):
+        release.wait(2)
+        order.append(value)
+
+    jobs = [('busy', PRIORITY_NORMAL), ('bulk', PRIORITY_LOW),
+            ('monitor', PRIORITY_NORMAL), ('owner', PRIORITY_HIGH)]
+    threads = []
+    for owner, priority in jobs:
+        threads.append(threading.Thread(
+            target=dispatcher.submit, args=(owner, job, owner),
+            kwargs={'priority': priority}))
+        threads[-1].start()
+        sleep(0.02)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    dispatcher.close()
+    assert order == ['busy', 'owner', 'monitor', 'bulk']
+    priorities = dispatcher.statistics()['priorities']
+    assert priorities['high']['samples'] == 1
+    assert priorities['low']['p50'] >= priorities['high']['p50']
+
+
+def test_dispatcher_close_with_pending_jobs():
+    release = threading.Event()
+    dispatcher = Dispatcher(workers=1)
+    results = []
+
+    def submitter(owner):
+        try:
+            results.append(dispatcher.submit(owner, release.wait, 2))
+        except RuntimeError as exc:
+            results.append(exc)
+
+    threads = [threading.Thread(target=submitter, args=(owner,))
+               for owner in ['running', 'waiting']]
+    for thread in threads:
+        thread.start()
+        sleep(0.05)
+    assert dispatcher.pending == 1
+    closer = threading.Thread(target=dispatcher.close)
+    closer.start()
+    # the one waiting in the queue doesn't wait for the close to finish
+    threads[1].join(0.5)
+    assert not threads[1].is_alive()
+    assert isinstance(results[0], RuntimeError)
+    release.set()
+    threads[0].join(2)
+    closer.join(2)
+    assert results[1] is True
+
+
+def test_dispatcher_forgets_gone_clients():
+    dispatcher = Dispatcher(workers=1)
+    try:
+        dispatcher.submit('released', int)
+        dispatcher.submit('gone', int)
+        dispatcher.release('released')
+        assert set(dispatcher.statistics()['clients']) == set(['gone'])
+        # a client without jobs for a whole period is forgotten
+        for i in range(2000):
+            dispatcher.submit('busy', int)
+        assert set(dispatcher.statistics()['clients']) == set(['busy'])
+    finally:
+        dispatcher.close()
+
+
+def test_scpi_priorities():
+    scpi_obj = scpi(port=None, dispatch_workers=1,
+                    low_priority_subtrees=['ARRay'])
+    try:
+        owner = threading.current_thread().name
+        assert scpi_obj._priority_of(owner, '*IDN?') == PRIORITY_HIGH
+        assert scpi_obj._priority_of(owner, 'SYST:LOCK:RELE') == PRIORITY_HIGH
+        assert scpi_obj._priority_of(owner, 'ARRAy?') == PRIORITY_LOW
+        assert scpi_obj._priority_of(owner, 'ARRA?;VALU?') == PRIORITY_NORMAL
+        assert scpi_obj.input('SYST:LOCK:REQU?') == 'True\r\n'
+        assert scpi_obj._priority_of(owner, 'ARRA?') == PRIORITY_HIGH
+    finally:
+        scpi_obj.__del__()
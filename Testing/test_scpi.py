@@ -0,0 +1,91 @@
+import socket
+from time import time
+
+from scpilib import scpi
+from scpilib.logger import scpi_timeit_collection, timeit_collection
+
+
+def _query(port, query, timeout=1):
+    deadline = time() + timeout
+    while True:
+        try:
+            client = socket.create_connection(('127.0.0.1', port), timeout=1)
+            break
+        except socket.error:
+            if time() > deadline:
+                raise
+    client.sendall(query)
+    answer = client.recv(1024)
+    client.close()
+    return answer
+
+
+def test_close_and_reopen_below_100ms():
+    scpi_obj = scpi(local=True, port=5670)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    scpi_obj.open()
+    try:
+        assert _query(5670, b'VALU?\n') == b'1\r\n'
+        idle = socket.create_connection(('127.0.0.1', 5670))
+        t_0 = time()
+        scpi_obj.close()
+        scpi_obj.open()
+        assert _query(5670, b'VALU?\n') == b'1\r\n'
+        assert time() - t_0 < 0.1
+        try:
+            assert idle.recv(1024) == b''
+        except socket.error:
+            pass  # reset when closed before being accepted
+        idle.close()
+    finally:
+        scpi_obj.close()
+
+
+def test_switch_remote_allowed():
+    scpi_obj = scpi(local=True, port=5671)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    scpi_obj.open()
+    try:
+        t_0 = time()
+        scpi_obj.remote_allowed = True
+        assert scpi_obj.remote_allowed
+        assert _query(5671, b'VALU?\n') == b'1\r\n'
+        scpi_obj.remote_allowed = False
+        assert not scpi_obj.remote_allowed
+        assert _query(5671, b'VALU?\n') == b'1\r\n'
+        assert time() - t_0 < 0.2
+    finally:
+        scpi_obj.close()
+
+
+def test_reaped_connection_releases_the_lock():
+    scpi_obj = scpi(local=True, port=5672, idle_timeout=0.1)
+    scpi_obj.open()
+    try:
+        client = socket.create_connection(('127.0.0.1', 5672), timeout=1)
+        client.sendall(b'SYST:LOCK:REQU?\n')
+        assert client.recv(1024) == b'True\r\n'
+        assert client.recv(1024) == b''
+        client.close()
+        assert _query(5672, b'SYST:LOCK:REQU?\n') == b'True\r\n'
+    finally:
+        scpi_obj.close()
+
+
+def test_instrumentation_reaches_the_listeners():
+    scpi_obj = scpi(local=True, port=5674)
+    scpi_obj.add_command('VALue', read_cb=lambda: 1)
+    scpi_obj.open()
+    try:
+        timeit_collection.pop('scpi', None)
+        # the listener was built with the bare input as its callback
+        scpi_timeit_collection(True)
+        try:
+            assert _query(5674, b'VALU?\n') == b'1\r\n'
+        finally:
+            scpi_timeit_collection(False)
+        assert len(timeit_collection['scpi']['input']) == 1
+        assert _query(5674, b'VALU?\n') == b'1\r\n'
+        assert len(timeit_collection['scpi']['input']) == 1
+    finally:
+        scpi_obj.close()
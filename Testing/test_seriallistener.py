@@ -0,0 +1,57 @@
+import os
+import select
+
+from scpilib.serialListener import SerialListener
+
+
+def readline(fd, timeout=2):
+    data = b''
+    while not data.endswith(b'\n'):
+        if not select.select([fd], [], [], timeout)[0]:
+            break
+        data += os.read(fd, 1024)
+    return data
+
+
+def test_serial_pty():
+    received = []
+
+    def callback(line):
+        received.append(line)
+        if line.endswith(b'?'):
+            return b'42\r\n'
+        return b'ACK\r\n'
+
+    listener = SerialListener(callback=callback)
+    listener.listen()
+    try:
+        fd = os.open(listener.slave_name, os.O_RDWR | os.O_NOCTTY)
+        # split lines and a command in two writes
+        os.write(fd, b'SOUR:CURR 1\r\nSOUR:')
+        assert readline(fd) == b'ACK\r\n'
+        os.write(fd, b'CURR?\n')
+        assert readline(fd) == b'42\r\n'
+        assert received == [b'SOUR:CURR 1', b'SOUR:CURR?']
+        os.close(fd)
+    finally:
+        listener.close()
+    assert not listener.is_alive()
+    assert not listener.is_listening()
+
+
+def test_serial_failing_command():
+    def callback(line):
+        if line == b'FAIL?':
+            raise ValueError("failing command")
+        return b'42\r\n'
+
+    listener = SerialListener(callback=callback)
+    listener.listen()
+    try:
+        fd = os.open(listener.slave_name, os.O_RDWR | os.O_NOCTTY)
+        os.write(fd, b'FAIL?\nSOUR:CURR?\n')
+        # the listener is still serving after the failure
+        assert readline(fd) == b'42\r\n'
+        os.close(fd)
+    finally:
+        listener.close()
@@ -1,6 +1,11 @@
 import pytest
+import socket
+import threading
+from time import sleep
 
-from scpilib.tcpListener import splitter
+from scpilib.tcpListener import splitter, TcpListener
+from scpilib.tcpListener import ADMISSION_REFUSE, ADMISSION_QUEUE
+from scpilib.tcpListener import ADMISSION_EVICT, resolve_socket_options
 
 
 def test_command_split():
@@ -20,3 +25,216 @@ def test_command_split():
     ]
     for inp, expected in scpi_commands:
         assert splitter(inp) == expected
+
+
+def _echo(line):
+    return line + '\r\n'
+
+
+def _connect(port):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=2)
+    return sock
+
+
+def _listener(port, **kwargs):
+    listener = TcpListener(callback=_echo, port=port, ipv6=False, **kwargs)
+    listener.listen()
+    sleep(0.1)
+    return listener
+
+
+def test_admission_refuse():
+    listener = _listener(5650, max_clients=1, admission=ADMISSION_REFUSE)
+    try:
+        first = _connect(5650)
+        first.sendall(b'first\n')
+        assert first.recv(64) == b'first\r\n'
+        second = _connect(5650)
+        assert second.recv(64) == b'NotAllow\r\n'
+        assert listener.rejected_connections == 1
+        first.close()
+        second.close()
+    finally:
+        listener.close()
+
+
+def test_admission_queue():
+    listener = _listener(5651, max_clients=1, admission=ADMISSION_QUEUE,
+                         queue_size=1)
+    try:
+        first = _connect(5651)
+        first.sendall(b'first\n')
+        assert first.recv(64) == b'first\r\n'
+        second = _connect(5651)
+        second.sendall(b'second\n')
+        sleep(0.1)
+        assert listener.waiting_connections == 1
+        assert listener.queued_connections == 1
+        third = _connect(5651)
+        assert third.recv(64) == b'NotAllow\r\n'
+        first.close()
+        assert second.recv(64) == b'second\r\n'
+        assert listener.waiting_connections == 0
+        second.close()
+        third.close()
+    finally:
+        listener.close()
+
+
+def test_admission_evict():
+    released = []
+    listener = _listener(5652, max_clients=1, admission=ADMISSION_EVICT,
+                         release_cb=released.append)
+    try:
+        first = _connect(5652)
+        first.sendall(b'first\n')
+        assert first.recv(64) == b'first\r\n'
+        name = '127.0.0.1:{0}'.format(first.getsockname()[1])
+        # until it is done with the answer it is not idle
+        sleep(0.05)
+        second = _connect(5652)
+        second.sendall(b'second\n')
+        assert second.recv(64) == b'second\r\n'
+        assert first.recv(64) == b''
+        assert listener.evicted_connections == 1
+        sleep(0.05)
+        # like the reaped ones, its locks are released
+        assert released == [name]
+        first.close()
+        second.close()
+    finally:
+        listener.close()
+
+
+def test_admission_evict_busy():
+    executing = threading.Event()
+    proceed = threading.Event()
+
+    def slow(line):
+        executing.set()
+        proceed.wait(2)
+        return line + '\r\n'
+    listener = TcpListener(callback=slow, port=5657, ipv6=False,
+                           max_clients=1, admission=ADMISSION_EVICT)
+    listener.listen()
+    sleep(0.1)
+    try:
+        first = _connect(5657)
+        first.sendall(b'first\n')
+        assert executing.wait(2)
+        # the only connection is executing a command, it is not evicted
+        second = _connect(5657)
+        assert second.recv(64) == b'NotAllow\r\n'
+        assert listener.evicted_connections == 0
+        proceed.set()
+        assert first.recv(64) == b'first\r\n'
+        first.close()
+        second.close()
+    finally:
+        proceed.set()
+        listener.close()
+
+
+def test_socket_options():
+    assert resolve_socket_options(None) == {}
+    assert resolve_socket_options('low-latency')['nodelay'] is True
+    with pytest.raises(KeyError):
+        resolve_socket_options('unknown')
+    with pytest.raises(KeyError):
+        resolve_socket_options({'nagle': False})
+    listener = TcpListener(callback=_echo, port=5653, ipv6=False,
+                           socket_options={'nodelay': True,
+                                           'rcvbuf': 256*1024})
+    try:
+        sock = listener._socket_ipv4
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET,
+                               socket.SO_RCVBUF) >= 256*1024
+    finally:
+        listener.close()
+
+
+def test_idle_reaper():
+    released = []
+    listener = _listener(5654, idle_timeout=0.1, release_cb=released.append)
+    try:
+        client = _connect(5654)
+        client.sendall(b'alive\n')
+        assert client.recv(64) == b'alive\r\n'
+        name = '127.0.0.1:{0}'.format(client.getsockname()[1])
+        assert client.recv(64) == b''
+        sleep(0.05)
+        assert listener.reaped_connections == 1
+        assert listener.active_connections == 0
+        assert released == [name]
+        client.close()
+    finally:
+        listener.close()
+
+
+def test_read_timeout():
+    listener = _listener(5655, read_timeout=0.1)
+    try:
+        client = _connect(5655)
+        client.sendall(b'partial')
+        assert client.recv(64) == b''
+        sleep(0.05)
+        assert listener.reaped_connections == 1
+        client.close()
+    finally:
+        listener.close()
+
+
+def test_output_buffer_backpressure():
+    block = b'x'*(1024*1024) + b'\r\n'
+    calls = []
+
+    def callback(line):
+        calls.append(line)
+        return block
+
+    listener = TcpListener(callback=callback, port=5656, ipv6=False,
+                           output_buffer=2*1024*1024)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = _connect(5656)
+        for i in range(20):
+            client.sendall(b'BLOCk?\n')
+        sleep(0.3)
+        paused = len(calls)
+        assert paused < 20
+        buffered = list(listener.buffered_bytes.values())
+        assert len(buffered) == 1 and buffered[0] >= 2*1024*1024
+        received = 0
+        while received < 20*len(block):
+            received += len(client.recv(1024*1024))
+        assert len(calls) == 20
+        client.close()
+    finally:
+        listener.close()
+
+
+def test_read_timeout_slow_consumer():
+    block = b'x'*(8*1024*1024) + b'\r\n'
+    listener = TcpListener(callback=lambda line: block, port=5658,
+                           ipv6=False, read_timeout=0.3,
+                           output_buffer=16*1024*1024)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = _connect(5658)
+        # the client keeps sending, but it is slow reading the answers:
+        # the writer is blocked longer than the read timeout
+        for i in range(4):
+            client.sendall(b'BLOCk?\n')
+            sleep(0.2)
+        received = 0
+        while received < 4*len(block):
+            data = client.recv(1024*1024)
+            assert len(data) > 0
+            received += len(data)
+        assert listener.reaped_connections == 0
+        client.close()
+    finally:
+        listener.close()
@@ -0,0 +1,84 @@
+import socket
+import threading
+from time import sleep
+
+from scpilib.udpListener import UdpListener
+
+
+def test_udp_datagrams():
+    received = []
+
+    def callback(line):
+        received.append(line)
+        if line.endswith(b'?'):
+            return b'42\r\n'
+        return b'ACK\r\n'
+
+    listener = UdpListener(callback=callback, port=5660, ipv6=False)
+    listener.listen()
+    try:
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        client.sendto(b'SOUR:CURR 1;SOUR:VOLT 2', ('127.0.0.1', 5660))
+        client.sendto(b'SOUR:CURR?\n', ('127.0.0.1', 5660))
+        assert client.recvfrom(64)[0] == b'42\r\n'
+        sleep(0.1)
+        assert received == [b'SOUR:CURR 1;SOUR:VOLT 2', b'SOUR:CURR?']
+        source = '127.0.0.1:{0}'.format(client.getsockname()[1])
+        counters = listener.statistics()[source]
+        assert counters['datagrams'] == 2
+        assert counters['commands'] == 3
+        assert counters['answers'] == 1
+        client.close()
+    finally:
+        listener.close()
+    assert not listener.is_alive()
+
+
+def test_udp_sources_bounded():
+    names = []
+
+    def callback(line):
+        names.append(threading.current_thread().name)
+        return b'ACK\r\n'
+
+    listener = UdpListener(callback=callback, port=5661, ipv6=False,
+                           max_sources=2)
+    listener.listen()
+    try:
+        clients = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                   for i in range(3)]
+        for client in clients:
+            client.sendto(b'SOUR:CURR 1', ('127.0.0.1', 5661))
+            sleep(0.05)
+        sources = ['127.0.0.1:{0}'.format(client.getsockname()[1])
+                   for client in clients]
+        # the commands saw the source, but the thread has its name back
+        assert names == sources
+        assert 'UdpListener4' in [thread.name
+                                  for thread in threading.enumerate()]
+        assert sorted(listener.statistics()) == sorted(sources[1:])
+        for client in clients:
+            client.close()
+    finally:
+        listener.close()
+
+
+def test_udp_failing_command():
+    def callback(line):
+        if line == b'FAIL?':
+            raise ValueError("failing command")
+        return b'42\r\n'
+
+    listener = UdpListener(callback=callback, port=5662, ipv6=False)
+    listener.listen()
+    try:
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        client.sendto(b'FAIL?', ('127.0.0.1', 5662))
+        client.sendto(b'SOUR:CURR?', ('127.0.0.1', 5662))
+        # the listener is still serving after the failure
+        assert client.recvfrom(64)[0] == b'42\r\n'
+        client.close()
+    finally:
+        listener.close()
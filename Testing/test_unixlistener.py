@@ -0,0 +1,74 @@
+import os
+import pytest
+import socket
+import tempfile
+from time import sleep
+
+from scpilib.unixListener import UnixSocketListener
+
+
+def _echo(line):
+    return line + '\r\n'
+
+
+def test_unix_socket_round_trip():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.sock')
+    received = []
+    listener = UnixSocketListener(callback=_echo, path=path)
+    # synchronous, so it has been called when the answer arrives
+    listener.add_connection_hook(lambda who, what: received.append(who),
+                                 sync=True)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.sendall(b'*IDN?\n')
+        assert client.recv(64) == b'*IDN?\r\n'
+        assert received == ['{0}:1'.format(path)]
+        client.close()
+    finally:
+        listener.close()
+    assert not os.path.exists(path)
+
+
+def test_unix_socket_in_use():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.sock')
+    received = []
+    listener = UnixSocketListener(callback=_echo, path=path)
+    listener.add_connection_hook(lambda who, what: received.append(what),
+                                 sync=True)
+    listener.listen()
+    sleep(0.1)
+    try:
+        with pytest.raises(IOError):
+            UnixSocketListener(callback=_echo, path=path)
+        # the check has not connected to the one listening
+        assert received == []
+        # the first one keeps its socket
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.sendall(b'*IDN?\n')
+        assert client.recv(64) == b'*IDN?\r\n'
+        client.close()
+    finally:
+        listener.close()
+
+
+def test_unix_socket_stale():
+    path = os.path.join(tempfile.mkdtemp(), 'scpi.sock')
+    # like the one left by a process that has crashed
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    listener = UnixSocketListener(callback=_echo, path=path)
+    listener.listen()
+    sleep(0.1)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.sendall(b'*IDN?\n')
+        assert client.recv(64) == b'*IDN?\r\n'
+        client.close()
+    finally:
+        listener.close()
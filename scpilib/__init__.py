@@ -19,6 +19,7 @@
 
 
 from scpi import scpi
+from hub import ServiceHub
 
 
 __author__ = "Sergi Blanch-Torné"
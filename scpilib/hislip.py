@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .tcpListener import TcpListener
+except Exception:
+    from tcpListener import TcpListener
+from itertools import count as _count
+import socket as _socket
+from struct import Struct as _Struct
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["HiSLIPListener"]
+
+
+HISLIP_PORT = 4880
+PROTOCOL_VERSION = 0x0100  # 1.0
+VENDOR_ID = b'SC'
+_MAX_MESSAGE_SIZE = 1 << 24
+
+# 'HS', message type, control code, message parameter, payload length
+HEADER = _Struct('!2sBBIQ')
+PROLOGUE = b'HS'
+_MESSAGE_SIZE = _Struct('!Q')
+
+# message types (IVI-6.1)
+INITIALIZE = 0
+INITIALIZE_RESPONSE = 1
+FATAL_ERROR = 2
+ERROR = 3
+ASYNC_LOCK = 4
+ASYNC_LOCK_RESPONSE = 5
+DATA = 6
+DATA_END = 7
+DEVICE_CLEAR_COMPLETE = 8
+DEVICE_CLEAR_ACKNOWLEDGE = 9
+ASYNC_REMOTE_LOCAL_CONTROL = 10
+ASYNC_REMOTE_LOCAL_RESPONSE = 11
+TRIGGER = 12
+INTERRUPTED = 13
+ASYNC_INTERRUPTED = 14
+ASYNC_MAXIMUM_MESSAGE_SIZE = 15
+ASYNC_MAXIMUM_MESSAGE_SIZE_RESPONSE = 16
+ASYNC_INITIALIZE = 17
+ASYNC_INITIALIZE_RESPONSE = 18
+ASYNC_DEVICE_CLEAR = 19
+ASYNC_SERVICE_REQUEST = 20
+ASYNC_STATUS_QUERY = 21
+ASYNC_STATUS_RESPONSE = 22
+ASYNC_DEVICE_CLEAR_ACKNOWLEDGE = 23
+ASYNC_LOCK_INFO = 24
+ASYNC_LOCK_INFO_RESPONSE = 25
+
+# fatal error codes
+FATAL_POORLY_FORMED_HEADER = 1
+FATAL_NO_SESSION = 2
+FATAL_INVALID_INITIALIZATION = 3
+
+# error codes
+ERROR_UNRECOGNIZED_MESSAGE_TYPE = 1
+ERROR_MESSAGE_TOO_LARGE = 4
+
+# control codes of the lock messages
+LOCK_RELEASE = 0
+LOCK_REQUEST = 1
+LOCK_FAILURE = 0
+LOCK_SUCCESS = 1
+LOCK_ERROR = 3
+
+_REFUSAL_ANSWER = b'NotAllow\r\n'
+
+
+def header(message_type, control_code=0, parameter=0, payload=b''):
+    """
+Build a HiSLIP message: the 16 bytes header followed by the payload.
+    :param message_type: int
+    :param control_code: int
+    :param parameter: int (32 bits)
+    :param payload: bytes
+    :return: bytes
+    """
+    return HEADER.pack(PROLOGUE, message_type, control_code, parameter,
+                       len(payload)) + payload
+
+
+class _Session(object):
+    """
+        The pair of channels of a client. The synchronous one carries the
+        data, the asynchronous one the out-of-band requests.
+    """
+    def __init__(self, session_id, sync_name, overlap):
+        super(_Session, self).__init__()
+        self.session_id = session_id
+        self.sync_name = sync_name
+        self.async_name = None
+        self.overlap = overlap
+        self.max_message_size = None
+        self.message_id = None
+
+
+class HiSLIPListener(TcpListener):
+    """
+        Listener of the HiSLIP protocol (IVI-6.1). The messages have a length
+        prefixed header, so the binary answers are sent without terminator
+        scanning and the out-of-band requests (device clear, status, lock)
+        go through a second, asynchronous, channel.
+
+        The connections are handled like in the TcpListener (admission,
+        socket options, reaper), both channels of a session are connections.
+        The locker knows the client by the name of its synchronous channel.
+
+        While a session has the exclusive lock (requested in its asynchronous
+        channel) the data of the other sessions is not executed: their
+        queries are answered 'NotAllow'.
+    """
+
+    _sessions = None
+    _sessions_lock = None
+    _session_counter = None
+    _max_message_size = None
+    _lock_session = None
+
+    def __init__(self, name=None, callback=None, local=True, port=HISLIP_PORT,
+                 max_message_size=None, *args, **kwargs):
+        self._sessions = {}
+        self._sessions_lock = _threading.Lock()
+        self._session_counter = _count(1)
+        self._max_message_size = max_message_size or _MAX_MESSAGE_SIZE
+        super(HiSLIPListener, self).__init__(
+            name=name or "HiSLIPListener", callback=callback, local=local,
+            port=port, *args, **kwargs)
+
+    @property
+    def max_message_size(self):
+        return self._max_message_size
+
+    @property
+    def sessions(self):
+        return len(self._sessions)
+
+    def _serve_connection(self, connectionName, stream, buffer=None):
+        if buffer is None:
+            write = stream.write
+        else:
+            write = buffer.write
+        message = self._receive(connectionName, stream, write)
+        if message is None:
+            return
+        message_type, control_code, parameter, payload = message
+        if message_type == INITIALIZE:
+            session = self._initialize(connectionName, control_code,
+                                       parameter, write)
+            try:
+                self._serve_sync(session, stream, write, buffer)
+            finally:
+                self._close_session(session)
+        elif message_type == ASYNC_INITIALIZE:
+            session = self._sessions.get(parameter)
+            if session is None or session.async_name is not None:
+                self._fatal(write, FATAL_INVALID_INITIALIZATION,
+                            "Unknown session {0}".format(parameter))
+                return
+            session.async_name = connectionName
+            write(header(ASYNC_INITIALIZE_RESPONSE,
+                         parameter=self._vendor_id()))
+            self._serve_async(session, connectionName, stream, write)
+        else:
+            self._fatal(write, FATAL_NO_SESSION,
+                        "The first message must initialize the channel")
+
+    def _receive(self, connectionName, stream, write):
+        """
+            Read one message. None when the connection has to end.
+        """
+        try:
+            data = stream.read(HEADER.size)
+        except _socket.timeout:
+            self._warning("Nothing received from {0} in {1} s, reaping it",
+                          connectionName, self._read_timeout)
+            self._connection_reaped.add(connectionName)
+            return None
+        except Exception as exc:
+            self._debug("Reception from {0} interrupted: {1}",
+                        connectionName, exc)
+            return None
+        if len(data) < HEADER.size:
+            self._debug("Connection {0} closed by the peer", connectionName)
+            return None
+        prologue, message_type, control_code, parameter, length = \
+            HEADER.unpack(data)
+        if prologue != PROLOGUE:
+            self._fatal(write, FATAL_POORLY_FORMED_HEADER,
+                        "Poorly formed message header")
+            return None
+        self._connection_busy.add(connectionName)
+        if length > self._max_message_size:
+            # consume the payload to keep the framing
+            while length > 0:
+                chunk = stream.read(min(length, 1 << 16))
+                if len(chunk) == 0:
+                    return None
+                length -= len(chunk)
+            self._warning("Too large message from {0}", connectionName)
+            write(header(ERROR, ERROR_MESSAGE_TOO_LARGE,
+                         payload=b'Message too large'))
+            return message_type, control_code, parameter, None
+        payload = stream.read(length) if length > 0 else b''
+        self._info("received from {0}: type {1:d}, {2:d} bytes {3!r}",
+                   connectionName, message_type, len(payload), payload)
+        return message_type, control_code, parameter, payload
+
+    def _initialize(self, connectionName, control_code, parameter, write):
+        client_version = parameter >> 16
+        with self._sessions_lock:
+            # the identifiers are 16 bits, skip the ones of open sessions
+            session_id = next(self._session_counter) & 0xFFFF
+            while session_id in self._sessions:
+                session_id = next(self._session_counter) & 0xFFFF
+            session = _Session(session_id, connectionName,
+                               overlap=bool(control_code & 1))
+            self._sessions[session_id] = session
+        self._debug("Session {0} for {1} (client protocol {2:#06x}, {3})",
+                    session_id, connectionName, client_version,
+                    "overlapped" if session.overlap else "synchronized")
+        write(header(INITIALIZE_RESPONSE, int(session.overlap),
+                     (PROTOCOL_VERSION << 16) | session_id))
+        return session
+
+    def _close_session(self, session):
+        with self._sessions_lock:
+            self._sessions.pop(session.session_id, None)
+            if self._lock_session == session.session_id:
+                self._lock_session = None
+
+    def _serve_sync(self, session, stream, write, buffer=None):
+        connectionName = session.sync_name
+        message = []
+        while not self._join_event.isSet():
+            if buffer is not None and not buffer.wait_writable():
+                self._warning("Cannot send to {0}: {1}",
+                              connectionName, buffer.error)
+                return
+            received = self._receive(connectionName, stream, write)
+            if received is None:
+                return
+            message_type, control_code, parameter, payload = received
+            if payload is None:
+                message = []
+            elif message_type in (DATA, DATA_END):
+                session.message_id = parameter
+                message.append(payload)
+                if message_type == DATA_END:
+                    self._dispatch(session, b''.join(message), write)
+                    message = []
+            elif message_type == DEVICE_CLEAR_COMPLETE:
+                message = []
+                session.overlap = bool(control_code & 1)
+                write(header(DEVICE_CLEAR_ACKNOWLEDGE, int(session.overlap)))
+            elif message_type == TRIGGER:
+                self._debug("Trigger from {0}", connectionName)
+            else:
+                self._unrecognized(connectionName, message_type, write)
+            self._connection_activity[connectionName] = _time()
+            self._connection_busy.discard(connectionName)
+
+    def _dispatch(self, session, data, write):
+        if data.endswith(b'\n'):
+            # the message is framed, the terminator is only a convention
+            data = data[:-1]
+        self._connection_hooks(session.sync_name, data)
+        if self._callback is None:
+            return
+        if self._lock_session not in (None, session.session_id):
+            self._warning("{0} is locked by the session {1}, refusing {2!r} "
+                          "from {3}", self._name, self._lock_session, data,
+                          session.sync_name)
+            answer = _REFUSAL_ANSWER
+        else:
+            answer = self._callback(data)
+        self._debug("scpi.input say {0!r}", answer)
+        if b'?' not in data:
+            # there is no answer to a write
+            return
+        if answer.endswith(b'\r\n'):
+            answer = answer[:-2]
+        write(header(DATA_END, parameter=session.message_id,
+                     payload=answer + b'\n'))
+
+    def _serve_async(self, session, connectionName, stream, write):
+        while not self._join_event.isSet():
+            received = self._receive(connectionName, stream, write)
+            if received is None:
+                return
+            message_type, control_code, parameter, payload = received
+            if payload is None:
+                continue
+            if message_type == ASYNC_MAXIMUM_MESSAGE_SIZE:
+                session.max_message_size = _MESSAGE_SIZE.unpack(payload)[0]
+                write(header(ASYNC_MAXIMUM_MESSAGE_SIZE_RESPONSE,
+                             payload=_MESSAGE_SIZE.pack(
+                                 self._max_message_size)))
+            elif message_type == ASYNC_DEVICE_CLEAR:
+                write(header(ASYNC_DEVICE_CLEAR_ACKNOWLEDGE,
+                             int(session.overlap)))
+            elif message_type == ASYNC_STATUS_QUERY:
+                write(header(ASYNC_STATUS_RESPONSE, 0))
+            elif message_type == ASYNC_LOCK:
+                write(header(ASYNC_LOCK_RESPONSE,
+                             self._lock(session, control_code)))
+            elif message_type == ASYNC_LOCK_INFO:
+                locked = self._lock_session is not None
+                write(header(ASYNC_LOCK_INFO_RESPONSE, int(locked),
+                             int(locked)))
+            elif message_type == ASYNC_REMOTE_LOCAL_CONTROL:
+                write(header(ASYNC_REMOTE_LOCAL_RESPONSE))
+            else:
+                self._unrecognized(connectionName, message_type, write)
+            self._connection_activity[connectionName] = _time()
+            self._connection_busy.discard(connectionName)
+
+    def _lock(self, session, control_code):
+        with self._sessions_lock:
+            if control_code == LOCK_REQUEST:
+                if self._lock_session in (None, session.session_id):
+                    self._lock_session = session.session_id
+                    return LOCK_SUCCESS
+                return LOCK_FAILURE
+            elif control_code == LOCK_RELEASE:
+                if self._lock_session == session.session_id:
+                    self._lock_session = None
+                    return LOCK_SUCCESS
+                return LOCK_ERROR
+            return LOCK_ERROR
+
+    def _vendor_id(self):
+        return (ord(VENDOR_ID[0:1]) << 8) | ord(VENDOR_ID[1:2])
+
+    def _unrecognized(self, connectionName, message_type, write):
+        self._warning("Unrecognized message type {0} from {1}",
+                      message_type, connectionName)
+        write(header(ERROR, ERROR_UNRECOGNIZED_MESSAGE_TYPE,
+                     payload=b'Unrecognized message type'))
+
+    def _fatal(self, write, code, reason):
+        self._error("HiSLIP fatal error: {0}", reason)
+        try:
+            write(header(FATAL_ERROR, code, payload=reason.encode()))
+        except Exception as exc:
+            self._debug("Cannot report the fatal error: {0}", exc)
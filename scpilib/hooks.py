@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+except Exception:
+    from logger import Logger as _Logger
+try:
+    from Queue import Queue as _Queue, Full as _Full
+except ImportError:
+    from queue import Queue as _Queue, Full as _Full
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["ConnectionHooks", "OVERFLOW_DROP", "OVERFLOW_BLOCK"]
+
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+_OVERFLOW_POLICIES = [OVERFLOW_DROP, OVERFLOW_BLOCK]
+_HOOK_QUEUE_SIZE = 1000
+_BLOCK_INTERVAL = 0.1  # seconds between checks of a blocked enqueue
+
+
+class ConnectionHooks(_Logger):
+    """
+        The hooks a listener calls with what each client sends. The 'sync'
+        ones are called by the thread of the connection, before the command
+        is executed, so they have to be cheap (like a filter). The others are
+        queued to a consumer thread, and when the queue is full the received
+        data is dropped or the connection waits, depending on the overflow
+        policy. Once closed, the data is dropped.
+
+        The time spent in the hooks, and waiting in the queue, is measured.
+    """
+
+    _sync_hooks = None
+    _async_hooks = None
+    _queue = None
+    _queue_size = None
+    _overflow = None
+    _consumer = None
+    _closed = False
+    _statistics_lock = None
+
+    def __init__(self, name=None, queue_size=None, overflow=None,
+                 *args, **kwargs):
+        super(ConnectionHooks, self).__init__(*args, **kwargs)
+        if queue_size is None:
+            queue_size = _HOOK_QUEUE_SIZE
+        if overflow is None:
+            overflow = OVERFLOW_DROP
+        if overflow not in _OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {0!r} (use one of {1})"
+                             "".format(overflow, _OVERFLOW_POLICIES))
+        self._name = "{0}Hooks".format(name or "Connection")
+        self._sync_hooks = []
+        self._async_hooks = []
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._statistics_lock = _threading.Lock()
+        self.reset_statistics()
+
+    def __len__(self):
+        return len(self._sync_hooks) + len(self._async_hooks)
+
+    def __call__(self, connection_name, data):
+        for hook in self._sync_hooks:
+            self._call(hook, connection_name, data, 'sync')
+        if len(self._async_hooks) > 0:
+            self._enqueue((_time(), connection_name, data))
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def overflow(self):
+        return self._overflow
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def add(self, hook, sync=False):
+        if not callable(hook):
+            raise TypeError("The hook must be a callable object")
+        if sync:
+            self._sync_hooks.append(hook)
+        else:
+            self._async_hooks.append(hook)
+            self._start_consumer()
+
+    def remove(self, hook):
+        for hooks in [self._sync_hooks, self._async_hooks]:
+            if hooks.count(hook):
+                hooks.pop(hooks.index(hook))
+                return True
+        return False
+
+    def close(self):
+        """
+            Stop the consumer once the queued data has been given to the
+            hooks (waiting a second at most, a hook may be stuck).
+        """
+        self._closed = True
+        if self._consumer is not None:
+            try:
+                self._queue.put_nowait(None)
+            except _Full:
+                # the consumer finishes when it has emptied the queue
+                pass
+            if self._consumer is not _threading.current_thread():
+                self._consumer.join(1)
+            self._consumer = None
+
+    def statistics(self):
+        """
+Per tier ('sync' and 'async') counters: the calls, the ones that raised an
+exception, the total and maximum latency (seconds) of the calls and, for the
+async ones, the maximum wait in the queue and the dropped data.
+        :return: dict
+        """
+        with self._statistics_lock:
+            return dict((tier, dict(counters))
+                        for tier, counters in self._statistics.items())
+
+    def reset_statistics(self):
+        with self._statistics_lock:
+            self._statistics = {
+                'sync': {'calls': 0, 'errors': 0, 'latency': 0.0,
+                         'max_latency': 0.0},
+                'async': {'calls': 0, 'errors': 0, 'latency': 0.0,
+                          'max_latency': 0.0, 'max_wait': 0.0, 'dropped': 0}}
+
+    def _start_consumer(self):
+        if self._consumer is not None:
+            return
+        self._queue = _Queue(self._queue_size)
+        self._consumer = _threading.Thread(name=self._name,
+                                           target=self._consume)
+        self._consumer.setDaemon(True)
+        self._consumer.start()
+
+    def _enqueue(self, item):
+        try:
+            if self._overflow == OVERFLOW_BLOCK:
+                # wait for room, unless it is closed meanwhile
+                while not self._closed:
+                    try:
+                        self._queue.put(item, timeout=_BLOCK_INTERVAL)
+                        return
+                    except _Full:
+                        pass
+            elif not self._closed:
+                self._queue.put_nowait(item)
+                return
+        except _Full:
+            pass
+        with self._statistics_lock:
+            self._statistics['async']['dropped'] += 1
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            when, connection_name, data = item
+            wait = _time() - when
+            with self._statistics_lock:
+                counters = self._statistics['async']
+                counters['max_wait'] = max(counters['max_wait'], wait)
+            for hook in list(self._async_hooks):
+                self._call(hook, connection_name, data, 'async')
+            if self._closed and self._queue.empty():
+                break
+        self._debug("Hooks consumer finishing")
+
+    def _call(self, hook, connection_name, data, tier):
+        t_0 = _time()
+        failed = False
+        try:
+            hook(connection_name, data)
+        except Exception as exc:
+            failed = True
+            self._warning("Exception calling {0} hook: {1}", hook, exc)
+        latency = _time() - t_0
+        with self._statistics_lock:
+            counters = self._statistics[tier]
+            counters['calls'] += 1
+            counters['errors'] += int(failed)
+            counters['latency'] += latency
+            counters['max_latency'] = max(counters['max_latency'], latency)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .logger import deprecated
+    from .hooks import ConnectionHooks
+except Exception:
+    from logger import Logger as _Logger
+    from logger import deprecated
+    from hooks import ConnectionHooks
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+from gzip import GzipFile as _GzipFile
+from io import BytesIO as _BytesIO
+import json as _json
+import socket as _socket
+import threading as _threading
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["HttpListener"]
+
+
+HTTP_PATH = '/scpi'
+# smaller bodies don't compensate the compression
+_GZIP_MIN_SIZE = 1024
+
+
+def _text(value):
+    # the binary arrays (the DataFormat other than ASCII) are bytes that
+    # cannot go in json: each byte is given as the latin-1 character
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return value
+
+
+class HttpServer(ThreadingMixIn, HTTPServer):
+    """
+        Threaded HTTP server of a listener object (that the handlers reach
+        as 'self.server.listener'). Also used by the MetricsListener.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, listener, address, handler, family=_socket.AF_INET):
+        self.address_family = family
+        self.listener = listener
+        HTTPServer.__init__(self, address, handler)
+
+
+class HttpHandler(BaseHTTPRequestHandler):
+    def send_body(self, code, content_type, body, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.listener._debug("{0}: {1}", self.address_string(),
+                                    format % args)
+
+
+def serve_in_thread(server, name):
+    thread = _threading.Thread(name=name, target=server.serve_forever)
+    thread.setDaemon(True)
+    return thread
+
+
+def shutdown_server(server, thread):
+    if thread.is_alive():
+        server.shutdown()
+        thread.join(1)
+    server.server_close()
+
+
+class _Handler(HttpHandler):
+    # HTTP/1.1 keeps the connection alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # the locker identifies the clients by the thread name
+        _threading.current_thread().name = "{0}:{1}".format(
+            self.client_address[0], self.client_address[1])
+
+    def do_GET(self):
+        self._safely(self._get)
+
+    def do_POST(self):
+        self._safely(self._post)
+
+    def _safely(self, method):
+        try:
+            method()
+        except Exception as exc:
+            # the client has to get a reply, whatever has failed
+            self.server.listener._error("Request {0} {1} failed: {2}",
+                                        self.command, self.path, exc)
+            self._reply(500, {'error': str(exc)})
+
+    def _get(self):
+        url = urlparse(self.path)
+        if url.path != HTTP_PATH:
+            return self._reply(404, {'error': "Unknown path"})
+        commands = parse_qs(url.query).get('cmd')
+        if not commands:
+            return self._reply(400, {'error': "Missing 'cmd' parameter"})
+        self._answer(commands)
+
+    def _post(self):
+        if urlparse(self.path).path != HTTP_PATH:
+            return self._reply(404, {'error': "Unknown path"})
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            commands = _json.loads(_text(self.rfile.read(length)))
+            if not isinstance(commands, list) or len(commands) == 0:
+                raise ValueError("Not a list of commands")
+        except ValueError as exc:
+            return self._reply(400, {'error': str(exc)})
+        self._answer([str(command) for command in commands])
+
+    def _answer(self, commands):
+        answer, answers = self.server.listener._execute(commands)
+        if answers is None:
+            # some answer has a ';' inside, or some command had none
+            return self._reply(502, {'error': "Cannot split the answer by "
+                                              "command", 'answer': answer})
+        self._reply(200, {'answer': answer, 'answers': answers})
+
+    def _reply(self, code, content):
+        body = _json.dumps(content).encode()
+        encoding = self.headers.get('Accept-Encoding') or ''
+        headers = {}
+        if 'gzip' in encoding and len(body) >= _GZIP_MIN_SIZE:
+            stream = _BytesIO()
+            with _GzipFile(fileobj=stream, mode='wb') as compressor:
+                compressor.write(body)
+            body = stream.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.send_body(code, 'application/json', body, headers)
+
+
+class HttpListener(_Logger):
+    """
+        HTTP/JSON gateway to the command tree, for the clients that poll the
+        instrument (like dashboards). 'GET /scpi?cmd=...' answers one (or
+        many, repeating 'cmd') commands and 'POST /scpi' a json array of
+        them. A batch is executed in a single call to the callback, like a
+        ';' separated line from the TcpListener. The reply has the 'answer'
+        as the callback gives it and the 'answers', one per command (when
+        they cannot be split, the reply is an error 502 with the 'answer').
+        The binary arrays are in the answers as latin-1 text: encoding them
+        in latin-1 gives back their bytes. Any other failure is an error
+        500.
+
+        The connections are kept alive (HTTP/1.1) and the big answers are
+        compressed when the client accepts gzip.
+    """
+
+    _callback = None
+    _connection_hooks = None
+
+    _local = None
+    _port = None
+
+    _server = None
+    _listener = None
+
+    def __init__(self, name=None, callback=None, local=True, port=8080,
+                 ipv6=False, *args, **kwargs):
+        super(HttpListener, self).__init__(*args, **kwargs)
+        self._name = name or "HttpListener"
+        self._callback = callback
+        self._connection_hooks = ConnectionHooks(self._name)
+        self._local = local
+        self._port = port
+        self._with_ipv6_support = ipv6
+        self.open()
+        self._debug("Listener thread prepared")
+
+    def __del__(self):
+        self.close()
+
+    def open(self):
+        if self._with_ipv6_support:
+            family = _socket.AF_INET6
+            host = '::1' if self._local else '::'
+        else:
+            family = _socket.AF_INET
+            host = '127.0.0.1' if self._local else '0.0.0.0'
+        self._server = HttpServer(self, (host, self._port), _Handler, family)
+        self._listener = serve_in_thread(self._server, "HttpListener")
+
+    def close(self):
+        if self._server is None:
+            return
+        self._debug("{0} close received", self._name)
+        shutdown_server(self._server, self._listener)
+        self._server = None
+        self._connection_hooks.close()
+        self._debug("Everything is close, exiting...")
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def local(self):
+        return self._local
+
+    @property
+    def callback(self):
+        """
+            The callable the requests are given to. When it is replaced, the
+            connections already open use the new one from the next request.
+        """
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        self._callback = callback
+
+    def listen(self):
+        self._debug("Launching listener thread")
+        self._listener.start()
+
+    def is_alive(self):
+        return self._listener is not None and self._listener.is_alive()
+
+    def is_listening(self):
+        return self._server is not None
+
+    def _execute(self, commands):
+        """
+Execute the commands in one line.
+        :return: tuple with the whole answer and the list of answers for each
+                 command (None if they cannot be split)
+        """
+        line = ';'.join(commands)
+        self._connection_hooks(_threading.current_thread().name, line)
+        if self._callback is None:
+            return None, [None] * len(commands)
+        answer = _text(self._callback(line)).rstrip('\r\n')
+        self._debug("scpi.input say {0!r}", answer)
+        if len(commands) == 1:
+            return answer, [answer]
+        answers = answer.split(';') if answer else []
+        if len(answers) != len(commands):
+            return answer, None
+        return answer, answers
+
+    def add_connection_hook(self, hook, sync=False):
+        """
+Add a function to be called with (connection name, received data). Unless it
+is 'sync' it will be called from a background thread, so it doesn't delay
+the execution of the commands.
+        :param hook: callable
+        :param sync: bool
+        """
+        self._connection_hooks.add(hook, sync)
+
+    @deprecated
+    def addConnectionHook(self, *args):
+        return self.add_connection_hook(*args)
+
+    def remove_connection_hook(self, hook):
+        return self._connection_hooks.remove(hook)
+
+    def hook_statistics(self):
+        return self._connection_hooks.statistics()
+
+    @deprecated
+    def removeConnectionHook(self, *args):
+        return self.remove_connection_hook(*args)
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .tcpListener import splitter, apply_socket_options
+    from .tcpListener import resolve_socket_options
+    from .hooks import ConnectionHooks
+    from .ratelimit import Throttled
+except Exception:
+    from logger import Logger as _Logger
+    from tcpListener import splitter, apply_socket_options
+    from tcpListener import resolve_socket_options
+    from hooks import ConnectionHooks
+    from ratelimit import Throttled
+import errno as _errno
+import os as _os
+import select as _select
+import socket as _socket
+import threading as _threading
+from time import time as _time
+try:
+    from selectors import DefaultSelector as _Selector
+    from selectors import EVENT_READ, EVENT_WRITE
+except ImportError:
+    _Selector = None
+    EVENT_READ = 1
+    EVENT_WRITE = 2
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["ServiceHub"]
+
+
+_READ_SIZE = 4096
+_OUTPUT_BUFFER = 1024*1024  # bytes pending to stop reading a connection
+_UNKNOWN_INSTRUMENT = b'NOK\r\n'
+
+
+class _Key(object):
+    def __init__(self, fileobj, events, data):
+        self.fileobj = fileobj
+        self.events = events
+        self.data = data
+
+
+class _SelectSelector(object):
+    """
+        The minimum of the python 3 'selectors' interface, over
+        select.select(), for the python versions without it.
+    """
+    def __init__(self):
+        super(_SelectSelector, self).__init__()
+        self._keys = {}
+
+    def register(self, fileobj, events, data=None):
+        self._keys[fileobj] = _Key(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._keys.pop(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        self._keys[fileobj] = _Key(fileobj, events, data)
+
+    def select(self, timeout=None):
+        readers = [key.fileobj for key in self._keys.values()
+                   if key.events & EVENT_READ]
+        writers = [key.fileobj for key in self._keys.values()
+                   if key.events & EVENT_WRITE]
+        readable, writable, _ = _select.select(readers, writers, [], timeout)
+        ready = {}
+        for fileobj in readable:
+            ready[fileobj] = ready.get(fileobj, 0) | EVENT_READ
+        for fileobj in writable:
+            ready[fileobj] = ready.get(fileobj, 0) | EVENT_WRITE
+        return [(self._keys[fileobj], events)
+                for fileobj, events in ready.items()
+                if fileobj in self._keys]
+
+    def close(self):
+        self._keys = {}
+
+
+class _Connection(object):
+    def __init__(self, sock, name, port):
+        super(_Connection, self).__init__()
+        self.sock = sock
+        self.name = name
+        self.port = port
+        self.received = b''
+        self.pending = b''
+        self.not_before = None  # when a throttled line can be given again
+
+
+class _HubService(object):
+    """
+        What a registered scpi object has in its services: the hub listens
+        for it, and closing it only removes the instrument from the hub.
+    """
+    def __init__(self, hub, port, prefix):
+        super(_HubService, self).__init__()
+        self._hub = hub
+        self._port = port
+        self._prefix = prefix
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def local(self):
+        return self._hub.local
+
+    @property
+    def callback(self):
+        return self._hub.callback(self._port, self._prefix)
+
+    @callback.setter
+    def callback(self, callback):
+        self._hub.reroute(callback, self._port, self._prefix)
+
+    def is_listening(self):
+        return self._hub.is_registered(self._port, self._prefix)
+
+    def close(self):
+        self._hub.unregister(self._port, self._prefix)
+
+    def add_connection_hook(self, hook, sync=False):
+        self._hub.add_connection_hook(hook, sync)
+
+    def remove_connection_hook(self, hook):
+        return self._hub.remove_connection_hook(hook)
+
+
+class ServiceHub(_Logger):
+    """
+        Many scpi objects served by one thread. Each instrument registers in
+        its own port, or many in the same port distinguished by a prefix: the
+        line 'PSU1:SOUR:CURR?' is given as 'SOUR:CURR?' to the instrument
+        registered with the 'PSU1' prefix.
+
+        All the sockets are non-blocking and attended by a single selector
+        loop, so the number of threads doesn't grow with the instruments or
+        the connections. The commands are executed in this loop, so a slow
+        callback delays the other instruments.
+
+        A client that doesn't read its answers is not read either while it
+        has more than 'output_buffer' bytes pending to be sent. Neither is a
+        client over its rate limit: its line waits, without blocking the
+        loop, until it can be executed.
+    """
+
+    _local = None
+    _socket_options = None
+    _output_buffer = None
+    _routes = None
+    _sockets = None
+    _connections = None
+    _selector = None
+    _actions = None
+    _actions_lock = None
+    _waker = None
+    _loop = None
+    _join_event = None
+
+    def __init__(self, name=None, local=True, socket_options=None,
+                 output_buffer=None, *args, **kwargs):
+        super(ServiceHub, self).__init__(*args, **kwargs)
+        self._name = name or "ServiceHub"
+        self._local = local
+        self._socket_options = resolve_socket_options(socket_options)
+        self._output_buffer = output_buffer or _OUTPUT_BUFFER
+        self._routes = {}
+        self._sockets = {}
+        self._connections = {}
+        self._selector = _Selector() if _Selector is not None \
+            else _SelectSelector()
+        self._actions = []
+        self._actions_lock = _threading.Lock()
+        self._waker = _os.pipe()
+        self._selector.register(self._waker[0], EVENT_READ, None)
+        self._connection_hooks = ConnectionHooks(self._name)
+        self._join_event = _threading.Event()
+        self._loop = _threading.Thread(name=self._name, target=self._serve)
+        self._loop.setDaemon(True)
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def local(self):
+        return self._local
+
+    @property
+    def output_buffer(self):
+        return self._output_buffer
+
+    @property
+    def instruments(self):
+        return sum([len(routes) for routes in self._routes.values()])
+
+    @property
+    def active_connections(self):
+        return len(self._connections)
+
+    def listen(self):
+        self._debug("Launching the hub loop")
+        self._loop.start()
+
+    def is_alive(self):
+        return self._loop.is_alive()
+
+    def in_loop(self):
+        return self._loop is _threading.current_thread()
+
+    def is_registered(self, port, prefix=None):
+        return prefix in self._routes.get(port, {})
+
+    def callback(self, port, prefix=None):
+        if prefix is not None:
+            prefix = prefix.upper()
+        return self._routes.get(port, {}).get(prefix)
+
+    def reroute(self, callback, port, prefix=None):
+        """
+Give the lines of an instrument already registered to another callback.
+        :param callback: callable
+        :param port: int
+        :param prefix: str
+        """
+        if prefix is not None:
+            prefix = prefix.upper()
+        routes = self._routes.get(port, {})
+        if prefix not in routes:
+            raise KeyError("Port {0} has no instrument {1}"
+                           "".format(port, prefix or ""))
+        routes[prefix] = callback
+
+    def register(self, callback, port, prefix=None):
+        """
+Serve the callback (usually the input of an scpi object) in the port. With a
+prefix, the port can be shared with other instruments.
+        :param callback: callable
+        :param port: int
+        :param prefix: str
+        :return: the service to be closed when the instrument leaves the hub
+        """
+        if prefix is not None:
+            prefix = prefix.upper()
+        routes = self._routes.get(port, {})
+        if prefix in routes:
+            raise KeyError("Port {0} has already an instrument {1}"
+                           "".format(port, prefix or ""))
+        if (prefix is None and len(routes) > 0) or None in routes:
+            raise KeyError("An instrument without prefix cannot share the "
+                           "port {0}".format(port))
+        if port not in self._sockets:
+            self._build_socket(port)
+        routes[prefix] = callback
+        self._routes[port] = routes
+        self._debug("Instrument {0} registered in port {1}", prefix, port)
+        return _HubService(self, port, prefix)
+
+    def unregister(self, port, prefix=None):
+        routes = self._routes.get(port, {})
+        if routes.pop(prefix, None) is None:
+            return
+        self._debug("Instrument {0} unregistered from port {1}", prefix, port)
+        if len(routes) == 0:
+            self._routes.pop(port, None)
+            self._do(self._close_port, port)
+
+    def close(self):
+        if self._join_event.isSet():
+            return
+        self._debug("{0} close received", self._name)
+        self._join_event.set()
+        self._wake_up()
+        if self._loop.is_alive() and \
+                self._loop is not _threading.current_thread():
+            self._loop.join(1)
+        for port in list(self._sockets.keys()):
+            self._close_port(port)
+        self._selector.close()
+        for fd in self._waker:
+            _os.close(fd)
+        self._connection_hooks.close()
+        self._debug("Everything is close, exiting...")
+
+    def add_connection_hook(self, hook, sync=False):
+        self._connection_hooks.add(hook, sync)
+
+    def remove_connection_hook(self, hook):
+        return self._connection_hooks.remove(hook)
+
+    def hook_statistics(self):
+        return self._connection_hooks.statistics()
+
+    # loop area ---
+
+    def _build_socket(self, port):
+        sock = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1' if self._local else '0.0.0.0', port))
+        sock.listen(_socket.SOMAXCONN)
+        sock.setblocking(False)
+        self._sockets[port] = sock
+        # the selector belongs to the loop thread
+        self._do(self._selector.register, sock, EVENT_READ, port)
+
+    def _close_port(self, port):
+        sock = self._sockets.pop(port, None)
+        if sock is not None:
+            self._unregister(sock)
+            sock.close()
+        for connection in list(self._connections.values()):
+            if connection.port == port:
+                self._close_connection(connection)
+
+    def _do(self, action, *args):
+        if not self._loop.is_alive() or \
+                self._loop is _threading.current_thread():
+            action(*args)
+            return
+        with self._actions_lock:
+            self._actions.append((action, args))
+        self._wake_up()
+
+    def _wake_up(self):
+        try:
+            _os.write(self._waker[1], b'\0')
+        except OSError:
+            pass
+
+    def _serve(self):
+        while not self._join_event.isSet():
+            for key, events in self._selector.select(self._timeout()):
+                if key.data is None:
+                    _os.read(self._waker[0], _READ_SIZE)
+                elif isinstance(key.data, _Connection):
+                    if events & EVENT_READ:
+                        self._receive(key.data)
+                    if events & EVENT_WRITE and \
+                            key.data.name in self._connections:
+                        self._send(key.data)
+                        if len(key.data.pending) < self._output_buffer and \
+                                key.data.name in self._connections:
+                            # lines held while the client didn't read
+                            self._process(key.data)
+                else:
+                    self._accept(key.fileobj, key.data)
+            self._resume()
+            with self._actions_lock:
+                actions, self._actions = self._actions, []
+            for action, args in actions:
+                action(*args)
+        for connection in list(self._connections.values()):
+            self._close_connection(connection)
+        self._debug("Hub loop finishing")
+
+    def _timeout(self):
+        # until the first throttled connection can go on
+        not_before = [connection.not_before
+                      for connection in self._connections.values()
+                      if connection.not_before is not None]
+        if len(not_before) == 0:
+            return None
+        return max(min(not_before) - _time(), 0)
+
+    def _resume(self):
+        now = _time()
+        for connection in list(self._connections.values()):
+            if connection.not_before is not None and \
+                    connection.not_before <= now and \
+                    connection.name in self._connections:
+                connection.not_before = None
+                self._process(connection)
+
+    def _accept(self, sock, port):
+        try:
+            connection, address = sock.accept()
+        except _socket.error as exc:
+            self._debug("Nothing to accept in {0}: {1}", port, exc)
+            return
+        connection.setblocking(False)
+        apply_socket_options(connection, self._socket_options)
+        name = "{0}:{1}".format(address[0], address[1])
+        self._debug("Connection from {0} to port {1}", name, port)
+        self._connections[name] = _Connection(connection, name, port)
+        self._selector.register(connection, EVENT_READ,
+                                self._connections[name])
+
+    def _receive(self, connection):
+        try:
+            data = connection.sock.recv(_READ_SIZE)
+        except _socket.error as exc:
+            if exc.args[0] in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                return
+            data = b''
+        if len(self._connection_hooks) > 0:
+            self._connection_hooks(connection.name, data)
+        if len(data) == 0:
+            self._close_connection(connection)
+            return
+        connection.received += data
+        self._process(connection)
+
+    def _process(self, connection):
+        held = True
+        while held and connection.name in self._connections and \
+                connection.not_before is None:
+            lines, remaining = splitter(connection.received)
+            if len(lines) == 0:
+                return
+            held = False
+            # the locker identifies the clients by the thread name
+            _threading.current_thread().name = connection.name
+            for i, line in enumerate(lines):
+                if len(connection.pending) >= self._output_buffer:
+                    # the rest waits until the client reads the answers
+                    remaining = b'\n'.join(lines[i:] + [remaining])
+                    held = True
+                    break
+                try:
+                    connection.pending += self._route(connection.port, line)
+                except Throttled as exc:
+                    # the rest waits until the line can be given again
+                    remaining = b'\n'.join(lines[i:] + [remaining])
+                    connection.not_before = _time() + exc.wait
+                    break
+            connection.received = remaining
+            _threading.current_thread().name = self._name
+            self._send(connection)
+            # the socket may have taken it all: go on with the held lines
+            held = held and len(connection.pending) < self._output_buffer
+
+    def _route(self, port, line):
+        routes = self._routes.get(port, {})
+        if None in routes:
+            return routes[None](line)
+        prefix, _, rest = line.partition(b':')
+        callback = routes.get(prefix.upper())
+        if callback is None:
+            self._warning("No instrument {0!r} in port {1}", prefix, port)
+            return _UNKNOWN_INSTRUMENT
+        return callback(rest)
+
+    def _send(self, connection):
+        if len(connection.pending) > 0:
+            try:
+                sent = connection.sock.send(connection.pending)
+                connection.pending = connection.pending[sent:]
+            except _socket.error as exc:
+                if exc.args[0] not in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                    self._warning("Cannot send to {0}: {1}",
+                                  connection.name, exc)
+                    self._close_connection(connection)
+                    return
+        events = 0
+        if len(connection.pending) < self._output_buffer and \
+                connection.not_before is None:
+            events |= EVENT_READ
+        if len(connection.pending) > 0:
+            events |= EVENT_WRITE
+        if events == 0:
+            # throttled with nothing to send: out of the selector until
+            # the line can be given again
+            self._unregister(connection.sock)
+            return
+        try:
+            self._selector.modify(connection.sock, events, connection)
+        except KeyError:
+            self._selector.register(connection.sock, events, connection)
+
+    def _close_connection(self, connection):
+        self._debug("Ending connection {0}", connection.name)
+        self._connections.pop(connection.name, None)
+        self._unregister(connection.sock)
+        connection.sock.close()
+
+    def _unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+from math import sqrt as _sqrt
+from threading import Lock as _Lock
+try:
+    from time import perf_counter_ns
+except ImportError:
+    try:
+        from time import perf_counter as _perf_counter
+    except ImportError:
+        # python 2 has no monotonic clock
+        from time import time as _perf_counter
+
+    def perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["StreamingStatistics", "perf_counter_ns"]
+
+
+# each power of 2 is split in 2**_SUB_BITS buckets (12.5% wide)
+_SUB_BITS = 3
+
+
+def _bucket(value):
+    exponent = value.bit_length() - 1
+    if exponent < _SUB_BITS:
+        return value
+    mantissa = (value >> (exponent - _SUB_BITS)) & ((1 << _SUB_BITS) - 1)
+    return ((exponent - _SUB_BITS + 1) << _SUB_BITS) + mantissa
+
+
+def _bucket_value(bucket):
+    """
+    The middle of the values that fall in the bucket.
+    """
+    if bucket < (1 << _SUB_BITS):
+        return float(bucket)
+    exponent = (bucket >> _SUB_BITS) + _SUB_BITS - 1
+    mantissa = bucket & ((1 << _SUB_BITS) - 1)
+    lower = ((1 << _SUB_BITS) + mantissa) << (exponent - _SUB_BITS)
+    return lower + (1 << (exponent - _SUB_BITS)) / 2.0
+
+
+class StreamingStatistics(object):
+    """
+        Statistics of a stream of (integer, like nanoseconds) samples in
+        constant memory: count, minimum, maximum, mean and variance (Welford)
+        and a log bucketed histogram for the percentiles (with an error below
+        the 6.25% of the value).
+    """
+
+    def __init__(self):
+        super(StreamingStatistics, self).__init__()
+        self._lock = _Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._count = 0
+            self._min = None
+            self._max = None
+            self._mean = 0.0
+            self._m2 = 0.0
+            self._histogram = {}
+
+    def add(self, value):
+        value = int(value)
+        with self._lock:
+            self._count += 1
+            if self._min is None or value < self._min:
+                self._min = value
+            if self._max is None or value > self._max:
+                self._max = value
+            delta = value - self._mean
+            self._mean += delta / self._count
+            self._m2 += delta * (value - self._mean)
+            bucket = _bucket(max(value, 0))
+            self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        if self._count == 0:
+            return 0.0
+        return self._m2 / self._count
+
+    @property
+    def std(self):
+        return _sqrt(self.variance)
+
+    def percentile(self, fraction):
+        """
+Value below which there are the given fraction (0 to 1) of the samples.
+        :param fraction: float
+        :return: float
+        """
+        with self._lock:
+            if self._count == 0:
+                return float('NaN')
+            rank = fraction * self._count
+            accumulated = 0
+            for bucket in sorted(self._histogram):
+                accumulated += self._histogram[bucket]
+                if accumulated >= rank:
+                    break
+            return min(max(_bucket_value(bucket), self._min), self._max)
+
+    def summary(self, scale=1.0):
+        """
+The statistics in a dict, multiplied by the scale (like 1e-9 to have
+seconds from nanoseconds).
+        :param scale: float
+        :return: dict
+        """
+        if self._count == 0:
+            return {'count': 0}
+        return {'count': self._count,
+                'min': self._min * scale,
+                'max': self._max * scale,
+                'mean': self._mean * scale,
+                'std': self.std * scale,
+                'p50': self.percentile(0.5) * scale,
+                'p99': self.percentile(0.99) * scale,
+                'p999': self.percentile(0.999) * scale}
@@ -100,6 +100,18 @@ class Locker(_Logger):
                         _current_thread().name, self._owner)
             return False
 
+    def release_owner(self, owner):
+        """
+            Release the lock on behalf of an owner that is gone (like a
+            connection closed by the server). Nothing is done if the lock
+            belongs to someone else.
+        """
+        if self._owner is not None and self._owner == owner:
+            self._warning("Release the lock of {0} on its behalf", owner)
+            self._do_release()
+            return True
+        return False
+
     def access(self):
         """
             Request if the give thread is allowed to access the resource.
@@ -28,12 +28,22 @@ from datetime import datetime as _datetime
 import logging as _logging
 from logging import handlers as _handlers
 from multiprocessing import current_process as _current_process
-from numpy import array, append
 import os
+import sys as _sys
 from time import time
 from threading import currentThread as _current_thread
 from threading import Lock as _Lock
+from threading import Thread as _Thread
+try:
+    from Queue import Queue as _Queue, Full as _Full
+except ImportError:
+    from queue import Queue as _Queue, Full as _Full
+try:
+    from .latency import StreamingStatistics, perf_counter_ns
+except Exception:
+    from latency import StreamingStatistics, perf_counter_ns
 from weakref import ref as _weakref
+from weakref import WeakSet as _WeakSet
 
 
 __author__ = "Sergi Blanch-Torné"
@@ -52,7 +62,9 @@ _deprecate_collect_ = True
 
 def scpi_debug(value):
     global _debug_
-    _debug_ = value
+    if bool(value) != _debug_:
+        _debug_ = bool(value)
+        _reinstall()
 
 
 def scpi_log2file(value):
@@ -62,7 +74,16 @@ def scpi_log2file(value):
 
 def scpi_timeit_collection(value):
     global _timeit_collect_
-    _timeit_collect_ = value
+    if bool(value) != _timeit_collect_:
+        _timeit_collect_ = bool(value)
+        _reinstall()
+
+
+def scpi_deprecation_collection(value):
+    global _deprecate_collect_
+    if bool(value) != _deprecate_collect_:
+        _deprecate_collect_ = bool(value)
+        _reinstall()
 
 
 logger_NOTSET = _logging.NOTSET  # 0
@@ -74,6 +95,7 @@ logger_DEBUG = _logging.DEBUG  # 10
 
 
 __all__ = ["scpi_debug", "scpi_log2file", "scpi_timeit_collection",
+           "scpi_deprecation_collection", "add_instrumentation_observer",
            "trace", "timeit", "deprecated",
            "timeit_collection", "deprecation_collection",
            "Logger", "logger_DEBUG", "logger_INFO", "logger_WARNING",
@@ -84,6 +106,19 @@ timeit_collection = {}
 deprecation_collection = {}
 deprecation_arguments = {}
 
+# longer arguments (like received payloads) are cut when logged
+_MAX_ARGUMENT_LENGTH = 256
+_STRINGS = (str, bytes, type(u''))
+
+
+def _truncate(argument):
+    if isinstance(argument, _STRINGS) and \
+            len(argument) > _MAX_ARGUMENT_LENGTH:
+        separator = b'...' if isinstance(argument, bytes) else u'...'
+        return argument[:_MAX_ARGUMENT_LENGTH-64] + separator + \
+            argument[-32:]
+    return argument
+
 
 def debug_stream(msg):
     __builtin__.print("{0:f} -- {1}".format(time(), msg))
@@ -95,80 +130,196 @@ def _get_printer(obj):
     return debug_stream
 
 
-def trace(method):
-    def _compact_args(lst_args, dct_args):
-        lst_str = "*args: {0}".format(lst_args) if len(lst_args) > 0 else ""
-        dct_str = "**kwargs: {0}".format(dct_args) if len(dct_args) > 0 else ""
-        if len(lst_str) > 0 and len(dct_args) > 0:
-            return "{0}, {1}".format(lst_str, dct_str)
-        elif len(lst_str) > 0:
-            return "{0}".format(lst_str)
-        elif len(dct_str) > 0:
-            return "{0}".format(dct_str)
-        return ""
-
-    def _compact_answer(answer):
-        if isinstance(answer, str) and len(answer) > 100:
-            return "{0}...{1}".format(answer[:25], answer[-25:])
-        return "{0}".format(answer)
+def _compact_args(lst_args, dct_args):
+    lst_str = "*args: {0}".format(lst_args) if len(lst_args) > 0 else ""
+    dct_str = "**kwargs: {0}".format(dct_args) if len(dct_args) > 0 else ""
+    if len(lst_str) > 0 and len(dct_args) > 0:
+        return "{0}, {1}".format(lst_str, dct_str)
+    elif len(lst_str) > 0:
+        return "{0}".format(lst_str)
+    elif len(dct_str) > 0:
+        return "{0}".format(dct_str)
+    return ""
+
+
+def _compact_answer(answer):
+    if isinstance(answer, str) and len(answer) > 100:
+        return "{0}...{1}".format(answer[:25], answer[-25:])
+    return "{0}".format(answer)
+
 
+def _tracer(method, method_name):
     def logging(*args, **kwargs):
-        if _debug_:
-            self = args[0]
-            klass = self.__class__.__name__
-            method_name = method.__name__
-            args_str = _compact_args(args[1:], kwargs)
-            printer = _get_printer(self)
-            printer("> {0}.{1}({2})"
-                    "".format(klass, method_name, args_str))
+        self = args[0]
+        klass = self.__class__.__name__
+        printer = _get_printer(self)
+        printer("> {0}.{1}({2})"
+                "".format(klass, method_name,
+                          _compact_args(args[1:], kwargs)))
         answer = method(*args, **kwargs)
-        if _debug_:
-            answer_str = _compact_answer(answer)
-            printer("< {0}.{1}: {2}"
-                    "".format(klass, method_name, answer_str))
+        printer("< {0}.{1}: {2}"
+                "".format(klass, method_name, _compact_answer(answer)))
         return answer
     return logging
 
 
-def timeit(method):
+def _measurer(method, method_name):
     def measure(*args, **kwargs):
-        if _timeit_collect_:
-            self = args[0]
-            klass = self.__class__.__name__
-            if klass not in timeit_collection:
-                timeit_collection[klass] = {}
-            method_name = method.__name__
-            if method_name not in timeit_collection[klass]:
-                timeit_collection[klass][method_name] = array([])
-            t_0 = time()
+        t_0 = perf_counter_ns()
         answer = method(*args, **kwargs)
-        if _timeit_collect_:
-            t_diff = time()-t_0
-            timeit_collection[klass][method_name] = append(
-                timeit_collection[klass][method_name], t_diff)
+        t_diff = perf_counter_ns() - t_0
+        klass = args[0].__class__.__name__
+        methods = timeit_collection.get(klass)
+        if methods is None:
+            methods = timeit_collection.setdefault(klass, {})
+        stats = methods.get(method_name)
+        if stats is None:
+            stats = methods.setdefault(method_name, StreamingStatistics())
+        stats.add(t_diff)
         return answer
-
     return measure
 
 
-def deprecated(method):
+def _collector(method, method_name):
     def collect(*args, **kwargs):
-        if _deprecate_collect_:
-            self = args[0]
-            klass = self.__class__.__name__
-            if klass not in deprecation_collection:
-                deprecation_collection[klass] = {}
-            method_name = method.__name__
-            if method_name not in deprecation_collection[klass]:
-                deprecation_collection[klass][method_name] = 0
-        answer = method(*args, **kwargs)
-        if _deprecate_collect_:
-            deprecation_collection[klass][method_name] += 1
-        return answer
-
+        methods = deprecation_collection.setdefault(
+            args[0].__class__.__name__, {})
+        methods[method_name] = methods.get(method_name, 0) + 1
+        return method(*args, **kwargs)
     return collect
 
 
+_TRACE = 'trace'
+_TIMEIT = 'timeit'
+_DEPRECATED = 'deprecated'
+_WRAPPERS = {_TRACE: _tracer, _TIMEIT: _measurer, _DEPRECATED: _collector}
+
+
+def _is_enabled(kind):
+    if kind == _TRACE:
+        return _debug_
+    if kind == _TIMEIT:
+        return _timeit_collect_
+    return _deprecate_collect_
+
+
+class _Instrumentation(object):
+    """
+        What has been decorated in a function. When the collection of a kind
+        is disabled its wrapper is not installed, so the disabled
+        instrumentation costs nothing in the call.
+    """
+    def __init__(self, function):
+        super(_Instrumentation, self).__init__()
+        self.function = function
+        self.kinds = []
+
+    def build(self):
+        callable_ = self.function
+        for kind in self.kinds:
+            if _is_enabled(kind):
+                callable_ = _WRAPPERS[kind](callable_, self.function.__name__)
+        if callable_ is not self.function:
+            callable_.__name__ = self.function.__name__
+            callable_.__doc__ = self.function.__doc__
+        callable_._instrumentation = self
+        return callable_
+
+
+_instrumented_modules = set()
+_instrumentation_observers = _WeakSet()
+
+
+def _instrument(method, kind):
+    if isinstance(method, property):
+        # decorated over the property: instrument its accessors
+        accessors = [_instrument(accessor, kind)
+                     if accessor is not None else None
+                     for accessor in (method.fget, method.fset, method.fdel)]
+        return property(accessors[0], accessors[1], accessors[2],
+                        method.__doc__)
+    instrumentation = getattr(method, '_instrumentation', None)
+    if instrumentation is None:
+        instrumentation = _Instrumentation(method)
+    instrumentation.kinds.append(kind)
+    _instrumented_modules.add(instrumentation.function.__module__)
+    return instrumentation.build()
+
+
+def _rebuild(value):
+    instrumentation = getattr(value, '_instrumentation', None)
+    if instrumentation is not None:
+        return instrumentation.build()
+    if isinstance(value, property):
+        accessors = [_rebuild(accessor)
+                     for accessor in (value.fget, value.fset, value.fdel)]
+        if any([new is not old for new, old in
+                zip(accessors, (value.fget, value.fset, value.fdel))]):
+            return property(accessors[0], accessors[1], accessors[2],
+                            value.__doc__)
+    return value
+
+
+def add_instrumentation_observer(observer):
+    """
+    Call observer.rebind_instrumented() each time the decorated methods are
+    swapped, to take again the bound methods it has given to others (like
+    the callbacks of the listeners), as they still have the old function.
+    Only a weak reference to the observer is kept.
+    """
+    _instrumentation_observers.add(observer)
+
+
+def _reinstall():
+    """
+    Swap in the decorated functions and methods the wrappers for the kinds
+    of instrumentation now enabled (or the bare function when there is
+    none). The modules of the same packages that have imported a decorated
+    function by name get the new one too, and the observers rebind what
+    they had captured.
+    """
+    replaced = {}
+    for module_name in list(_instrumented_modules):
+        module = _sys.modules.get(module_name)
+        if module is None:
+            continue
+        containers = [module] + [
+            value for value in list(vars(module).values())
+            if isinstance(value, type) and value.__module__ == module_name]
+        for container in containers:
+            for name, value in list(vars(container).items()):
+                if value is None:
+                    continue
+                new = _rebuild(value)
+                if new is not value:
+                    setattr(container, name, new)
+                    replaced[id(value)] = (value, new)
+    packages = set([module_name.split('.')[0]
+                    for module_name in _instrumented_modules])
+    for module_name, module in list(_sys.modules.items()):
+        if module is None or module_name in _instrumented_modules or \
+                module_name.split('.')[0] not in packages:
+            continue
+        for name, value in list(vars(module).items()):
+            old, new = replaced.get(id(value), (None, None))
+            if old is value:
+                setattr(module, name, new)
+    for observer in list(_instrumentation_observers):
+        observer.rebind_instrumented()
+
+
+def trace(method):
+    return _instrument(method, _TRACE)
+
+
+def timeit(method):
+    return _instrument(method, _TIMEIT)
+
+
+def deprecated(method):
+    return _instrument(method, _DEPRECATED)
+
+
 def deprecated_argument(class_name, method_name, argument):
     if _deprecate_collect_:
         dct = deprecation_arguments
@@ -183,6 +334,69 @@ def deprecated_argument(class_name, method_name, argument):
         method_dct[argument] += 1
 
 
+_LOG_QUEUE_SIZE = 10000
+_log_queues = {}  # logger name: (queue handler, writer)
+
+
+class _QueueHandler(_logging.Handler):
+    """
+        Handler that only puts the records in a bounded queue, counting the
+        ones dropped when it is full.
+    """
+    def __init__(self, queue):
+        _logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except _Full:
+            self.dropped += 1
+
+
+class _LogWriter(object):
+    """
+        Thread that takes the records from the queue and gives them to the
+        handlers, so the formatting and the writes to disk (and the file
+        rotations) are done in background.
+    """
+    _sentinel = None
+
+    def __init__(self, queue, handlers):
+        super(_LogWriter, self).__init__()
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = _Thread(name="LogWriter", target=self._write)
+        self._thread.setDaemon(True)
+
+    def start(self):
+        self._thread.start()
+
+    def flush(self):
+        self.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self):
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is self._sentinel:
+                    break
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            finally:
+                self.queue.task_done()
+
+
 class Logger(object):
     """
 This class is a very basic debugging flag mode used as a super class
@@ -214,6 +428,7 @@ for the other classes in this library.
         self.__logging_folder = None
         self.__logging_file = None
         self.__logger_obj = _logging.getLogger(self.__logger_name)
+        self.__bind_methods()
         self.__handler = None
         # setup ---
         self.enable_log(True)
@@ -235,6 +450,9 @@ for the other classes in this library.
                                            '%(name)s - %(message)s')
             self.__handler.setFormatter(formatter)
             self.__logger_obj.addHandler(self.__handler)
+        elif self.__logger_obj.name in _log_queues:
+            # the file handler is behind the queue
+            self.__handler = _log_queues[self.__logger_obj.name][1].handlers[0]
         else:
             self.__handler = self.__logger_obj.handlers[0]
 
@@ -288,6 +506,7 @@ Lower level object from python logging.
     @logger_obj.setter
     def logger_obj(self, obj):
         self.__logger_obj = obj
+        self.__bind_methods()
 
     @property
     def handler(self):
@@ -326,6 +545,58 @@ Easy access method to atomize two operations with the python logging in one
         self.__logger_obj.addHandler(handler)
         self.__handler = handler
 
+    def enable_log_queue(self, size=None):
+        """
+Move the handlers of the python logger behind a bounded queue, attended by a
+background thread. It is shared by all the objects using the same logger.
+        :param size: int (maximum of records waiting to be written)
+        :return: None
+        """
+        with lock:
+            if self.__logger_obj.name in _log_queues:
+                return
+            queue = _Queue(size or _LOG_QUEUE_SIZE)
+            handlers = list(self.__logger_obj.handlers)
+            writer = _LogWriter(queue, handlers)
+            handler = _QueueHandler(queue)
+            for each in handlers:
+                self.__logger_obj.removeHandler(each)
+            self.__logger_obj.addHandler(handler)
+            writer.start()
+            _log_queues[self.__logger_obj.name] = (handler, writer)
+
+    def disable_log_queue(self):
+        """
+Write what is queued and give back the handlers to the python logger.
+        :return: None
+        """
+        with lock:
+            if self.__logger_obj.name not in _log_queues:
+                return
+            handler, writer = _log_queues.pop(self.__logger_obj.name)
+            self.__logger_obj.removeHandler(handler)
+            writer.stop()
+            for each in writer.handlers:
+                self.__logger_obj.addHandler(each)
+
+    def flush_log_queue(self):
+        """
+Wait until the queued records are written.
+        :return: None
+        """
+        if self.__logger_obj.name in _log_queues:
+            _log_queues[self.__logger_obj.name][1].flush()
+
+    @property
+    def log_queue_dropped(self):
+        """
+Records lost because the log queue was full.
+        :return: int
+        """
+        if self.__logger_obj.name in _log_queues:
+            return _log_queues[self.__logger_obj.name][0].dropped
+        return 0
+
     def logging_folder(self):
         """
 Says the patch where the object will write when logs are configured to be
@@ -399,13 +670,7 @@ Only use from with an object of the module to report critical issues.
         :param args: *lst
         :return: None
         """
-        try:
-            if len(args) > 0:
-                msg = msg.format(*args)
-            self.__log_message(msg, logger_CRITICAL)
-        except Exception as exc:
-            self.__log_message("Cannot log {0!r} because {1}".format(msg, exc),
-                               logger_CRITICAL)
+        self.__log(logger_CRITICAL, msg, args)
 
     def _error(self, msg, *args):
         """
@@ -414,13 +679,7 @@ Only use from with an object of the module to report errors.
         :param args: *lst
         :return: None
         """
-        try:
-            if len(args) > 0:
-                msg = msg.format(*args)
-            self.__log_message(msg, logger_ERROR)
-        except Exception as exc:
-            self.__log_message("Cannot log {0!r} because {1}".format(msg, exc),
-                               logger_CRITICAL)
+        self.__log(logger_ERROR, msg, args)
 
     def _warning(self, msg, *args):
         """
@@ -429,13 +688,7 @@ Only use from with an object of the module to report warnings.
         :param args: *lst
         :return: None
         """
-        try:
-            if len(args) > 0:
-                msg = msg.format(*args)
-            self.__log_message(msg, logger_WARNING)
-        except Exception as exc:
-            self.__log_message("Cannot log {0!r} because {1}".format(msg, exc),
-                               logger_CRITICAL)
+        self.__log(logger_WARNING, msg, args)
 
     def _info(self, msg, *args):
         """
@@ -444,13 +697,7 @@ Only use from with an object of the module to report information.
         :param args: *lst
         :return: None
         """
-        try:
-            if len(args) > 0:
-                msg = msg.format(*args)
-            self.__log_message(msg, logger_INFO)
-        except Exception as exc:
-            self.__log_message("Cannot log {0!r} because {1}".format(msg, exc),
-                               logger_CRITICAL)
+        self.__log(logger_INFO, msg, args)
 
     def _debug(self, msg, *args):
         """
@@ -459,11 +706,24 @@ Only use from with an object of the module to report debug messages.
         :param args: *lst
         :return: None
         """
+        if self.__debug_flag:
+            self.__log(logger_DEBUG, msg, args)
+
+    def __log(self, level, msg, args):
+        """
+Format the message, only when it will be emitted, and report it. The long
+arguments are truncated.
+        :param level: int
+        :param msg: str
+        :param args: lst
+        :return: None
+        """
+        if not self.__log2file or not self.__logger_obj.isEnabledFor(level):
+            return
         try:
-            if self.__debug_flag:
-                if len(args) > 0:
-                    msg = msg.format(*args)
-                self.__log_message(msg, logger_DEBUG)
+            if len(args) > 0:
+                msg = msg.format(*[_truncate(arg) for arg in args])
+            self.__log_message(msg, level)
         except Exception as exc:
             self.__log_message("Cannot log {0!r} because {1}".format(msg, exc),
                                logger_CRITICAL)
@@ -475,14 +735,15 @@ Wrapper method to call the python logger and pass the message to be reported.
         :param args: *lst
         :return: None
         """
-        _tag = self._level_str[level]
         if self.__log2file:
-            method = {logger_CRITICAL: self.__logger_obj.critical,
-                      logger_ERROR: self.__logger_obj.error,
-                      logger_WARNING: self.__logger_obj.warn,
-                      logger_INFO: self.__logger_obj.info,
-                      logger_DEBUG: self.__logger_obj.debug}
-            method[level]("{0}: {1}".format(self.name, msg))
+            self.__methods[level]("{0}: {1}".format(self.name, msg))
+
+    def __bind_methods(self):
+        self.__methods = {logger_CRITICAL: self.__logger_obj.critical,
+                          logger_ERROR: self.__logger_obj.error,
+                          logger_WARNING: self.__logger_obj.warning,
+                          logger_INFO: self.__logger_obj.info,
+                          logger_DEBUG: self.__logger_obj.debug}
 
     ##################
     # Internal methods
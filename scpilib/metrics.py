@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .ratelimit import subtree_key
+    from .httpListener import HttpServer, HttpHandler
+    from .httpListener import serve_in_thread, shutdown_server
+except Exception:
+    from logger import Logger as _Logger
+    from ratelimit import subtree_key
+    from httpListener import HttpServer, HttpHandler
+    from httpListener import serve_in_thread, shutdown_server
+from bisect import bisect_left as _bisect_left
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["MetricsRegistry", "MetricsListener", "command_label",
+           "answer_error"]
+
+
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds, in seconds, of the latency histograms
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# more different commands are counted together, so a client sending
+# garbage cannot make the registry grow without limit
+_MAX_COMMANDS = 1000
+_OTHER_COMMAND = 'other'
+
+_ERROR_ANSWERS = ('NOK', 'NotAllow')
+_STRINGS = (str, bytes, type(u''))
+
+
+def command_label(command):
+    """
+    The name of a command as it is reported: the words reduced to the first 4
+    letters (like the command tree does) and the '?' of the queries.
+
+    >>> command_label('SOURce:CURRent:UPPer?')
+    'SOUR:CURR:UPPE?'
+
+    :param command: str
+    :return: str
+    """
+    label = ':'.join(subtree_key(command))
+    if '?' in command.split(' ', 1)[0]:
+        label += '?'
+    return label
+
+
+def answer_error(answer):
+    """
+    The kind of error of an answer, or None if it is not an error.
+    :return: 'NOK', 'NotAllow', 'NaN' or None
+    """
+    if isinstance(answer, float):
+        if answer != answer:
+            return 'NaN'
+    elif isinstance(answer, _STRINGS) and answer in _ERROR_ANSWERS:
+        return str(answer)
+    return None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+class _Histogram(object):
+    def __init__(self):
+        super(_Histogram, self).__init__()
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[_bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts[:]):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def percentile(self, fraction):
+        """
+        Linear interpolation within the bucket where the fraction falls (the
+        last bound when it is in the '+Inf' one).
+        """
+        counts = self.counts[:]
+        total = sum(counts)
+        if total == 0:
+            return float('NaN')
+        rank = fraction * total
+        accumulated = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, counts):
+            if count > 0 and accumulated + count >= rank:
+                return lower + (bound - lower) * (rank - accumulated) / count
+            accumulated += count
+            lower = bound
+        return LATENCY_BUCKETS[-1]
+
+    def render(self, name, pairs):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                name, _labels(pairs + [('le', bound)]), cumulative))
+        lines.append("{0}_sum{1} {2!r}".format(name, _labels(pairs),
+                                               self.sum))
+        lines.append("{0}_count{1} {2}".format(name, _labels(pairs),
+                                               self.count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+        Counters of the commands (requests, errors and latency per command),
+        of the attribute reads and writes and of the bytes moved by the
+        listeners, plus gauges read when the metrics are rendered (like the
+        active connections). The render is in the Prometheus text format.
+
+        The updates are serialized by a lock, but the snapshots (commands()
+        and totals()) don't take it, so querying them doesn't delay the
+        commands being executed. A snapshot can be a few samples behind.
+    """
+
+    def __init__(self):
+        super(MetricsRegistry, self).__init__()
+        self._lock = _threading.Lock()
+        self._gauges = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+            self._errors = {}
+            self._attributes = {}
+            self._bytes = {}
+            self._rejected = {}
+            self._since = _time()
+
+    def observe_command(self, command, answer, seconds):
+        """
+Account a command executed: its answer tells if it has been an error.
+        :param command: str
+        :param answer: what the command tree answered
+        :param seconds: float
+        """
+        label = command_label(command)
+        error = answer_error(answer)
+        with self._lock:
+            histogram = self._commands.get(label)
+            if histogram is None:
+                if len(self._commands) >= _MAX_COMMANDS:
+                    label = _OTHER_COMMAND
+                    histogram = self._commands.get(label)
+                if histogram is None:
+                    histogram = _Histogram()
+                    self._commands[label] = histogram
+            histogram.observe(seconds)
+            if error is not None:
+                key = (label, error)
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def observe_attribute(self, operation, seconds):
+        """
+Account an attribute 'read' or 'write' (the callback of the instrument).
+        """
+        with self._lock:
+            histogram = self._attributes.get(operation)
+            if histogram is None:
+                histogram = _Histogram()
+                self._attributes[operation] = histogram
+            histogram.observe(seconds)
+
+    def count_bytes(self, listener, received=0, sent=0):
+        with self._lock:
+            counters = self._bytes.get(listener)
+            if counters is None:
+                counters = [0, 0]
+                self._bytes[listener] = counters
+            counters[0] += received
+            counters[1] += sent
+
+    def count_rejected(self, listener):
+        """
+Account a connection refused by a listener (kept here, as the listener can be
+rebuilt and restart its own counter).
+        """
+        with self._lock:
+            self._rejected[listener] = self._rejected.get(listener, 0) + 1
+
+    def add_gauge(self, name, description, function, **labels):
+        """
+Report, when rendering, what the function answers at that moment.
+        :param name: str (like 'scpi_active_connections')
+        :param description: str
+        :param function: callable without arguments that returns a number
+        :param labels: to distinguish the gauges with the same name
+        """
+        with self._lock:
+            self._gauges.append((name, description, function,
+                                 sorted(labels.items())))
+
+    def remove_gauges(self, **labels):
+        """
+Forget the gauges that have these labels (like a listener that is closed).
+        """
+        labels = sorted(labels.items())
+        with self._lock:
+            self._gauges = [gauge for gauge in self._gauges
+                            if not all([pair in gauge[3] for pair in labels])]
+
+    def commands(self):
+        """
+Snapshot of the per command counters, with the 50 and 99 percentiles of the
+latency (interpolated in the histogram buckets).
+        :return: dict {command: {'requests', 'errors', 'seconds', 'p50',
+                                 'p99'}}
+        """
+        answer = {}
+        for label, histogram in list(self._commands.items()):
+            answer[label] = {'requests': histogram.count, 'errors': 0,
+                             'seconds': histogram.sum,
+                             'p50': histogram.percentile(0.5),
+                             'p99': histogram.percentile(0.99)}
+        for (label, error), count in list(self._errors.items()):
+            if label in answer:
+                answer[label]['errors'] += count
+        return answer
+
+    def totals(self):
+        """
+Snapshot of the counters of all the commands and listeners since the last
+reset: commands (and per second), errors, latency percentiles, bytes and
+rejected connections.
+        :return: dict
+        """
+        merged = _Histogram()
+        for histogram in list(self._commands.values()):
+            merged.merge(histogram)
+        elapsed = _time() - self._since
+        byte_counters = list(self._bytes.values())
+        return {'commands': merged.count,
+                'rate': merged.count / elapsed if elapsed > 0 else 0.0,
+                'errors': sum(list(self._errors.values())),
+                'p50': merged.percentile(0.5),
+                'p99': merged.percentile(0.99),
+                'received': sum([counters[0] for counters in byte_counters]),
+                'sent': sum([counters[1] for counters in byte_counters]),
+                'rejected': sum(list(self._rejected.values()))}
+
+    def render(self):
+        """
+The metrics in the Prometheus text exposition format.
+        :return: str
+        """
+        lines = []
+        with self._lock:
+            self._render_commands(lines)
+            self._render_attributes(lines)
+            self._render_bytes(lines)
+            self._render_rejected(lines)
+            gauges = list(self._gauges)
+        self._render_gauges(gauges, lines)
+        return '\n'.join(lines) + '\n'
+
+    def _render_commands(self, lines):
+        lines.append("# HELP scpi_commands_total Commands executed.")
+        lines.append("# TYPE scpi_commands_total counter")
+        for label in sorted(self._commands):
+            lines.append("scpi_commands_total{0} {1}".format(
+                _labels([('command', label)]), self._commands[label].count))
+        lines.append("# HELP scpi_command_errors_total Commands answered "
+                     "with NOK, NotAllow or NaN.")
+        lines.append("# TYPE scpi_command_errors_total counter")
+        for (label, error) in sorted(self._errors):
+            lines.append("scpi_command_errors_total{0} {1}".format(
+                _labels([('command', label), ('error', error)]),
+                self._errors[(label, error)]))
+        lines.append("# HELP scpi_command_duration_seconds Time to execute "
+                     "the commands.")
+        lines.append("# TYPE scpi_command_duration_seconds histogram")
+        for label in sorted(self._commands):
+            lines += self._commands[label].render(
+                'scpi_command_duration_seconds', [('command', label)])
+
+    def _render_attributes(self, lines):
+        lines.append("# HELP scpi_attribute_duration_seconds Time in the "
+                     "attribute callbacks.")
+        lines.append("# TYPE scpi_attribute_duration_seconds histogram")
+        for operation in sorted(self._attributes):
+            lines += self._attributes[operation].render(
+                'scpi_attribute_duration_seconds',
+                [('operation', operation)])
+
+    def _render_bytes(self, lines):
+        for position, name, description in \
+                [(0, 'scpi_received_bytes_total', "Bytes received."),
+                 (1, 'scpi_sent_bytes_total', "Bytes sent.")]:
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} counter".format(name))
+            for listener in sorted(self._bytes):
+                lines.append("{0}{1} {2}".format(
+                    name, _labels([('listener', listener)]),
+                    self._bytes[listener][position]))
+
+    def _render_rejected(self, lines):
+        lines.append("# HELP scpi_rejected_connections_total Connections "
+                     "refused by the listeners.")
+        lines.append("# TYPE scpi_rejected_connections_total counter")
+        for listener in sorted(self._rejected):
+            lines.append("scpi_rejected_connections_total{0} {1}".format(
+                _labels([('listener', listener)]), self._rejected[listener]))
+
+    def _render_gauges(self, gauges, lines):
+        described = set()
+        for name, description, function, pairs in gauges:
+            try:
+                value = function()
+            except Exception:
+                continue
+            if name not in described:
+                lines.append("# HELP {0} {1}".format(name, description))
+                lines.append("# TYPE {0} gauge".format(name))
+                described.add(name)
+            lines.append("{0}{1} {2}".format(name, _labels(pairs), value))
+
+
+class _Handler(HttpHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.listener.registry.render().encode('utf-8')
+        self.send_body(200, CONTENT_TYPE, body)
+
+
+class MetricsListener(_Logger):
+    """
+        Serves 'GET /metrics' for a Prometheus server to scrape the
+        registry, in a port apart from the instrument ones.
+    """
+
+    _registry = None
+    _local = None
+    _port = None
+    _server = None
+    _listener = None
+
+    def __init__(self, name=None, registry=None, local=True, port=9100,
+                 *args, **kwargs):
+        super(MetricsListener, self).__init__(*args, **kwargs)
+        self._name = name or "MetricsListener"
+        self._registry = registry or MetricsRegistry()
+        self._local = local
+        self._port = port
+        self._server = HttpServer(
+            self, ('127.0.0.1' if self._local else '0.0.0.0', self._port),
+            _Handler)
+        self._listener = serve_in_thread(self._server, self._name)
+        self._debug("Listener thread prepared")
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def registry(self):
+        return self._registry
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server else self._port
+
+    def listen(self):
+        self._debug("Launching listener thread")
+        self._listener.start()
+
+    def is_alive(self):
+        return self._listener.is_alive()
+
+    def is_listening(self):
+        return self._server is not None
+
+    def close(self):
+        if self._server is None:
+            return
+        self._debug("{0} close received", self._name)
+        shutdown_server(self._server, self._listener)
+        self._server = None
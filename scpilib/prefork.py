@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .tcpListener import TcpListener, resolve_socket_options
+except Exception:
+    from logger import Logger as _Logger
+    from tcpListener import TcpListener, resolve_socket_options
+import multiprocessing as _multiprocessing
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["PreforkListener"]
+
+
+try:
+    _mp = _multiprocessing.get_context('fork')
+except AttributeError:
+    _mp = _multiprocessing  # python 2 always forks
+_JOIN_TIMEOUT = 1  # seconds to wait the workers when closing
+
+
+def is_read_only(line):
+    """
+    Check if a request can be attended by any worker process: all its
+    commands are queries of the command tree. Writes, special commands
+    (like '*RST'), the SYSTem subtree (where the locks are) and the commands
+    completed with the previous one (starting with ':') are for the
+    authoritative process.
+
+    :param line: str
+    :return: bool
+    """
+    for command in line.split(';'):
+        command = command.strip()
+        if len(command) == 0:
+            continue
+        if '?' not in command or command[0] in '*:' or \
+                command[:4].upper() == 'SYST':
+            return False
+    return True
+
+
+class PreforkListener(_Logger):
+    """
+        Spread the read only queries over many processes to scale beyond the
+        GIL. Each worker is a forked copy of the process (so, with the same
+        command tree) that binds the same port with SO_REUSEPORT, letting the
+        kernel balance the connections between them.
+
+        The requests that may change the state (writes, special commands and
+        the SYSTem subtree with the locks) are forwarded to the process that
+        built this object, the authoritative one, where they are executed
+        with the name of the client connection so the Locker semantics are
+        kept. While any lock is taken, all the requests are forwarded, and
+        when a worker connection finishes its locks are released in the
+        authoritative process (with the 'release_cb').
+
+        The read callbacks are executed in the workers, so they must read
+        from the hardware or from a state shared between processes, not from
+        python objects modified by the write callbacks. For the same reason,
+        the metrics of the queries attended by the workers are not collected
+        (only the forwarded requests are counted).
+    """
+
+    _callback = None
+    _locked_cb = None
+    _release_cb = None
+    _n_workers = None
+
+    _local = None
+    _port = None
+
+    def __init__(self, name=None, callback=None, locked_cb=None, local=True,
+                 port=5025, workers=None, socket_options=None,
+                 release_cb=None, *args, **kwargs):
+        super(PreforkListener, self).__init__(name=name or "PreforkListener")
+        if workers is None:
+            workers = _multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError("At least one worker process is required")
+        self._callback = callback
+        self._locked_cb = locked_cb
+        self._release_cb = release_cb
+        self._local = local
+        self._port = port
+        self._n_workers = workers
+        self._socket_options = resolve_socket_options(socket_options)
+        self._socket_options['reuseport'] = True
+        self._listener_args = args
+        self._listener_kwargs = kwargs
+        self._lock_flag = _mp.Value('b', 0, lock=False)
+        self._stop_event = _mp.Event()
+        self._workers = []
+        self._authorities = []
+        self._forwarded = 0
+        self._forward_lock = None
+        self._worker_connection = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def local(self):
+        return self._local
+
+    @property
+    def workers(self):
+        return self._n_workers
+
+    @property
+    def forwarded(self):
+        """
+Number of requests attended by the authoritative process.
+        """
+        return self._forwarded
+
+    @property
+    def callback(self):
+        """
+            The callable the requests are given to. When it is replaced, the
+            connections already open use the new one from the next request.
+        """
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        self._callback = callback
+
+    def listen(self):
+        self._debug("Launching {0:d} worker processes", self._n_workers)
+        self._stop_event.clear()
+        for i in range(self._n_workers):
+            parent_end, child_end = _mp.Pipe()
+            worker = _mp.Process(name="{0}{1:d}".format(self.name, i),
+                                 target=self._worker,
+                                 args=(i, child_end, parent_end))
+            worker.daemon = True
+            worker.start()
+            child_end.close()
+            authority = _threading.Thread(
+                name="{0}Authority{1:d}".format(self.name, i),
+                target=self._authority, args=(parent_end,))
+            authority.setDaemon(True)
+            authority.start()
+            self._workers.append(worker)
+            self._authorities.append((authority, parent_end))
+
+    def close(self):
+        if len(self._workers) == 0:
+            return
+        self._debug("{0} close received", self.name)
+        self._stop_event.set()
+        deadline = _time() + _JOIN_TIMEOUT
+        for worker in self._workers:
+            worker.join(max(deadline - _time(), 0))
+            if worker.is_alive():
+                self._warning("Worker {0} doesn't finish, terminate it",
+                              worker.name)
+                worker.terminate()
+        for authority, connection in self._authorities:
+            authority.join(max(deadline - _time(), 0))
+            connection.close()
+        self._workers = []
+        self._authorities = []
+        self._debug("Everything is close, exiting...")
+
+    def is_alive(self):
+        return any([worker.is_alive() for worker in self._workers])
+
+    def is_listening(self):
+        return self.is_alive()
+
+    # authoritative process side ---
+
+    def _authority(self, connection):
+        while True:
+            try:
+                client, line = connection.recv()
+            except (EOFError, IOError):
+                break
+            if line is None:
+                # the connection has finished in the worker
+                answer = self._release(client)
+            else:
+                answer = self._execute(client, line)
+            if self._locked_cb is not None:
+                self._lock_flag.value = int(bool(self._locked_cb()))
+            try:
+                connection.send(answer)
+            except (EOFError, IOError):
+                break
+        self._debug("Authority thread finishing")
+
+    def _execute(self, client, line):
+        # the locker identifies the owner by the thread name
+        _threading.current_thread().name = client
+        try:
+            answer = self._callback(line)
+        except Exception as exc:
+            self._error("Forwarded request {0!r} from {1} failed: {2}",
+                        line, client, exc)
+            answer = ''
+        self._forwarded += 1
+        return answer
+
+    def _release(self, client):
+        if self._release_cb is not None:
+            try:
+                self._release_cb(client)
+            except Exception as exc:
+                self._error("Cannot release the locks of {0}: {1}",
+                            client, exc)
+        return None
+
+    # worker process side ---
+
+    def _worker(self, index, connection, parent_end):
+        parent_end.close()
+        self._worker_connection = connection
+        self._forward_lock = _threading.Lock()
+        listener = TcpListener(name="{0}{1:d}".format(self.name, index),
+                               callback=self._worker_input,
+                               local=self._local, port=self._port,
+                               socket_options=self._socket_options,
+                               release_cb=self._worker_release,
+                               *self._listener_args, **self._listener_kwargs)
+        listener.listen()
+        self._stop_event.wait()
+        listener.close()
+        connection.close()
+
+    def _worker_input(self, line):
+        if not self._lock_flag.value and is_read_only(line):
+            return self._callback(line)
+        with self._forward_lock:
+            self._worker_connection.send(
+                (_threading.current_thread().name, line))
+            return self._worker_connection.recv()
+
+    def _worker_release(self, client):
+        # only a client that has been forwarded can have a lock
+        if not self._lock_flag.value:
+            return
+        with self._forward_lock:
+            self._worker_connection.send((client, None))
+            self._worker_connection.recv()
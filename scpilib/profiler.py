@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+except Exception:
+    from logger import Logger as _Logger
+import cProfile as _cProfile
+import os as _os
+import pstats as _pstats
+import sys as _sys
+import threading as _threading
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["Profiler", "PROFILE_CPROFILE", "PROFILE_SAMPLING"]
+
+
+PROFILE_CPROFILE = 'cprofile'  # deterministic, of the commands executed
+PROFILE_SAMPLING = 'sampling'  # periodic snapshot of the stacks
+PROFILE_MODES = [PROFILE_CPROFILE, PROFILE_SAMPLING]
+
+_SAMPLING_INTERVAL = 0.005  # seconds
+
+
+def _frame_name(code):
+    return "{0} ({1}:{2:d})".format(code.co_name,
+                                    _os.path.basename(code.co_filename),
+                                    code.co_firstlineno)
+
+
+def _collapsed_stack(thread_name, frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(thread_name)
+    names.reverse()
+    return ';'.join(names)
+
+
+class Profiler(_Logger):
+    """
+        Profiles the execution of the commands, from whatever thread
+        (listeners or dispatcher workers) they come.
+
+        With 'cprofile' each thread has its own cProfile, enabled only while
+        the thread is in call(), and they are merged at the end in a pstats
+        file. With 'sampling' a thread takes, periodically, the stack of all
+        the others: it costs nothing to the commands and the result is in
+        the collapsed stack format (one 'frame;frame;... count' per line)
+        that the flamegraph tools read.
+    """
+
+    _mode = None
+    _interval = None
+    _profiles = None
+    _depth = None
+    _samples = None
+    _sampler = None
+    _join_event = None
+    _active = None
+    _condition = None
+
+    def __init__(self, name=None, mode=PROFILE_CPROFILE,
+                 interval=_SAMPLING_INTERVAL, *args, **kwargs):
+        super(Profiler, self).__init__(*args, **kwargs)
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode {0!r} (use one of {1})"
+                             "".format(mode, PROFILE_MODES))
+        self._name = name or "Profiler"
+        self._mode = mode
+        self._interval = interval
+        self._profiles = {}
+        self._depth = _threading.local()
+        self._samples = {}
+        self._join_event = _threading.Event()
+        # threads in call(), that stop() waits before dumping their profiles
+        self._active = set()
+        self._condition = _threading.Condition()
+        if mode == PROFILE_SAMPLING:
+            self._sampler = _threading.Thread(name=self._name,
+                                              target=self._sample)
+            self._sampler.setDaemon(True)
+            self._sampler.start()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def tracing(self):
+        """
+            If the calls have to go through call().
+        """
+        return self._mode == PROFILE_CPROFILE and \
+            not self._join_event.isSet()
+
+    @property
+    def samples(self):
+        return sum(self._samples.values())
+
+    def call(self, function, *args):
+        """
+Execute the function with the profile of the current thread enabled.
+        """
+        depth = getattr(self._depth, 'value', 0)
+        if depth > 0:
+            return function(*args)
+        ident = _threading.current_thread().ident
+        with self._condition:
+            if not self.tracing:
+                profile = None
+            else:
+                profile = self._profiles.get(ident)
+                if profile is None:
+                    profile = _cProfile.Profile()
+                    self._profiles[ident] = profile
+                self._active.add(ident)
+        if profile is None:
+            return function(*args)
+        self._depth.value = depth + 1
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            self._depth.value = depth
+            with self._condition:
+                self._active.discard(ident)
+                self._condition.notify_all()
+
+    def stop(self, path):
+        """
+Stop profiling and write the result in the path: pstats for 'cprofile' and
+collapsed stacks for 'sampling'.
+        :param path: str
+        :return: str (the path)
+        """
+        own = _threading.current_thread().ident
+        with self._condition:
+            self._join_event.set()
+            # the profiles cannot be read while they are being filled (but
+            # stop() can be called from a command being profiled)
+            while len(self._active - set([own])) > 0:
+                self._condition.wait()
+        if self._sampler is not None:
+            self._sampler.join(1)
+        if self._mode == PROFILE_CPROFILE:
+            self._dump_stats(path)
+        else:
+            self._dump_collapsed(path)
+        self._info("Profile ({0}) written in {1}", self._mode, path)
+        return path
+
+    def _dump_stats(self, path):
+        profiles = list(self._profiles.values())
+        if len(profiles) == 0:
+            # nothing executed, but the file has to be a valid pstats
+            profiles = [_cProfile.Profile()]
+            profiles[0].enable()
+            profiles[0].disable()
+        stats = _pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+    def _dump_collapsed(self, path):
+        with open(path, 'w') as output:
+            for stack in sorted(self._samples):
+                output.write("{0} {1:d}\n".format(stack,
+                                                  self._samples[stack]))
+
+    def _sample(self):
+        own = _threading.current_thread().ident
+        while not self._join_event.wait(self._interval):
+            names = dict((thread.ident, thread.name)
+                         for thread in _threading.enumerate())
+            for ident, frame in list(_sys._current_frames().items()):
+                if ident == own:
+                    continue
+                stack = _collapsed_stack(names.get(ident, str(ident)), frame)
+                self._samples[stack] = self._samples.get(stack, 0) + 1
+        self._debug("Sampler finishing with {0:d} samples", self.samples)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+except Exception:
+    from logger import Logger as _Logger
+import threading as _threading
+from time import sleep as _sleep
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["TokenBucket", "RateLimiter", "Throttled", "subtree_key",
+           "RATE_LIMIT_DELAY", "RATE_LIMIT_REJECT"]
+
+
+RATE_LIMIT_DELAY = 'delay'  # wait until the command is allowed
+RATE_LIMIT_REJECT = 'reject'  # answer 'NotAllow'
+_RATE_LIMIT_POLICIES = [RATE_LIMIT_DELAY, RATE_LIMIT_REJECT]
+
+# every how many commands the buckets of the gone clients are forgotten
+_PRUNE_PERIOD = 1000
+
+
+def subtree_key(command):
+    """
+    The words of a command reduced like the command tree does, to the first
+    4 letters, to compare them whatever form the client has used.
+
+    >>> subtree_key('SOURce:CURRent:UPPer 1.0')
+    ('SOUR', 'CURR', 'UPPE')
+
+    :param command: str
+    :return: tuple
+    """
+    command = command.strip().lstrip(':').split(' ', 1)[0].rstrip('?')
+    return tuple(word[:4].upper() for word in command.split(':'))
+
+
+class Throttled(Exception):
+    """
+        A line that cannot be executed yet: the caller, that cannot wait,
+        has to give it again after 'wait' seconds.
+    """
+    def __init__(self, wait):
+        super(Throttled, self).__init__(
+            "Throttled for {0:.3f} s".format(wait))
+        self.wait = wait
+
+
+class TokenBucket(object):
+    """
+        Allows 'rate' commands per second, with bursts of up to 'burst'.
+    """
+    def __init__(self, rate, burst=None):
+        super(TokenBucket, self).__init__()
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self._burst
+        self._when = _time()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def full(self):
+        self._refill(_time())
+        return self._tokens >= self._burst
+
+    def wait(self, count=1):
+        """
+The seconds to wait until there are 'count' tokens, without taking them.
+        :return: float
+        """
+        self._refill(_time())
+        if self._tokens >= count:
+            return 0.0
+        return (count - self._tokens) / self._rate
+
+    def take(self, reserve=False, count=1):
+        """
+Take a token. When there is none, return the seconds to wait for it and,
+if 'reserve', take it anyway (it will be the one the caller waits for).
+        :return: float
+        """
+        wait = self.wait(count)
+        if wait == 0 or reserve:
+            self._tokens -= count
+        return wait
+
+    def _refill(self, now):
+        self._tokens = min(self._burst,
+                           self._tokens + (now - self._when) * self._rate)
+        self._when = now
+
+
+def _bucket_arguments(limit):
+    if isinstance(limit, (tuple, list)):
+        return limit
+    return limit, None
+
+
+class RateLimiter(_Logger):
+    """
+        Token bucket limits per client: one for all the commands of the
+        client and one for each of the configured subtrees. The subtrees
+        are given like the commands ('*IDN', 'MEASure:VOLTage').
+    """
+
+    _policy = None
+    _connection_limit = None
+    _subtree_limits = None
+    _buckets = None
+    _counters = None
+    _lock = None
+
+    def __init__(self, connection=None, subtrees=None, policy=None,
+                 *args, **kwargs):
+        super(RateLimiter, self).__init__(*args, **kwargs)
+        if policy is None:
+            policy = RATE_LIMIT_DELAY
+        if policy not in _RATE_LIMIT_POLICIES:
+            raise ValueError("Unknown rate limit policy {0!r} (use one of "
+                             "{1})".format(policy, _RATE_LIMIT_POLICIES))
+        self._name = "RateLimiter"
+        self._policy = policy
+        self._connection_limit = None
+        if connection is not None:
+            self._connection_limit = _bucket_arguments(connection)
+        self._subtree_limits = []
+        for subtree, limit in (subtrees or {}).items():
+            self._subtree_limits.append((subtree_key(subtree),
+                                         _bucket_arguments(limit)))
+        self._buckets = {}
+        self._counters = {}
+        self._lock = _threading.Lock()
+        self._commands = 0
+
+    @property
+    def policy(self):
+        return self._policy
+
+    def acquire(self, owner, command):
+        """
+Check if the owner can execute the command. With the 'delay' policy it waits
+until it can, with the 'reject' one returns False.
+        :param owner: str (the connection name)
+        :param command: str
+        :return: bool
+        """
+        with self._lock:
+            wait = 0.0
+            for bucket in self._owner_buckets(owner, subtree_key(command)):
+                wait = max(wait, bucket.take(
+                    reserve=self._policy == RATE_LIMIT_DELAY))
+            counters = self._owner_counters(owner)
+            counters['commands'] += 1
+            if wait > 0:
+                if self._policy == RATE_LIMIT_REJECT:
+                    counters['rejected'] += 1
+                else:
+                    counters['throttled'] += 1
+                    counters['delay'] += wait
+            self._commands += 1
+            if self._commands % _PRUNE_PERIOD == 0:
+                self._prune()
+        if wait > 0:
+            if self._policy == RATE_LIMIT_REJECT:
+                self._debug("Reject {0!r} from {1}", command, owner)
+                return False
+            self._debug("Delay {0!r} from {1} {2:.3f} s", command, owner,
+                        wait)
+            _sleep(wait)
+        return True
+
+    def delay(self, owner, commands, reserve=True):
+        """
+The seconds the owner has to wait before executing the commands of a line.
+With 'reserve' the tokens are taken anyway (they are the ones the caller
+waits for); otherwise they are only taken when there is no wait, and the
+caller has to ask again later.
+        :param owner: str (the connection name)
+        :param commands: list of str
+        :param reserve: bool
+        :return: float
+        """
+        with self._lock:
+            counts = {}
+            for command in commands:
+                for bucket in self._owner_buckets(owner,
+                                                  subtree_key(command)):
+                    counts[bucket] = counts.get(bucket, 0) + 1
+            wait = max([bucket.wait(count)
+                        for bucket, count in counts.items()] or [0.0])
+            counters = self._owner_counters(owner)
+            if wait > 0:
+                counters['throttled'] += len(commands)
+                counters['delay'] += wait
+            if wait == 0 or reserve:
+                for bucket, count in counts.items():
+                    bucket.take(reserve=True, count=count)
+                counters['commands'] += len(commands)
+                self._commands += len(commands)
+                if self._commands % _PRUNE_PERIOD < len(commands):
+                    self._prune()
+        if wait > 0:
+            self._debug("Delay {0!r} from {1} {2:.3f} s", commands, owner,
+                        wait)
+        return wait
+
+    def statistics(self):
+        """
+Per client counters: the commands, the ones delayed ('throttled') with the
+total 'delay' and the ones 'rejected'.
+        :return: dict
+        """
+        with self._lock:
+            return dict((owner, dict(counters))
+                        for owner, counters in self._counters.items())
+
+    def reset_statistics(self):
+        with self._lock:
+            self._counters = {}
+
+    def _owner_buckets(self, owner, words):
+        buckets = []
+        if self._connection_limit is not None:
+            buckets.append(self._bucket((owner, None),
+                                        self._connection_limit))
+        for subtree, limit in self._subtree_limits:
+            if words[:len(subtree)] == subtree:
+                buckets.append(self._bucket((owner, subtree), limit))
+        return buckets
+
+    def _bucket(self, key, limit):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _owner_counters(self, owner):
+        counters = self._counters.get(owner)
+        if counters is None:
+            counters = {'commands': 0, 'throttled': 0, 'rejected': 0,
+                        'delay': 0.0}
+            self._counters[owner] = counters
+        return counters
+
+    def _prune(self):
+        # a full bucket is like a new one, and the quiet clients don't
+        # need to be reported
+        for key, bucket in list(self._buckets.items()):
+            if bucket.full:
+                self._buckets.pop(key)
+        for owner, counters in list(self._counters.items()):
+            if counters['throttled'] == 0 and counters['rejected'] == 0 and \
+                    not any([key[0] == owner for key in self._buckets]):
+                self._counters.pop(owner)
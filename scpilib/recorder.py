@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+from __future__ import print_function
+try:
+    from .logger import Logger as _Logger
+    from .metrics import answer_error
+except Exception:
+    from logger import Logger as _Logger
+    from metrics import answer_error
+import csv as _csv
+from itertools import count as _count
+import json as _json
+import mmap as _mmap
+import os as _os
+import struct as _struct
+import sys as _sys
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["CommandRecorder", "read_records"]
+
+
+# file header: magic, version, record size, capacity, records written
+HEADER = _struct.Struct('<8sHHIQ')
+HEADER_SIZE = 64
+MAGIC = b'SCPITRC\0'
+VERSION = 2
+# record: sequence number, timestamp (ns), latency (ns), answer size, status,
+#   command length, connection and command (both truncated to the field)
+RECORD = _struct.Struct('<QQQIBH22s75s')
+_WRITTEN = _struct.Struct('<Q')
+CONNECTION_SIZE = 22
+COMMAND_SIZE = 75
+
+STATUS_OK = 0
+STATUSES = ['OK', 'NOK', 'NotAllow', 'NaN']
+_STATUS_OF_STRINGS = {'NOK': 1, 'NotAllow': 2}
+
+_CAPACITY = 65536  # records (8 MB)
+_STRINGS = (str, bytes, type(u''))
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('latin-1', 'replace')
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value
+    return value.decode('latin-1')
+
+
+class CommandRecorder(_Logger):
+    """
+        Binary trace of the commands in a ring buffer of fixed size records,
+        mapped from a file: when it is full the oldest records are
+        overwritten. Recording is packing a record in its slot, without
+        locks nor formatting, so it can be kept enabled. As the file is
+        mapped, what has been recorded survives a crash of the process.
+
+        An existing trace with the same format and capacity is continued;
+        any other file in the path is renamed with a '.old' suffix.
+
+        Use read_records() (or 'python -m scpilib.recorder') to decode it.
+    """
+
+    _path = None
+    _capacity = None
+    _file = None
+    _map = None
+    _slots = None
+
+    def __init__(self, path, capacity=None, *args, **kwargs):
+        super(CommandRecorder, self).__init__(*args, **kwargs)
+        self._name = "CommandRecorder"
+        self._path = path
+        self._capacity = capacity or _CAPACITY
+        size = HEADER_SIZE + RECORD.size * self._capacity
+        written = self._previous_records(size)
+        if written is None:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            written = 0
+        else:
+            self._file = open(path, 'r+b')
+        self._map = _mmap.mmap(self._file.fileno(), size)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size,
+                         self._capacity, written)
+        # next() of a count is atomic, so the threads get different slots
+        self._slots = _count(written)
+        self._debug("Recording {0:d} commands in {1} (after {2:d})",
+                    self._capacity, path, written)
+
+    def _previous_records(self, size):
+        """
+        The sequence number to continue a trace already in the path, or None
+        when there is nothing to continue (the file that was there, if any,
+        is kept aside).
+        """
+        if not _os.path.exists(self._path):
+            return None
+        try:
+            with open(self._path, 'rb') as trace:
+                content = trace.read(size)
+            magic, version, record_size, capacity, written = \
+                HEADER.unpack_from(content, 0)
+        except Exception:
+            magic = None
+        if magic != MAGIC or version != VERSION or \
+                record_size != RECORD.size or \
+                capacity != self._capacity or len(content) != size:
+            aside = self._path + '.old'
+            self._warning("{0} is not a trace like this one, renamed to {1}",
+                          self._path, aside)
+            _os.rename(self._path, aside)
+            return None
+        # the total in the header can be behind after a crash
+        for i in range(capacity):
+            sequence, timestamp = RECORD.unpack_from(
+                content, HEADER_SIZE + i*RECORD.size)[:2]
+            if timestamp != 0:
+                written = max(written, sequence + 1)
+        return written
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def record(self, connection, command, answer, latency):
+        """
+Record a command executed.
+        :param connection: str (the connection name)
+        :param command: str
+        :param answer: what the command tree answered
+        :param latency: int (nanoseconds)
+        """
+        mapped = self._map
+        if mapped is None:
+            return
+        index = next(self._slots)
+        if isinstance(answer, _STRINGS):
+            size = len(answer)
+            status = _STATUS_OF_STRINGS.get(answer, STATUS_OK)
+        else:
+            size = len(str(answer))
+            error = answer_error(answer)
+            status = STATUS_OK if error is None else STATUSES.index(error)
+        command = _bytes(command)
+        RECORD.pack_into(
+            mapped, HEADER_SIZE + (index % self._capacity) * RECORD.size,
+            index, int(_time() * 1e9), latency, size, status,
+            min(len(command), 0xffff), _bytes(connection), command)
+        # the total, not only what is in the buffer
+        _WRITTEN.pack_into(mapped, HEADER.size - _WRITTEN.size, index + 1)
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is None:
+            return
+        mapped, self._map = self._map, None
+        mapped.flush()
+        mapped.close()
+        self._file.close()
+
+
+def read_records(path):
+    """
+Decode a trace file, in the order the records have been taken (the oldest
+first).
+    :param path: str
+    :return: list of dict
+    """
+    with open(path, 'rb') as trace:
+        content = trace.read()
+    magic, version, record_size, capacity = \
+        HEADER.unpack_from(content, 0)[:4]
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError("{0} is not a command trace (version {1})"
+                         "".format(path, VERSION))
+    records = []
+    # the slots not written are zeros; the total in the header can be
+    # behind by the records being written in other threads
+    for i in range(capacity):
+        (sequence, timestamp, latency, size, status, length, connection,
+         command) = RECORD.unpack_from(content, HEADER_SIZE + i*RECORD.size)
+        if timestamp == 0:
+            continue
+        records.append({'sequence': sequence,
+                        'timestamp': timestamp, 'latency': latency,
+                        'connection': _text(connection.rstrip(b'\0')),
+                        'command': _text(command[:length]),
+                        'truncated': length > COMMAND_SIZE,
+                        'answer_size': size, 'status': STATUSES[status]})
+    # the clock can go backwards, but not the slots
+    records.sort(key=lambda record: record['sequence'])
+    return records
+
+
+_FIELDS = ['sequence', 'timestamp', 'latency', 'connection', 'command',
+           'truncated', 'answer_size', 'status']
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] trace_file")
+    parser.add_option('', "--format", default='csv',
+                      help="Output format: csv or json")
+    (options, args) = parser.parse_args()
+    if len(args) != 1 or options.format not in ('csv', 'json'):
+        parser.error("one trace file and a format 'csv' or 'json'")
+    records = read_records(args[0])
+    if options.format == 'json':
+        _json.dump(records, _sys.stdout, indent=1)
+        print()
+    else:
+        writer = _csv.DictWriter(_sys.stdout, _FIELDS)
+        writer.writerow(dict(zip(_FIELDS, _FIELDS)))
+        writer.writerows(records)
+
+
+if __name__ == '__main__':
+    main()
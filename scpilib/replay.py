@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+from __future__ import print_function
+try:
+    from .logger import Logger as _Logger
+    from .latency import StreamingStatistics, perf_counter_ns
+    from .recorder import read_records, MAGIC
+except Exception:
+    from logger import Logger as _Logger
+    from latency import StreamingStatistics, perf_counter_ns
+    from recorder import read_records, MAGIC
+import csv as _csv
+import json as _json
+import socket as _socket
+import sys as _sys
+import threading as _threading
+from time import sleep as _sleep
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["Replay", "load_session", "answer_status"]
+
+
+_DEFAULT_CONNECTION = 'replay'
+# answers that differ are reported, but only the first ones are kept
+_MAX_EXAMPLES = 10
+_ANSWER_STATUS = {'NOK': 'NOK', 'NotAllow': 'NotAllow', 'nan': 'NaN'}
+
+
+def answer_status(answer):
+    """
+    Status of an answer as received by a client ('OK', 'NOK', 'NotAllow' or
+    'NaN'), like the recorder stores it.
+    """
+    return _ANSWER_STATUS.get(answer.strip(), 'OK')
+
+
+def load_session(path):
+    """
+Read the commands captured: a binary trace of the recorder, a csv like the
+one of its decoder (with at least the 'command' column) or a text file with
+a command per line (optionally preceded by the connection and a tab). A
+csv can also have the exact 'answer' expected (like in a test scenario).
+    :param path: str
+    :return: list of dict, with the 'command', 'connection', 'timestamp' (ns,
+             or None) and, if they were captured, 'status', 'answer_size' and
+             'answer'
+    """
+    with open(path, 'rb') as capture:
+        magic = capture.read(len(MAGIC))
+    if magic == MAGIC:
+        return read_records(path)
+    with open(path, 'r') as capture:
+        first = capture.readline()
+        capture.seek(0)
+        if 'command' in first.split(','):
+            records = list(_csv.DictReader(capture))
+        else:
+            records = []
+            for line in capture:
+                line = line.rstrip('\r\n')
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+                connection, _, command = line.rpartition('\t')
+                records.append({'connection': connection, 'command': command})
+    for record in records:
+        record['connection'] = record.get('connection') or \
+            _DEFAULT_CONNECTION
+        timestamp = record.get('timestamp')
+        record['timestamp'] = int(timestamp) if timestamp else None
+        if record.get('answer_size') not in (None, ''):
+            record['answer_size'] = int(record['answer_size'])
+        else:
+            record['answer_size'] = None
+        record['status'] = record.get('status') or None
+        record['answer'] = record.get('answer') or None
+        record['truncated'] = record.get('truncated') in (True, 'True')
+    return records
+
+
+class _TcpClient(object):
+    def __init__(self, address, timeout):
+        super(_TcpClient, self).__init__()
+        self._socket = _socket.create_connection(address, timeout)
+        self._received = b''
+
+    def __call__(self, command):
+        if not isinstance(command, bytes):
+            command = command.encode('latin-1')
+        self._socket.sendall(command + b'\n')
+        try:
+            while b'\r\n' not in self._received:
+                data = self._socket.recv(65536)
+                if not data:
+                    break
+                self._received += data
+        except _socket.timeout:
+            # some commands have no answer
+            return ''
+        answer, _, self._received = self._received.partition(b'\r\n')
+        return answer.decode('latin-1')
+
+    def close(self):
+        self._socket.close()
+
+
+class _InputClient(object):
+    def __init__(self, function):
+        super(_InputClient, self).__init__()
+        self._function = function
+
+    def __call__(self, command):
+        return self._function(command).rstrip('\r\n')
+
+    def close(self):
+        pass
+
+
+class Replay(_Logger):
+    """
+        Sends again the commands of a captured session, each connection by
+        its own simulated client, keeping the time between the commands
+        (divided by the 'rate'; with rate 0 as fast as possible). With more
+        'clients' than connections in the session, they are repeated.
+
+        The target is the input of an scpi object (a callable), that is
+        called from a thread named like the connection (as the locks
+        identify the clients by it), or a (host, port) to use the network.
+
+        With 'ordered' each command waits, besides its time, until the ones
+        captured before it (of any connection) have been answered, so a
+        scenario where the clients depend on each other (like the locks) is
+        replayed in the same order whatever the timing of the machine.
+
+        The report has the throughput, the latency percentiles and the
+        answers with a different status (or answer, or size) than the
+        captured ones.
+    """
+
+    def __init__(self, records, target, rate=1.0, clients=None, timeout=2.0,
+                 ordered=False, *args, **kwargs):
+        super(Replay, self).__init__(*args, **kwargs)
+        self._name = "Replay"
+        truncated = len([record for record in records
+                         if record.get('truncated')])
+        if truncated > 0:
+            # the trace only has the beginning of the longer commands
+            self._warning("{0:d} truncated commands will not be replayed",
+                          truncated)
+            records = [record for record in records
+                       if not record.get('truncated')]
+        self._target = target
+        self._rate = rate
+        self._timeout = timeout
+        self._ordered = ordered
+        records = [dict(record, order=i) for i, record in enumerate(records)]
+        self._sessions = self._distribute(records, clients)
+        if ordered and \
+                sum([len(session) for name, session in self._sessions]) != \
+                len(records):
+            raise ValueError("An ordered replay cannot repeat the "
+                             "connections in more clients")
+        timestamps = [record['timestamp'] for record in records
+                      if record['timestamp'] is not None]
+        self._origin = min(timestamps) if timestamps else None
+        self._latency = StreamingStatistics()
+        self._lock = _threading.Lock()
+        self._diffs = []
+        self._differences = 0
+        self._resized = 0
+        self._failed = 0
+        # the order of the next command to be sent, when 'ordered'
+        self._turn = 0
+        self._skipped = set()
+        self._turn_condition = _threading.Condition()
+
+    @property
+    def clients(self):
+        return len(self._sessions)
+
+    def _distribute(self, records, clients):
+        by_connection = {}
+        order = []
+        for record in records:
+            if record['connection'] not in by_connection:
+                by_connection[record['connection']] = []
+                order.append(record['connection'])
+            by_connection[record['connection']].append(record)
+        sessions = [(connection, by_connection[connection])
+                    for connection in order]
+        if clients is None or clients == len(sessions) or \
+                len(sessions) == 0:
+            return sessions
+        if clients > len(sessions):
+            return [("{0}#{1:d}".format(sessions[i % len(sessions)][0],
+                                        i // len(sessions)),
+                     sessions[i % len(sessions)][1])
+                    for i in range(clients)]
+        merged = [("client{0:d}".format(i), []) for i in range(clients)]
+        for i, (connection, session) in enumerate(sessions):
+            merged[i % clients][1].extend(session)
+        for name, session in merged:
+            if self._ordered:
+                session.sort(key=lambda record: record['order'])
+            else:
+                session.sort(key=lambda record: record['timestamp'] or 0)
+        return merged
+
+    def run(self):
+        """
+Replay the session and wait for all the clients to finish.
+        :return: dict (the report)
+        """
+        start = _time()
+        threads = [_threading.Thread(name=name, target=self._client,
+                                     args=(session, start))
+                   for name, session in self._sessions]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._report(_time() - start)
+
+    def _connect(self):
+        if callable(self._target):
+            return _InputClient(self._target)
+        return _TcpClient(self._target, self._timeout)
+
+    def _client(self, session, start):
+        try:
+            client = self._connect()
+        except Exception as exc:
+            self._error("Cannot connect to {0}: {1}", self._target, exc)
+            with self._lock:
+                self._failed += len(session)
+            # the others cannot wait for the commands of this client
+            self._pass_turns([record['order'] for record in session])
+            return
+        try:
+            for record in session:
+                self._wait_turn(record, start)
+                self._wait_order(record)
+                try:
+                    self._send(client, record)
+                finally:
+                    self._pass_turns([record['order']])
+        finally:
+            client.close()
+
+    def _send(self, client, record):
+        t_0 = perf_counter_ns()
+        try:
+            answer = client(record['command'])
+        except Exception as exc:
+            self._warning("{0!r} failed: {1}", record['command'], exc)
+            with self._lock:
+                self._failed += 1
+            return
+        self._latency.add(perf_counter_ns() - t_0)
+        self._compare(record, answer)
+
+    def _wait_order(self, record):
+        if not self._ordered:
+            return
+        with self._turn_condition:
+            while self._turn != record['order']:
+                self._turn_condition.wait()
+
+    def _pass_turns(self, orders):
+        if not self._ordered:
+            return
+        with self._turn_condition:
+            self._skipped.update(orders)
+            while self._turn in self._skipped:
+                self._skipped.discard(self._turn)
+                self._turn += 1
+            self._turn_condition.notify_all()
+
+    def _wait_turn(self, record, start):
+        if self._rate <= 0 or record['timestamp'] is None:
+            return
+        due = start + (record['timestamp'] - self._origin) * 1e-9 / self._rate
+        delay = due - _time()
+        if delay > 0:
+            _sleep(delay)
+
+    def _compare(self, record, answer):
+        status = answer_status(answer)
+        expected = record.get('answer')
+        with self._lock:
+            if (record.get('status') is not None and
+                    record['status'] != status) or \
+                    (expected is not None and expected != answer):
+                self._differences += 1
+                if len(self._diffs) < _MAX_EXAMPLES:
+                    self._diffs.append({'connection': record['connection'],
+                                        'command': record['command'],
+                                        'captured': expected or
+                                        record['status'],
+                                        'replayed': status,
+                                        'answer': answer})
+            elif record.get('answer_size') is not None and \
+                    record['answer_size'] != len(answer):
+                self._resized += 1
+
+    def _report(self, elapsed):
+        latency = self._latency.summary(scale=1e-9)
+        return {'clients': len(self._sessions),
+                'commands': latency['count'],
+                'failed': self._failed,
+                'seconds': elapsed,
+                'throughput': latency['count'] / elapsed if elapsed else 0.0,
+                'latency': latency,
+                'differences': self._differences,
+                'resized': self._resized,
+                'examples': self._diffs}
+
+
+def _print_report(report):
+    print("{0:d} clients, {1:d} commands in {2:.3f} s ({3:.1f} commands/s)"
+          "".format(report['clients'], report['commands'], report['seconds'],
+                    report['throughput']))
+    latency = report['latency']
+    if latency['count'] > 0:
+        print("latency: min {0:.6f} p50 {1:.6f} p99 {2:.6f} p999 {3:.6f} "
+              "max {4:.6f} s".format(latency['min'], latency['p50'],
+                                     latency['p99'], latency['p999'],
+                                     latency['max']))
+    print("{0:d} failed, {1:d} with a different status, {2:d} with a "
+          "different answer size".format(report['failed'],
+                                         report['differences'],
+                                         report['resized']))
+    for diff in report['examples']:
+        print("\t{connection} {command!r}: {captured} -> {replayed} "
+              "({answer!r})".format(**diff))
+
+
+def _instrument(spec):
+    # 'module:callable' that builds the scpi object
+    module_name, _, attribute = spec.partition(':')
+    module = __import__(module_name, fromlist=[attribute])
+    return getattr(module, attribute)()
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] capture_file")
+    parser.add_option('', "--tcp", default=None,
+                      help="Replay to this host:port")
+    parser.add_option('', "--instrument", default=None,
+                      help="Replay in-process to the scpi object built by "
+                           "this 'module:callable'")
+    parser.add_option('', "--rate", type="float", default=1.0,
+                      help="Speed multiplier (0 for as fast as possible)")
+    parser.add_option('', "--clients", type="int", default=None,
+                      help="Simulated clients (the captured connections "
+                           "by default)")
+    parser.add_option('', "--ordered", action="store_true", default=False,
+                      help="Send each command after the ones captured "
+                           "before it have been answered")
+    parser.add_option('', "--json", action="store_true", default=False,
+                      help="Print the report in json")
+    (options, args) = parser.parse_args()
+    if len(args) != 1 or (options.tcp is None) == \
+            (options.instrument is None):
+        parser.error("one capture file and either --tcp or --instrument")
+    if options.tcp is not None:
+        host, _, port = options.tcp.rpartition(':')
+        target = (host or '127.0.0.1', int(port))
+    else:
+        target = _instrument(options.instrument).input
+    replay = Replay(load_session(args[0]), target, rate=options.rate,
+                    clients=options.clients, ordered=options.ordered)
+    report = replay.run()
+    if options.json:
+        _json.dump(report, _sys.stdout, indent=1)
+        print()
+    else:
+        _print_report(report)
+
+
+if __name__ == '__main__':
+    main()
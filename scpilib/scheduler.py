@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+except Exception:
+    from logger import Logger as _Logger
+from collections import deque as _deque
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["Dispatcher", "PRIORITY_HIGH", "PRIORITY_NORMAL", "PRIORITY_LOW"]
+
+
+PRIORITY_HIGH = 0  # lock owners and control commands
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # bulk queries
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW]
+PRIORITY_NAMES = ['high', 'normal', 'low']
+
+# latencies kept, per priority, to calculate the percentiles
+_LATENCY_SAMPLES = 1000
+# every how many jobs the counters of the idle clients are forgotten
+_PRUNE_PERIOD = 1000
+
+
+def _percentile(values, percent):
+    """
+    Nearest rank percentile of a sorted list.
+    """
+    if len(values) == 0:
+        return 0.0
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class _Job(object):
+    def __init__(self, owner, function, args, priority):
+        super(_Job, self).__init__()
+        self.owner = owner
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.when = _time()
+        self.done = _threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class Dispatcher(_Logger):
+    """
+        A pool of workers shared by all the clients. Each client has its own
+        queue of jobs and, when the workers are all busy, the clients are
+        served in turns (round-robin), so one client sending requests in a
+        tight loop cannot monopolize them.
+
+        The jobs have a priority: the ones with a higher priority go ahead,
+        and the turns are within the same priority. The latency (from the
+        submission to the end) is reported per priority.
+
+        The workers run the jobs with the name of the client, as it is what
+        the locker uses to identify them.
+    """
+
+    _workers = None
+    _queues = None
+    _turns = None
+    _condition = None
+    _join_event = None
+    _busy = None
+
+    def __init__(self, name=None, workers=1, *args, **kwargs):
+        super(Dispatcher, self).__init__(*args, **kwargs)
+        self._name = name or "Dispatcher"
+        self._queues = {}
+        self._turns = [_deque() for priority in PRIORITIES]
+        self._latencies = [_deque(maxlen=_LATENCY_SAMPLES)
+                           for priority in PRIORITIES]
+        self._condition = _threading.Condition()
+        self._join_event = _threading.Event()
+        self._busy = 0
+        self._counters = {}
+        self._active = set()
+        self._jobs = 0
+        self._saturated = 0
+        self._workers = []
+        for i in range(workers):
+            worker = _threading.Thread(name="{0}{1}".format(self._name, i),
+                                       target=self._work)
+            worker.setDaemon(True)
+            self._workers.append(worker)
+            worker.start()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def workers(self):
+        return len(self._workers)
+
+    @property
+    def pending(self):
+        with self._condition:
+            return sum([len(queue) for queue in self._queues.values()])
+
+    @property
+    def saturated(self):
+        """
+            How many jobs have found all the workers busy.
+        """
+        return self._saturated
+
+    def is_worker(self):
+        return _threading.current_thread() in self._workers
+
+    def submit(self, owner, function, *args, **kwargs):
+        """
+Queue the job of the owner and wait for its result.
+        :param owner: str (the connection name)
+        :param function: callable
+        :param priority: one of PRIORITIES (keyword, PRIORITY_NORMAL default)
+        :return: what the function returns
+        """
+        priority = kwargs.pop('priority', PRIORITY_NORMAL)
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority {0!r}".format(priority))
+        job = _Job(owner, function, args, priority)
+        key = (priority, owner)
+        with self._condition:
+            if self._join_event.isSet():
+                raise RuntimeError("The dispatcher is closed")
+            if self._busy >= len(self._workers):
+                self._saturated += 1
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = _deque()
+                self._queues[key] = queue
+                self._turns[priority].append(owner)
+            queue.append(job)
+            self._condition.notify()
+        job.done.wait()
+        with self._condition:
+            self._latencies[priority].append(_time() - job.when)
+        if job.exception is not None:
+            raise job.exception
+        return job.result
+
+    def release(self, owner):
+        """
+Forget the counters of a client that has gone.
+        :param owner: str (the connection name)
+        """
+        with self._condition:
+            self._counters.pop(owner, None)
+            self._active.discard(owner)
+
+    def close(self):
+        """
+            The jobs being executed finish, but the ones still in the queues
+            are not executed: their submit() raises a RuntimeError.
+        """
+        if self._join_event.isSet():
+            return
+        self._debug("{0} close received", self._name)
+        with self._condition:
+            self._join_event.set()
+            pending = [job for queue in self._queues.values()
+                       for job in queue]
+            self._queues = {}
+            for turns in self._turns:
+                turns.clear()
+            self._condition.notify_all()
+        if len(pending) > 0:
+            self._warning("{0:d} pending jobs cancelled", len(pending))
+        for job in pending:
+            job.exception = RuntimeError("The dispatcher is closed")
+            job.done.set()
+        for worker in self._workers:
+            if worker is not _threading.current_thread():
+                worker.join(1)
+
+    def statistics(self):
+        """
+Per client counters: the jobs, and the total and maximum time they have
+waited for a worker. Plus the 'saturated' jobs, that found all the workers
+busy, and per priority the percentiles of the latency of the last jobs.
+        :return: dict
+        """
+        with self._condition:
+            answer = dict((owner, dict(counters))
+                          for owner, counters in self._counters.items())
+            latencies = [sorted(samples) for samples in self._latencies]
+        priorities = {}
+        for priority, samples in zip(PRIORITY_NAMES, latencies):
+            priorities[priority] = {
+                'samples': len(samples),
+                'p50': _percentile(samples, 50),
+                'p90': _percentile(samples, 90),
+                'p99': _percentile(samples, 99),
+                'max': samples[-1] if len(samples) > 0 else 0.0}
+        return {'clients': answer, 'saturated': self._saturated,
+                'priorities': priorities}
+
+    def reset_statistics(self):
+        with self._condition:
+            self._counters = {}
+            self._active = set()
+            self._saturated = 0
+            for samples in self._latencies:
+                samples.clear()
+
+    def _has_jobs(self):
+        return any([len(turns) > 0 for turns in self._turns])
+
+    def _next_job(self):
+        # in the highest priority with jobs, the client that has its turn
+        # gives one job and goes to the end
+        for priority, turns in enumerate(self._turns):
+            if len(turns) > 0:
+                break
+        owner = turns.popleft()
+        queue = self._queues[(priority, owner)]
+        job = queue.popleft()
+        if len(queue) > 0:
+            turns.append(owner)
+        else:
+            self._queues.pop((priority, owner))
+        return job
+
+    def _work(self):
+        thread = _threading.current_thread()
+        name = thread.name
+        while True:
+            with self._condition:
+                while not self._has_jobs() and \
+                        not self._join_event.isSet():
+                    self._condition.wait()
+                if self._join_event.isSet():
+                    break
+                job = self._next_job()
+                self._busy += 1
+                self._account(job)
+            thread.name = job.owner
+            try:
+                job.result = job.function(*job.args)
+            except Exception as exc:
+                job.exception = exc
+            finally:
+                thread.name = name
+                with self._condition:
+                    self._busy -= 1
+                job.done.set()
+        self._debug("Worker {0} finishing", name)
+
+    def _account(self, job):
+        self._jobs += 1
+        if self._jobs % _PRUNE_PERIOD == 0:
+            self._prune()
+        self._active.add(job.owner)
+        wait = _time() - job.when
+        counters = self._counters.get(job.owner)
+        if counters is None:
+            counters = {'jobs': 0, 'wait': 0.0, 'max_wait': 0.0}
+            self._counters[job.owner] = counters
+        counters['jobs'] += 1
+        counters['wait'] += wait
+        counters['max_wait'] = max(counters['max_wait'], wait)
+
+    def _prune(self):
+        # the clients without jobs since the last time may have gone (and
+        # their names are not reused), the listeners without connections
+        # don't say it
+        waiting = set([owner for priority, owner in self._queues])
+        for owner in list(self._counters.keys()):
+            if owner not in self._active and owner not in waiting:
+                self._counters.pop(owner)
+        self._active = set()
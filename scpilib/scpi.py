@@ -21,28 +21,60 @@ try:
     from .commands import Component, Attribute, build_component, build_channel
     from .commands import build_attribute, build_special_cmd, CHNUMSIZE
     from .logger import Logger as _Logger
-    from .logger import trace, scpi_debug
+    from .logger import trace, scpi_debug, add_instrumentation_observer
     from .logger import timeit, timeit_collection
     from .logger import (deprecated, deprecation_collection,
                          deprecated_argument, deprecation_arguments)
     from .tcpListener import TcpListener
+    from .unixListener import UnixSocketListener
+    from .udpListener import UdpListener
+    from .serialListener import SerialListener
+    from .hislip import HiSLIPListener
+    from .httpListener import HttpListener
+    from .ratelimit import RateLimiter, Throttled, subtree_key
+    from .ratelimit import RATE_LIMIT_DELAY
+    from .scheduler import Dispatcher
+    from .scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+    from .prefork import PreforkListener
+    from .metrics import MetricsRegistry, MetricsListener
+    from .profiler import Profiler, PROFILE_CPROFILE, PROFILE_MODES
+    from .recorder import CommandRecorder
+    from .latency import perf_counter_ns as _perf_counter_ns
     from .lock import Locker as _Locker
     from .version import version as _version
 except Exception:
     from commands import Component, Attribute, build_component, build_channel
     from commands import build_attribute, build_special_cmd, CHNUMSIZE
     from logger import Logger as _Logger
-    from logger import trace, scpi_debug
+    from logger import trace, scpi_debug, add_instrumentation_observer
     from logger import timeit, timeit_collection
     from logger import (deprecated, deprecation_collection,
                         deprecated_argument, deprecation_arguments)
     from tcpListener import TcpListener
+    from unixListener import UnixSocketListener
+    from udpListener import UdpListener
+    from serialListener import SerialListener
+    from hislip import HiSLIPListener
+    from httpListener import HttpListener
+    from ratelimit import RateLimiter, Throttled, subtree_key
+    from ratelimit import RATE_LIMIT_DELAY
+    from scheduler import Dispatcher
+    from scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+    from prefork import PreforkListener
+    from metrics import MetricsRegistry, MetricsListener
+    from profiler import Profiler, PROFILE_CPROFILE, PROFILE_MODES
+    from recorder import CommandRecorder
+    from latency import perf_counter_ns as _perf_counter_ns
     from lock import Locker as _Locker
     from version import version as _version
+from multiprocessing import Value as _SharedValue
+import os as _os
 import re
+from tempfile import gettempdir as _gettempdir
 from time import sleep as _sleep
 from time import time as _time
 from threading import currentThread as _current_thread
+from threading import Lock as _Lock
 from traceback import print_exc, format_exc
 
 
@@ -57,6 +89,11 @@ __all__ = ["scpi"]
 TCPLISTENER_LOCAL = 0b10000000
 TCPLISTENER_REMOTE = 0b01000000
 
+DATA_FORMATS = ['ASCII', 'QUADRUPLE', 'DOUBLE', 'SINGLE', 'HALF']
+
+# subtrees with high priority in the dispatcher (the special commands also)
+HIGH_PRIORITY_SUBTREES = ['SYSTem:LOCK', 'SYSTem:WLOCK']
+
 PARAM_RE = re.compile('(?P<cmd>[^\s?]+)(?P<query>\?)?(?P<args>.*)?$')
 
 
@@ -78,9 +115,44 @@ def split_params(data):
 
 class scpi(_Logger):
     '''This is an object to be build in order to provide to your instrument
-       SCPI communications. By now it only provides network (ipv4 and ipv6)
-       communications, but if required it can be extended to support other
-       types.
+       SCPI communications. By now it provides network (ipv4 and ipv6)
+       communications and, for clients in the same host, a unix domain socket
+       (when the 'unix_socket' path is given). With 'port=None' the network
+       listener is not built. Fire-and-forget datagrams are accepted when an
+       'udp_port' is given. With a number of 'workers' the network queries are
+       spread over that many processes (see PreforkListener). A
+       'serial_device' (a tty path, or 'pty' for a pseudo-terminal) adds a
+       line oriented serial service. The 'hislip_port' (usually 4880) adds
+       a HiSLIP (IVI-6.1) service, with message framing and an asynchronous
+       channel. With an 'http_port' the command tree is also reachable by
+       HTTP/JSON requests. Given a 'hub' (see ServiceHub), the network port
+       is attended by the hub (shared with other instruments when they have
+       a 'hub_prefix').
+
+       The commands of each client can be limited with a 'rate_limit' and
+       'subtree_rate_limits' (see RateLimiter), and with 'dispatch_workers'
+       the commands are executed by a shared pool of workers that serves the
+       clients in turns (see Dispatcher). The lock owners, the special
+       commands and the 'high_priority_subtrees' go ahead in the dispatcher
+       queue, and the 'low_priority_subtrees' (like bulk array queries) go
+       after the others.
+
+       With 'log_queue' (True or the size of the queue) the logs are written
+       to the file by a background thread.
+
+       With 'metrics' the commands, attribute callbacks and network traffic
+       are counted (see MetricsRegistry), and with a 'metrics_port' they are
+       served in the Prometheus text format by an HTTP listener (always in
+       the loopback interface). The clients can query them in the
+       'SYSTem:STATistics' subtree.
+
+       The execution can be profiled on demand (see profile_start()), and
+       with 'profiling' also by the clients in the 'SYSTem:PROFile' subtree.
+       The profiles requested by the clients are written in the
+       'profile_directory' (the temporary one by default).
+
+       With a 'trace_path' each command is recorded in a binary ring buffer
+       of 'trace_records' (see CommandRecorder), to be decoded later.
 
        By default it builds sockets that only listen in the loopback network
        interface. By default we like to avoid to expose the conection. There
@@ -93,15 +165,43 @@ class scpi(_Logger):
     _command_tree = None
 
     _data_format = None
+    _shared_data_format = None
+
+    _listener_options = None
+    _hook_options = None
+    _rate_limiter = None
+    _dispatcher = None
+    _metrics = None
+    _metrics_listener = None
+    _profiler = None
+    _profile_directory = None
+    _profile_lock = None
+    _recorder = None
 
     def __init__(self, command_tree=None, special_commands=None,
                  local=True, port=5025, auto_open=None, services=None,
-                 write_lock=None, debug=False,
+                 write_lock=None, debug=False, max_clients=None,
+                 backlog=None, admission=None, queue_size=None,
+                 socket_options=None, unix_socket=None, udp_port=None,
+                 workers=None, idle_timeout=None, read_timeout=None,
+                 output_buffer=None, serial_device=None, serial_baudrate=9600,
+                 hislip_port=None, http_port=None, hook_queue_size=None,
+                 hook_overflow=None, hub=None, hub_prefix=None,
+                 rate_limit=None, subtree_rate_limits=None,
+                 rate_limit_policy=None, dispatch_workers=None,
+                 high_priority_subtrees=None, low_priority_subtrees=None,
+                 log_queue=None, metrics=None, metrics_port=None,
+                 profiling=None, profile_directory=None, trace_path=None,
+                 trace_records=None,
                  # Deprecated arguments:
                  specialCommands=None, autoOpen=None, writeLock=None,
                  *args, **kwargs):
         scpi_debug(debug)
         super(scpi, self).__init__(name="scpi", *args, **kwargs)
+        add_instrumentation_observer(self)
+        if log_queue:
+            # True or the size of the queue
+            self.enable_log_queue(None if log_queue is True else log_queue)
         self._command_tree = command_tree or Component()
         self._command_tree.enable_log(self.log_state())
         self._command_tree.log_level = self.log_level
@@ -114,6 +214,47 @@ class scpi(_Logger):
         self._debug("Given commands: {0!r}", self._command_tree)
         self._local = local
         self._port = port
+        # given as they are to all the listeners with connections (tcp,
+        # prefork, unix socket and HiSLIP)
+        self._listener_options = dict(
+            max_clients=max_clients, backlog=backlog, admission=admission,
+            queue_size=queue_size, socket_options=socket_options,
+            idle_timeout=idle_timeout, read_timeout=read_timeout,
+            output_buffer=output_buffer)
+        # and to the ones of them that have connection hooks
+        self._hook_options = dict(hook_queue_size=hook_queue_size,
+                                  hook_overflow=hook_overflow)
+        self._unix_socket = unix_socket
+        self._udp_port = udp_port
+        self._workers = workers
+        self._serial_device = serial_device
+        self._serial_baudrate = serial_baudrate
+        self._hislip_port = hislip_port
+        self._http_port = http_port
+        self._hub = hub
+        self._hub_prefix = hub_prefix
+        self._metrics = None
+        if metrics or metrics_port is not None:
+            self._metrics = MetricsRegistry()
+        self._metrics_port = metrics_port
+        self._profiling = profiling
+        self._profile_directory = profile_directory or _gettempdir()
+        self._profile_lock = _Lock()
+        self._recorder = None
+        if trace_path is not None:
+            self._recorder = CommandRecorder(trace_path, trace_records)
+        self._rate_limiter = None
+        if rate_limit is not None or subtree_rate_limits is not None:
+            self._rate_limiter = RateLimiter(rate_limit, subtree_rate_limits,
+                                             rate_limit_policy)
+        self._dispatcher = None
+        if dispatch_workers is not None:
+            self._dispatcher = Dispatcher("scpiDispatcher", dispatch_workers)
+        self._high_priority_subtrees = [subtree_key(subtree) for subtree in
+                                        HIGH_PRIORITY_SUBTREES +
+                                        (high_priority_subtrees or [])]
+        self._low_priority_subtrees = [subtree_key(subtree) for subtree in
+                                       low_priority_subtrees or []]
         self._services = {}
         if services is not None:
             deprecated_argument("scpi", "__init__", "services")
@@ -143,6 +284,10 @@ class scpi(_Logger):
                     type, value, traceback)
         if self.is_open:
             self.close()
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+        if self._recorder is not None:
+            self._recorder.close()
         self.__summary_timeit()
         self.__summary_deprecated()
 
@@ -150,6 +295,10 @@ class scpi(_Logger):
         self._debug("Delete request received")
         if self.is_open:
             self.close()
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+        if self._recorder is not None:
+            self._recorder.close()
         self.__summary_timeit()
         self.__summary_deprecated()
 
@@ -182,11 +331,15 @@ class scpi(_Logger):
                 value = timeit_collection[klass][method]
                 aux[method_full_name] = value
         for name in sorted(aux):
-            value = aux[name]
+            value = aux[name].summary(scale=1e-9)
+            if value['count'] == 0:
+                continue
             msg += "\tmethod {1:{0}} {2:4} calls: min {3:06.6f} " \
-                   "max {4:06.6f} (mean {5:06.6f} std {6:06.6f})\n" \
-                   "".format(strlen, name, len(value), value.min(),
-                             value.max(), value.mean(), value.std())
+                   "max {4:06.6f} (mean {5:06.6f} std {6:06.6f}) " \
+                   "p50 {7:06.6f} p99 {8:06.6f} p999 {9:06.6f}\n" \
+                   "".format(strlen, name, value['count'], value['min'],
+                             value['max'], value['mean'], value['std'],
+                             value['p50'], value['p99'], value['p999'])
         if len(msg) > 0:
             self._warning("timeit summary:\n{0}", msg)
 
@@ -228,7 +381,24 @@ class scpi(_Logger):
 
     def open(self):
         if not self.is_open:
-            self.__build_tcp_listener()
+            if self._port is not None and self._hub is not None:
+                self.__register_in_hub()
+            elif self._port is not None and self._workers is not None:
+                self.__build_prefork_listener()
+            elif self._port is not None:
+                self.__build_tcp_listener()
+            if self._unix_socket is not None:
+                self.__build_unix_socket_listener()
+            if self._udp_port is not None:
+                self.__build_udp_listener()
+            if self._serial_device is not None:
+                self.__build_serial_listener()
+            if self._hislip_port is not None:
+                self.__build_hislip_listener()
+            if self._http_port is not None:
+                self.__build_http_listener()
+            if self._metrics_port is not None:
+                self.__build_metrics_listener()
         else:
             self._warning("Already Open")
 
@@ -239,28 +409,188 @@ class scpi(_Logger):
                 self._debug("Close service {0}", key)
                 self._services[key].close()
                 self._services.pop(key)
+            if self._metrics_listener is not None:
+                self._metrics_listener.close()
+                self._metrics_listener = None
+            if self._recorder is not None:
+                self._recorder.flush()
             self._debug("Communications finished. Exiting...")
+            self.flush_log_queue()
         else:
             self._warning("Already Close")
 
+    def __options(self, hooks=False):
+        options = dict(self._listener_options)
+        if hooks:
+            options.update(self._hook_options)
+        return options
+
     def __build_tcp_listener(self):
         self._debug("Opening tcp listener ({0})",
                     "local" if self._local else "remote")
-        self._services['tcpListener'] = TcpListener(name="TcpListener",
-                                                    callback=self.input,
-                                                    local=self._local,
-                                                    port=self._port)
+        self._services['tcpListener'] = TcpListener(
+            name="TcpListener", callback=self.input, local=self._local,
+            port=self._port, release_cb=self.__release_locks_of,
+            metrics=self._metrics, **self.__options(hooks=True))
         self._services['tcpListener'].listen()
 
-    def add_connection_hook(self, hook):
+    def __register_in_hub(self):
+        self._debug("Registering in the hub (port {0}, prefix {1})",
+                    self._port, self._hub_prefix)
+        self._services['hubService'] = self._hub.register(
+            self.input, self._port, self._hub_prefix)
+
+    def __build_prefork_listener(self):
+        self._debug("Opening {0} prefork listeners ({1})", self._workers,
+                    "local" if self._local else "remote")
+        if self._shared_data_format is None:
+            # the workers have to see the data format changes
+            self._shared_data_format = _SharedValue(
+                'b', DATA_FORMATS.index(self._data_format), lock=False)
+        self._services['preforkListener'] = PreforkListener(
+            name="PreforkListener", callback=self.input,
+            locked_cb=self.__is_any_lock_booked, local=self._local,
+            port=self._port, workers=self._workers,
+            release_cb=self.__release_locks_of, **self.__options())
+        self._services['preforkListener'].listen()
+
+    def __build_unix_socket_listener(self):
+        self._debug("Opening unix socket listener ({0})", self._unix_socket)
+        self._services['unixSocketListener'] = UnixSocketListener(
+            name="UnixSocketListener", callback=self.input,
+            path=self._unix_socket, release_cb=self.__release_locks_of,
+            metrics=self._metrics, **self.__options(hooks=True))
+        self._services['unixSocketListener'].listen()
+
+    def __build_udp_listener(self):
+        self._debug("Opening udp listener ({0})",
+                    "local" if self._local else "remote")
+        self._services['udpListener'] = UdpListener(
+            name="UdpListener", callback=self.input, local=self._local,
+            port=self._udp_port)
+        self._services['udpListener'].listen()
+
+    def __build_serial_listener(self):
+        self._debug("Opening serial listener ({0})", self._serial_device)
+        self._services['serialListener'] = SerialListener(
+            name="SerialListener", callback=self.input,
+            device=self._serial_device, baudrate=self._serial_baudrate)
+        self._services['serialListener'].listen()
+
+    def __build_hislip_listener(self):
+        self._debug("Opening HiSLIP listener ({0})",
+                    "local" if self._local else "remote")
+        self._services['hislipListener'] = HiSLIPListener(
+            name="HiSLIPListener", callback=self.input, local=self._local,
+            port=self._hislip_port, release_cb=self.__release_locks_of,
+            metrics=self._metrics, **self.__options(hooks=True))
+        self._services['hislipListener'].listen()
+
+    def __build_http_listener(self):
+        self._debug("Opening http listener ({0})",
+                    "local" if self._local else "remote")
+        self._services['httpListener'] = HttpListener(
+            name="HttpListener", callback=self.input, local=self._local,
+            port=self._http_port)
+        self._services['httpListener'].listen()
+
+    def rebind_instrumented(self):
+        """
+            The services have the input captured as a bound method: when the
+            instrumentation swaps the decorated methods, give them the new
+            one.
+        """
+        for service in list(self._services.values()):
+            service.callback = self.input
+
+    def __build_metrics_listener(self):
+        self._debug("Opening metrics listener (port {0})", self._metrics_port)
+        self._metrics_listener = MetricsListener(
+            name="MetricsListener", registry=self._metrics, local=True,
+            port=self._metrics_port)
+        self._metrics_listener.listen()
+
+    @property
+    def metrics(self):
+        """
+            The MetricsRegistry with the counters of this instrument (None
+            when it has been built without 'metrics').
+        """
+        return self._metrics
+
+    def rate_limit_statistics(self):
+        """
+Per client counters of the rate limiter: commands, the throttled or rejected
+ones and the accumulated delay.
+        :return: dict
+        """
+        if self._rate_limiter is None:
+            return {}
+        return self._rate_limiter.statistics()
+
+    def dispatch_statistics(self):
+        if self._dispatcher is None:
+            return {}
+        return self._dispatcher.statistics()
+
+    def profile_start(self, mode=PROFILE_CPROFILE, interval=None):
+        """
+Start profiling the commands: 'cprofile' measures every call they do, and
+'sampling' takes the stacks of all the threads periodically (every
+'interval' seconds), which costs nothing to the commands.
+        :param mode: one of PROFILE_MODES
+        :param interval: float
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode {0!r} (use one of {1})"
+                             "".format(mode, PROFILE_MODES))
+        kwargs = {} if interval is None else {'interval': interval}
+        with self._profile_lock:
+            if self._profiler is not None:
+                raise RuntimeError("Already profiling ({0})"
+                                   "".format(self._profiler.mode))
+            self._profiler = Profiler("scpiProfiler", mode, **kwargs)
+        self._info("Profile ({0}) started", mode)
+
+    def profile_stop(self, path=None):
+        """
+Stop the profile and write it: in pstats format for 'cprofile' and as
+collapsed stacks (for flamegraphs) for 'sampling'. Without a path, or
+with only a file name, it goes to the 'profile_directory'.
+        :param path: str
+        :return: str (the path written)
+        """
+        with self._profile_lock:
+            profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            raise RuntimeError("Not profiling")
+        if path is None:
+            path = "scpi-{0:d}-{1:d}.{2}".format(
+                _os.getpid(), int(_time()),
+                'pstats' if profiler.mode == PROFILE_CPROFILE else 'folded')
+        if _os.path.dirname(path) == '':
+            path = _os.path.join(self._profile_directory, path)
+        return profiler.stop(path)
+
+    @property
+    def serial_name(self):
+        """
+            Path of the serial line where the instrument is listening (the
+            pseudo-terminal one when the device is 'pty').
+        """
+        if 'serialListener' in self._services:
+            service = self._services['serialListener']
+            return service.slave_name or service.device
+
+    def add_connection_hook(self, hook, sync=False):
         try:
             services = self._services.itervalues()
         except AttributeError:
             services = self._services.values()
         for service in services:
-            if hasattr(service, 'addConnectionHook'):
+            if hasattr(service, 'add_connection_hook'):
                 try:
-                    service.addConnectionHook(hook)
+                    service.add_connection_hook(hook, sync)
                 except Exception as e:
                     self._error("Exception setting a hook to {0}: {1}",
                                 service, e)
@@ -273,8 +603,8 @@ class scpi(_Logger):
         except AttributeError:
             services = self._services.values()
         for service in services:
-            if hasattr(service, 'removeConnectionHook'):
-                if not service.removeConnectionHook(hook):
+            if hasattr(service, 'remove_connection_hook'):
+                if not service.remove_connection_hook(hook):
                     self._warning("Service {0} refuse to remove the hook",
                                   service)
             else:
@@ -284,8 +614,7 @@ class scpi(_Logger):
         self._data_format = 'ASCII'
         self.add_attribute('DataFormat', self._command_tree,
                            self.data_format, self.data_format,
-                           allowed_argins=['ASCII', 'QUADRUPLE', 'DOUBLE',
-                                           'SINGLE', 'HALF'])
+                           allowed_argins=DATA_FORMATS)
 
     def __build_system_component(self, write_lock, writeLock=None):
         if writeLock is not None:
@@ -299,6 +628,10 @@ class scpi(_Logger):
             self.__build_wlocker_component(system_tree)
         else:
             self._wlock = None
+        if self._metrics is not None:
+            self.__build_statistics_component(system_tree)
+        if self._profiling:
+            self.__build_profile_component(system_tree)
         # TODO: other SYSTem components from SCPI-99 (pages 21-*)
         #       :SYSTem:PASSword
         #       :SYSTem:PASSword:CDISable
@@ -315,6 +648,74 @@ class scpi(_Logger):
         #       :SYSTem:TZONe
         #       :SYSTem:VERSion
 
+    def __build_statistics_component(self, command_tree):
+        sub_tree = self.add_component('STATistics', command_tree)
+        self.add_attribute('COMMands', sub_tree,
+                           lambda: self._metrics.totals()['commands'])
+        self.add_attribute('RATE', sub_tree,
+                           lambda: self._metrics.totals()['rate'])
+        self.add_attribute('ERRors', sub_tree,
+                           lambda: self._metrics.totals()['errors'])
+        self.add_attribute('LATency', sub_tree, self.__command_latencies)
+        self.add_attribute('CONNections', sub_tree,
+                           lambda: self.__sum_of_services(
+                               'active_connections'))
+        self.add_attribute('REJected', sub_tree,
+                           lambda: self._metrics.totals()['rejected'])
+        self.add_attribute('RECeived', sub_tree,
+                           lambda: self._metrics.totals()['received'])
+        self.add_attribute('SENT', sub_tree,
+                           lambda: self._metrics.totals()['sent'])
+        self.add_attribute('BUFFered', sub_tree,
+                           lambda: self.__sum_of_services('pending_bytes'))
+        self.add_attribute('RESet', sub_tree,
+                           write_cb=lambda value: self.reset_statistics())
+
+    def __command_latencies(self):
+        # 'p50,p99' of all the commands followed by the 'command,p50,p99'
+        # of each one
+        totals = self._metrics.totals()
+        fields = ["{0:g}".format(totals['p50']),
+                  "{0:g}".format(totals['p99'])]
+        commands = self._metrics.commands()
+        for label in sorted(commands):
+            fields += [label, "{0:g}".format(commands[label]['p50']),
+                       "{0:g}".format(commands[label]['p99'])]
+        return ','.join(fields)
+
+    def __sum_of_services(self, counter):
+        return sum([getattr(service, counter)
+                    for service in list(self._services.values())
+                    if hasattr(service, counter)])
+
+    def reset_statistics(self):
+        """
+Restart the counters reported in the SYSTem:STATistics subtree.
+        """
+        if self._metrics is not None:
+            self._metrics.reset()
+
+    def __build_profile_component(self, command_tree):
+        sub_tree = self.add_component('PROFile', command_tree)
+        self.add_attribute('STARt', sub_tree,
+                           write_cb=lambda mode: self.profile_start(
+                               mode.strip().lower()))
+        self.add_attribute('STOP', sub_tree,
+                           read_cb=self.__client_profile_stop,
+                           write_cb=self.__client_profile_stop)
+        self.add_attribute('STATe', sub_tree, self.__profile_state)
+
+    def __client_profile_stop(self, name=None):
+        # the clients can only name the file, not where it goes
+        if name:
+            name = _os.path.basename(name.strip().strip('"\''))
+        return self.profile_stop(name or None)
+
+    def __profile_state(self):
+        if self._profiler is None:
+            return 'OFF'
+        return self._profiler.mode.upper()
+
     def __build_locker_component(self, command_tree):
         self._lock = _Locker(name='readLock')
         sub_tree = self.add_component('LOCK', command_tree)
@@ -345,16 +746,11 @@ class scpi(_Logger):
             raise AssertionError("Only boolean can be assigned")
         if value != (not self._services['tcpListener'].local):
             tcpListener = self._services.pop('tcpListener')
-            tcpListener.close()
             self._debug("Close the active listeners and their connections.")
-            while tcpListener.is_listening():
-                self._warning("Waiting for listerners finish")
-                _sleep(1)
+            tcpListener.close()
             self._debug("Building the new listeners.")
-            if value is True:
-                self.__build_tcp_listener(TCPLISTENER_REMOTE)
-            else:
-                self.__build_tcp_listener(TCPLISTENER_LOCAL)
+            self._local = not value
+            self.__build_tcp_listener()
         else:
             self._debug("Nothing to do when setting like it was.")
 
@@ -599,8 +995,12 @@ Or write_cb if it's followed by an space and something that can be casted after.
 
     def data_format(self, value=None):
         if value is None:
+            if self._shared_data_format is not None:
+                return DATA_FORMATS[self._shared_data_format.value]
             return self._data_format
         self._data_format = value
+        if self._shared_data_format is not None:
+            self._shared_data_format.value = DATA_FORMATS.index(value)
 
     @property
     def valid_separators(self):
@@ -608,6 +1008,63 @@ Or write_cb if it's followed by an space and something that can be casted after.
 
     @timeit
     def input(self, line):
+        if self._dispatcher is not None and self._dispatcher.is_worker():
+            return self._input(line)
+        owner = _current_thread().name
+        if self._rate_limiter is not None and \
+                self._rate_limiter.policy == RATE_LIMIT_DELAY:
+            self._delay(owner, line)
+        if self._dispatcher is not None:
+            return self._dispatcher.submit(
+                owner, self._input, line,
+                priority=self._priority_of(owner, line))
+        return self._input(line)
+
+    def _delay(self, owner, line):
+        # the line waits in the thread of its connection, not in a worker
+        # of the dispatcher, and the hub loop gives it again later
+        commands = []
+        for i, command in enumerate(self._prepare_input_line(line)):
+            command = command.strip()
+            if command.startswith(':') and i > 0:
+                command = "{0}{1}".format(
+                    commands[i-1].rsplit(':', 1)[0], command)
+            commands.append(command)
+        if self._hub is not None and self._hub.in_loop():
+            wait = self._rate_limiter.delay(owner, commands, reserve=False)
+            if wait > 0:
+                raise Throttled(wait)
+            return
+        wait = self._rate_limiter.delay(owner, commands)
+        if wait > 0:
+            _sleep(wait)
+
+    def _priority_of(self, owner, line):
+        if owner in (self._lock.owner,
+                     self._wlock.owner if self._wlock else None):
+            return PRIORITY_HIGH
+        priority = PRIORITY_LOW
+        for command in line.split(';'):
+            command = command.strip()
+            if command.startswith('*'):
+                return PRIORITY_HIGH
+            words = subtree_key(command)
+            for subtree in self._high_priority_subtrees:
+                if words[:len(subtree)] == subtree:
+                    return PRIORITY_HIGH
+            if not any([words[:len(subtree)] == subtree
+                        for subtree in self._low_priority_subtrees]):
+                # a line is low priority only if all its commands are
+                priority = PRIORITY_NORMAL
+        return priority
+
+    def _input(self, line):
+        profiler = self._profiler
+        if profiler is not None and profiler.tracing:
+            return profiler.call(self._process_line, line)
+        return self._process_line(line)
+
+    def _process_line(self, line):
         # TODO: Document the 3 answer codes 'ACK', 'NOK' and 'NotAllow'
         #  as well as the float('NaN')
         self._debug("Received {0!r} input", line)
@@ -616,22 +1073,20 @@ Or write_cb if it's followed by an space and something that can be casted after.
         for i, command in enumerate(line):
             command = command.strip()  # avoid '\n' terminator if exist
             self._debug("Processing {0:d}th command: {1!r}", i+1, command)
-            if command.startswith('*'):
-                answer = self._process_special_command(command[1:])
-                if answer is not None:
-                    results.append(answer)
-            elif command.startswith(':'):
-                command = self._complete_partial_command(command, i, line)
-                if command is None:
-                    results.append(float('NaN'))
-                else:
-                    answer = self._process_normal_command(command)
-                    if answer is not None:
-                        results.append(answer)
+            if self._metrics is None and self._recorder is None:
+                answer = self._execute_command(command, i, line)
             else:
-                answer = self._process_normal_command(command)
-                if answer is not None:
-                    results.append(answer)
+                t_0 = _perf_counter_ns()
+                answer = self._execute_command(command, i, line)
+                t_diff = _perf_counter_ns()-t_0
+                if self._metrics is not None:
+                    self._metrics.observe_command(command, answer,
+                                                  t_diff*1e-9)
+                if self._recorder is not None:
+                    self._recorder.record(_current_thread().name, command,
+                                          answer, t_diff)
+            if answer is not None:
+                results.append(answer)
         # self._debug("Answers: {0!r}", results)
         answer = ""
         for res in results:
@@ -642,6 +1097,20 @@ Or write_cb if it's followed by an space and something that can be casted after.
             return answer[:-1]+'\r\n'
         return ''
 
+    def _execute_command(self, command, position, line):
+        if command.startswith(':'):
+            command = self._complete_partial_command(command, position, line)
+            if command is None:
+                return float('NaN')
+        if self._rate_limiter is not None and \
+                self._rate_limiter.policy != RATE_LIMIT_DELAY and \
+                not self._rate_limiter.acquire(_current_thread().name,
+                                               command):
+            return 'NotAllow'
+        if command.startswith('*'):
+            return self._process_special_command(command[1:])
+        return self._process_normal_command(command)
+
     @timeit
     def _prepare_input_line(self, input):
         while len(input) > 0 and input[-1] in self.valid_separators:
@@ -752,7 +1221,13 @@ Or write_cb if it's followed by an space and something that can be casted after.
 
     @timeit
     def _do_read_operation(self, subtree, word, channel_stack, params):
-        answer = subtree[word].read(ch_lst=channel_stack, params=params)
+        if self._metrics is None:
+            answer = subtree[word].read(ch_lst=channel_stack, params=params)
+        else:
+            t_0 = _perf_counter_ns()
+            answer = subtree[word].read(ch_lst=channel_stack, params=params)
+            self._metrics.observe_attribute(
+                'read', (_perf_counter_ns()-t_0)*1e-9)
         if answer is None:
             answer = float('NaN')
         return answer
@@ -762,7 +1237,15 @@ Or write_cb if it's followed by an space and something that can be casted after.
         # TODO: By default don't provide a readback, but there will be an SCPI
         #       command to return an answer to the write commands
         if self._is_write_access_allowed():
-            answer = subtree[word].write(ch_lst=channel_stack, value=params)
+            if self._metrics is None:
+                answer = subtree[word].write(ch_lst=channel_stack,
+                                             value=params)
+            else:
+                t_0 = _perf_counter_ns()
+                answer = subtree[word].write(ch_lst=channel_stack,
+                                             value=params)
+                self._metrics.observe_attribute(
+                    'write', (_perf_counter_ns()-t_0)*1e-9)
             if answer is None:
                 # FIXME: it must be configurable
                 #  if there have to be an answer
@@ -793,6 +1276,16 @@ Or write_cb if it's followed by an space and something that can be casted after.
         self._forceAccessRelease()
         return self._BookAccess()
 
+    def __release_locks_of(self, owner):
+        self._lock.release_owner(owner)
+        if self._wlock:
+            self._wlock.release_owner(owner)
+        if self._dispatcher is not None:
+            self._dispatcher.release(owner)
+
+    def __is_any_lock_booked(self):
+        return self._is_access_booked() or self._is_write_access_booked()
+
     def _lock_owner(self):
         return self._lock.owner
 
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .logger import deprecated
+    from .tcpListener import splitter
+    from .hooks import ConnectionHooks
+except Exception:
+    from logger import Logger as _Logger
+    from logger import deprecated
+    from tcpListener import splitter
+    from hooks import ConnectionHooks
+import errno as _errno
+import os as _os
+import select as _select
+import threading as _threading
+try:
+    import fcntl as _fcntl
+    import termios as _termios
+    import tty as _tty
+except ImportError:
+    # not a posix platform: there is no serial service
+    _fcntl = None
+    _termios = None
+    _tty = None
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["SerialListener"]
+
+
+PTY = 'pty'
+
+_READ_SIZE = 4096
+
+BAUDRATES = {}
+if _termios is not None:
+    for _rate in [1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200,
+                  230400]:
+        if hasattr(_termios, 'B{0:d}'.format(_rate)):
+            BAUDRATES[_rate] = getattr(_termios, 'B{0:d}'.format(_rate))
+
+
+class SerialListener(_Logger):
+    """
+        Line oriented service over a serial line. With the device PTY a
+        pseudo-terminal is opened and the clients have to talk with its
+        'slave_name' (useful for tests, or to present a virtual instrument
+        to a legacy station). Otherwise the device is the path of the tty
+        to be used, set in raw mode and with the given baudrate.
+
+        The reads are non-blocking and the lines are split and dispatched
+        like in the TcpListener. As there is a single peer, the locker
+        knows it by the name of the listener thread: 'serial:<device>'.
+    """
+
+    _callback = None
+    _connection_hooks = None
+    _join_event = None
+
+    _device = None
+    _baudrate = None
+    _fd = None
+    _slave_fd = None
+    _slave_name = None
+    _waker = None
+    _listener = None
+
+    def __init__(self, name=None, callback=None, device=PTY, baudrate=9600,
+                 *args, **kwargs):
+        super(SerialListener, self).__init__(*args, **kwargs)
+        self._name = name or "SerialListener"
+        self._callback = callback
+        self._connection_hooks = ConnectionHooks(self._name)
+        self._device = device
+        if baudrate not in BAUDRATES:
+            raise ValueError("Unsupported baudrate {0}".format(baudrate))
+        self._baudrate = baudrate
+        self._join_event = _threading.Event()
+        self._join_event.clear()
+        self.open()
+        self._debug("Listener thread prepared")
+
+    def __del__(self):
+        self.close()
+
+    def open(self):
+        if self._device == PTY:
+            self._fd, self._slave_fd = _os.openpty()
+            self._slave_name = _os.ttyname(self._slave_fd)
+            # the echo would return the commands to the client
+            _tty.setraw(self._slave_fd)
+            self._debug("Pseudo-terminal available in {0}",
+                        self._slave_name)
+        else:
+            self._fd = _os.open(self._device, _os.O_RDWR | _os.O_NOCTTY)
+            _tty.setraw(self._fd)
+            attributes = _termios.tcgetattr(self._fd)
+            attributes[4] = attributes[5] = BAUDRATES[self._baudrate]
+            _termios.tcsetattr(self._fd, _termios.TCSANOW, attributes)
+        self._set_non_blocking(self._fd)
+        self._waker = _os.pipe()
+        self._listener = _threading.Thread(
+            name="serial:{0}".format(self._slave_name or self._device),
+            target=self._serve)
+        self._listener.setDaemon(True)
+
+    def close(self):
+        if self._join_event.isSet():
+            return
+        self._debug("{0} close received", self._name)
+        self._join_event.set()
+        if self._waker is not None:
+            _os.write(self._waker[1], b'\0')
+        if self._listener is not None and self._listener.is_alive() and \
+                self._listener is not _threading.current_thread():
+            self._listener.join(1)
+        for fd in [self._fd, self._slave_fd] + list(self._waker or []):
+            if fd is not None:
+                try:
+                    _os.close(fd)
+                except OSError:
+                    pass
+        self._fd = self._slave_fd = self._waker = None
+        self._connection_hooks.close()
+        self._debug("Everything is close, exiting...")
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @property
+    def slave_name(self):
+        """
+            Path of the pseudo-terminal the clients have to open (None when
+            the service uses a real tty).
+        """
+        return self._slave_name
+
+    @property
+    def callback(self):
+        """
+            The callable the requests are given to. When it is replaced, the
+            connections already open use the new one from the next request.
+        """
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        self._callback = callback
+
+    def listen(self):
+        self._debug("Launching listener thread")
+        self._listener.start()
+
+    def is_alive(self):
+        return self._listener is not None and self._listener.is_alive()
+
+    def is_listening(self):
+        return self._fd is not None
+
+    def _set_non_blocking(self, fd):
+        flags = _fcntl.fcntl(fd, _fcntl.F_GETFL)
+        _fcntl.fcntl(fd, _fcntl.F_SETFL, flags | _os.O_NONBLOCK)
+
+    def _serve(self):
+        remaining = b''
+        name = _threading.current_thread().name
+        while not self._join_event.isSet():
+            _select.select([self._fd, self._waker[0]], [], [])
+            if self._join_event.isSet():
+                break
+            try:
+                data = _os.read(self._fd, _READ_SIZE)
+            except OSError as exc:
+                if exc.errno in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                    continue
+                # EIO when the pty has no one in the other side
+                self._debug("Reception from {0} interrupted: {1}",
+                            name, exc)
+                self._join_event.wait(0.1)
+                continue
+            self._info("received from {0}: {1:d} bytes {2!r}",
+                       name, len(data), data)
+            self._connection_hooks(name, data)
+            if self._callback is None:
+                continue
+            lines, remaining = splitter(remaining + data)
+            for line in lines:
+                try:
+                    answer = self._callback(line)
+                except Exception as exc:
+                    # one command cannot stop the service of the others
+                    self._error("Command {0!r} from {1} failed: {2}",
+                                line, name, exc)
+                    continue
+                self._debug("scpi.input say {0!r}", answer)
+                self._write(answer)
+        self._debug("Listener thread finishing")
+
+    def _write(self, data):
+        while len(data) > 0 and not self._join_event.isSet():
+            try:
+                written = _os.write(self._fd, data)
+            except OSError as exc:
+                if exc.errno not in (_errno.EAGAIN, _errno.EWOULDBLOCK):
+                    self._warning("Cannot answer: {0}", exc)
+                    return
+                _select.select([], [self._fd], [], 1)
+                continue
+            data = data[written:]
+
+    def add_connection_hook(self, hook, sync=False):
+        """
+Add a function to be called with (connection name, received data). Unless it
+is 'sync' it will be called from a background thread, so it doesn't delay
+the execution of the commands.
+        :param hook: callable
+        :param sync: bool
+        """
+        self._connection_hooks.add(hook, sync)
+
+    @deprecated
+    def addConnectionHook(self, *args):
+        return self.add_connection_hook(*args)
+
+    def remove_connection_hook(self, hook):
+        return self._connection_hooks.remove(hook)
+
+    def hook_statistics(self):
+        return self._connection_hooks.statistics()
+
+    @deprecated
+    def removeConnectionHook(self, *args):
+        return self.remove_connection_hook(*args)
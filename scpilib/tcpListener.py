@@ -20,14 +20,16 @@
 try:
     from .logger import Logger as _Logger
     from .logger import deprecated, deprecated_argument
+    from .hooks import ConnectionHooks
 except Exception:
     from logger import Logger as _Logger
     from logger import deprecated, deprecated_argument
-from gc import collect as _gccollect
+    from hooks import ConnectionHooks
+from collections import deque as _deque
+from select import select as _select
 import socket as _socket
 import threading as _threading
-from time import sleep as _sleep
-from traceback import print_exc as _print_exc
+from time import time as _time
 
 __author__ = "Sergi Blanch-Torné"
 __email__ = "sblanch@cells.es"
@@ -36,6 +38,30 @@ __license__ = "GPLv3+"
 
 
 _MAX_CLIENTS = 10
+_JOIN_TIMEOUT = 1  # seconds to wait the threads when closing
+_QUEUE_SIZE = 10
+
+# admission policies when the maximum number of clients is reached
+ADMISSION_REFUSE = 'refuse'  # answer with a refusal message and close
+ADMISSION_QUEUE = 'queue'  # hold the connection in a bounded wait queue
+ADMISSION_EVICT = 'evict'  # close the oldest idle session to make room
+_ADMISSION_POLICIES = [ADMISSION_REFUSE, ADMISSION_QUEUE, ADMISSION_EVICT]
+
+_REFUSAL_MESSAGE = b'NotAllow\r\n'
+
+# socket tuning profiles: 'nodelay' disables Nagle's algorithm, 'sndbuf' and
+# 'rcvbuf' set the kernel buffer sizes (in bytes) and 'keepalive' enables the
+# tcp keepalive probes (with 'keepidle', 'keepintvl' and 'keepcnt' when the
+# platform supports them). 'reuseport' allows many processes to bind the same
+# port to let the kernel balance the connections between them.
+SOCKET_PROFILES = {'default': {},
+                   'low-latency': {'nodelay': True,
+                                   'keepalive': True},
+                   'bulk': {'sndbuf': 4*1024*1024,
+                            'rcvbuf': 4*1024*1024,
+                            'keepalive': True}}
+_SOCKET_OPTIONS = ['nodelay', 'sndbuf', 'rcvbuf', 'keepalive', 'keepidle',
+                   'keepintvl', 'keepcnt', 'reuseport']
 
 
 def splitter(data, sep='\r\n'):
@@ -73,6 +99,181 @@ def splitter(data, sep='\r\n'):
     return result, remaining
 
 
+def resolve_socket_options(profile):
+    """
+    Resolve a socket tuning profile to the dictionary of options to be
+    applied. It can be the name of one of the SOCKET_PROFILES or a custom
+    dictionary with any of the keys 'nodelay', 'sndbuf', 'rcvbuf',
+    'keepalive', 'keepidle', 'keepintvl', 'keepcnt' and 'reuseport'.
+
+    :param profile: str, dict or None
+    :return: dict
+    """
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        unknown = [key for key in profile if key not in _SOCKET_OPTIONS]
+        if len(unknown) > 0:
+            raise KeyError("Unknown socket options {0} (use {1})"
+                           "".format(unknown, _SOCKET_OPTIONS))
+        return dict(profile)
+    if profile not in SOCKET_PROFILES:
+        raise KeyError("Unknown socket profile {0!r} (use one of {1})"
+                       "".format(profile, sorted(SOCKET_PROFILES.keys())))
+    return dict(SOCKET_PROFILES[profile])
+
+
+def apply_socket_options(sock, options):
+    """
+    Set in the socket the options of an already resolved profile. The ones
+    that are not supported by the platform are ignored.
+
+    :param sock: socket
+    :param options: dict
+    :return: None
+    """
+    is_tcp = sock.family in (_socket.AF_INET, _socket.AF_INET6)
+    if 'nodelay' in options and is_tcp:
+        sock.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY,
+                        int(options['nodelay']))
+    if 'sndbuf' in options:
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_SNDBUF,
+                        options['sndbuf'])
+    if 'rcvbuf' in options:
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_RCVBUF,
+                        options['rcvbuf'])
+    if 'keepalive' in options and is_tcp:
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_KEEPALIVE,
+                        int(options['keepalive']))
+        for key, name in [('keepidle', 'TCP_KEEPIDLE'),
+                          ('keepintvl', 'TCP_KEEPINTVL'),
+                          ('keepcnt', 'TCP_KEEPCNT')]:
+            if key in options and hasattr(_socket, name):
+                sock.setsockopt(_socket.IPPROTO_TCP, getattr(_socket, name),
+                                options[key])
+    if options.get('reuseport'):
+        if not hasattr(_socket, 'SO_REUSEPORT'):
+            raise AssertionError("SO_REUSEPORT not supported by the platform")
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEPORT, 1)
+
+
+class _OutputBuffer(object):
+    """
+        Answers waiting to be sent to a client. The connection thread appends
+        them and a writer thread drains them to the stream, so a slow client
+        doesn't block the thread doing the work. Above the high water mark
+        the connection thread stops reading until the writer takes the
+        buffer back below the mark.
+    """
+
+    def __init__(self, stream, high_water):
+        super(_OutputBuffer, self).__init__()
+        self._stream = stream
+        self._high_water = high_water
+        self._chunks = _deque()
+        self._size = 0
+        self._closed = False
+        self._error = None
+        self._condition = _threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def error(self):
+        return self._error
+
+    def write(self, data):
+        with self._condition:
+            if self._closed:
+                raise IOError("Output buffer closed ({0})".format(self._error))
+            self._chunks.append(data)
+            self._size += len(data)
+            self._condition.notify_all()
+
+    def wait_writable(self):
+        with self._condition:
+            while self._size >= self._high_water and not self._closed:
+                self._condition.wait()
+            return not self._closed
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def drain(self):
+        while True:
+            with self._condition:
+                while len(self._chunks) == 0 and not self._closed:
+                    self._condition.wait()
+                if len(self._chunks) == 0:
+                    return
+                chunk = self._chunks.popleft()
+            try:
+                self._stream.write(chunk)
+            except Exception as exc:
+                with self._condition:
+                    self._error = exc
+                    self._closed = True
+                    self._chunks.clear()
+                    self._size = 0
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._size -= len(chunk)
+                # wake up the reader on the same condition it waits for
+                if self._size < self._high_water:
+                    self._condition.notify_all()
+
+
+class _TimedStream(object):
+    """
+        Stream of a connection whose reads give up (with socket.timeout)
+        when nothing arrives in the timeout. The socket stays blocking, so
+        the writes (maybe from the writer thread of an output buffer) are
+        not affected by the timeout of the reads.
+    """
+
+    def __init__(self, connection, stream, timeout):
+        super(_TimedStream, self).__init__()
+        self._connection = connection
+        self._stream = stream
+        self._timeout = timeout
+        self._received = b''
+
+    def _receive(self):
+        ready = _select([self._connection], [], [], self._timeout)[0]
+        if len(ready) == 0:
+            raise _socket.timeout("timed out")
+        data = self._connection.recv(65536)
+        self._received += data
+        return len(data) > 0
+
+    def readline(self):
+        while b'\n' not in self._received:
+            if not self._receive():
+                break
+        position = self._received.find(b'\n')+1 or len(self._received)
+        line, self._received = \
+            self._received[:position], self._received[position:]
+        return line
+
+    def read(self, size):
+        while len(self._received) < size:
+            if not self._receive():
+                break
+        data, self._received = self._received[:size], self._received[size:]
+        return data
+
+    def write(self, data):
+        return self._stream.write(data)
+
+    def close(self):
+        self._stream.close()
+
+
 class TcpListener(_Logger):
     """
         TODO: describe it
@@ -82,6 +283,11 @@ class TcpListener(_Logger):
     _callback = None
     _connection_hooks = None
     _max_clients = None
+    _backlog = None
+    _admission = None
+    _queue_size = None
+    _socket_options = None
+    _metrics = None
     _join_event = None
 
     _local = None
@@ -97,9 +303,11 @@ class TcpListener(_Logger):
     _socket_ipv6 = None
 
     def __init__(self, name=None, callback=None, local=True, port=5025,
-                 max_clients=None, ipv6=True,
-                 maxClients=None,
-                 *args, **kwargs):
+                 max_clients=None, ipv6=True, backlog=None, admission=None,
+                 queue_size=None, socket_options=None, idle_timeout=None,
+                 read_timeout=None, release_cb=None, output_buffer=None,
+                 hook_queue_size=None, hook_overflow=None, metrics=None,
+                 maxClients=None, *args, **kwargs):
         super(TcpListener, self).__init__(*args, **kwargs)
         if maxClients is not None:
             deprecated_argument("TcpListener", "__init__", "maxClients")
@@ -107,15 +315,60 @@ class TcpListener(_Logger):
                 max_clients = maxClients
         if max_clients is None:
             max_clients = _MAX_CLIENTS
+        if backlog is None:
+            backlog = max_clients
+        if admission is None:
+            admission = ADMISSION_REFUSE
+        if admission not in _ADMISSION_POLICIES:
+            raise ValueError("Unknown admission policy {0!r} (use one of {1})"
+                             "".format(admission, _ADMISSION_POLICIES))
+        if queue_size is None:
+            queue_size = _QUEUE_SIZE
         self._name = name or "TcpListener"
         self._callback = callback
-        self._connection_hooks = []
+        self._connection_hooks = ConnectionHooks(self._name, hook_queue_size,
+                                                 hook_overflow)
         self._local = local
         self._port = port
         self._max_clients = max_clients
+        self._backlog = backlog
+        self._admission = admission
+        self._queue_size = queue_size
+        self._socket_options = resolve_socket_options(socket_options)
+        self._idle_timeout = idle_timeout
+        self._read_timeout = read_timeout
+        self._release_cb = release_cb
+        self._output_buffer = output_buffer
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add_gauge('scpi_active_connections',
+                              "Connections being served.",
+                              lambda: self.active_connections,
+                              listener=self._name)
+            metrics.add_gauge('scpi_buffered_bytes',
+                              "Bytes waiting in the output buffers.",
+                              lambda: self.pending_bytes,
+                              listener=self._name)
         self._join_event = _threading.Event()
         self._join_event.clear()
         self._connection_threads = {}
+        self._connection_sockets = {}
+        self._connection_activity = {}
+        self._admission_lock = _threading.Lock()
+        self._admission_queue = _deque()
+        self._rejected_connections = 0
+        self._queued_connections = 0
+        self._evicted_connections = 0
+        self._connection_buffers = {}
+        self._connection_busy = set()
+        self._connection_reaped = set()
+        self._connection_evicted = set()
+        self._reaped_connections = 0
+        self._reaper = None
+        if idle_timeout is not None:
+            self._reaper = _threading.Thread(name="{0}Reaper".format(
+                self._name), target=self._reap)
+            self._reaper.setDaemon(True)
         self._with_ipv6_support = ipv6
         self.open()
         self._debug("Listener thread prepared")
@@ -146,22 +399,43 @@ class TcpListener(_Logger):
             return
         self._debug("{0} close received", self._name)
         if hasattr(self, '_join_event'):
-            self._debug("Deleting TcpListener")
+            self._debug("Deleting {0}", self.__class__.__name__)
             self._join_event.set()
-        self._shutdown_socket(self._socket_ipv4)
-        if self._with_ipv6_support and hasattr(self, '_socket_ipv6'):
-            self._shutdown_socket(self._socket_ipv6)
-        if self._is_listening_ipv4():
-            self._socket_ipv4 = None
-        if self._with_ipv6_support and self._is_listening_ipv6():
-            self._socket_ipv6 = None
-        _gccollect()
-        while self.is_alive():
-            _gccollect()
-            self._debug("Waiting for Listener threads")
-            _sleep(1)
+        deadline = _time() + _JOIN_TIMEOUT
+        # shutdown unblocks the accept() of the listener threads
+        for sock in self._listening_sockets():
+            self._shutdown_socket(sock)
+        self._join_threads(self._listener_threads() + [self._reaper],
+                           deadline)
+        with self._admission_lock:
+            while len(self._admission_queue) > 0:
+                address, connection = self._admission_queue.popleft()
+                connection.close()
+            connections = list(self._connection_sockets.values())
+            threads = list(self._connection_threads.values())
+        # and the readline() of the connection threads
+        for connection in connections:
+            self._shutdown_socket(connection)
+        self._join_threads(threads, deadline)
+        for sock in self._listening_sockets():
+            sock.close()
+        self._socket_ipv4 = None
+        self._socket_ipv6 = None
+        self._connection_hooks.close()
+        if self._metrics is not None:
+            self._metrics.remove_gauges(listener=self._name)
+        if self.is_alive():
+            self._warning("Listener threads still alive after {0} s",
+                          _JOIN_TIMEOUT)
         self._debug("Everything is close, exiting...")
 
+    def _join_threads(self, threads, deadline):
+        for thread in threads:
+            if thread is None or thread is _threading.current_thread() or \
+                    not thread.is_alive():
+                continue
+            thread.join(max(deadline - _time(), 0))
+
     @property
     def port(self):
         return self._port
@@ -170,14 +444,78 @@ class TcpListener(_Logger):
     def local(self):
         return self._local
 
+    @property
+    def max_clients(self):
+        return self._max_clients
+
+    @property
+    def backlog(self):
+        return self._backlog
+
+    @property
+    def admission(self):
+        return self._admission
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def socket_options(self):
+        return dict(self._socket_options)
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    @property
+    def read_timeout(self):
+        return self._read_timeout
+
+    @property
+    def output_buffer(self):
+        return self._output_buffer
+
+    @property
+    def buffered_bytes(self):
+        """
+Bytes waiting to be sent to each of the connections (only when they have an
+output buffer).
+        :return: dict
+        """
+        return dict([(name, buffer.size) for name, buffer
+                     in list(self._connection_buffers.items())])
+
+    @property
+    def pending_bytes(self):
+        """
+Bytes waiting to be sent to all the connections.
+        :return: int
+        """
+        return sum([buffer.size for buffer
+                    in list(self._connection_buffers.values())])
+
+    @property
+    def callback(self):
+        """
+            The callable the requests are given to. When it is replaced, the
+            connections already open use the new one from the next request.
+        """
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        self._callback = callback
+
     def listen(self):
         self._debug("Launching listener thread")
-        self._listener_ipv4.start()
-        if hasattr(self, '_listener_ipv6'):
-            self._listener_ipv6.start()
+        for thread in self._listener_threads():
+            thread.start()
+        if self._reaper is not None:
+            self._reaper.start()
 
     def is_alive(self):
-        return self._is_ipv4_listener_alive() or self._is_ipv6_listener_alive()
+        return any([thread.is_alive() for thread in self._listener_threads()])
 
     @deprecated
     def isAlive(self):
@@ -199,8 +537,9 @@ class TcpListener(_Logger):
             _socket.AF_INET, _socket.SOCK_STREAM)
         self._socket_ipv4.setsockopt(
             _socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        apply_socket_options(self._socket_ipv4, self._socket_options)
         self._listener_ipv4 = _threading.Thread(name="Listener4",
-                                                target=self.__listener,
+                                                target=self._listener,
                                                 args=(self._socket_ipv4,
                                                       self._host_ipv4,))
         self._listener_ipv4.setDaemon(True)
@@ -223,8 +562,9 @@ class TcpListener(_Logger):
                                          _socket.IPV6_V6ONLY, True)
             self._socket_ipv6.setsockopt(_socket.SOL_SOCKET,
                                          _socket.SO_REUSEADDR, 1)
+            apply_socket_options(self._socket_ipv6, self._socket_options)
             self._listener_ipv6 = _threading.Thread(name="Listener6",
-                                                    target=self.__listener,
+                                                    target=self._listener,
                                                     args=(self._socket_ipv6,
                                                           self._host_ipv6,))
             self._listener_ipv6.setDaemon(True)
@@ -233,25 +573,45 @@ class TcpListener(_Logger):
     def buildIpv6Socket(self):
         return self.build_ipv6_socket()
 
-    @staticmethod
-    def _shutdown_socket(sock):
+    def _listening_sockets(self):
+        sockets = [self._socket_ipv4]
+        if self._with_ipv6_support and self._socket_ipv6 is not None:
+            sockets.append(self._socket_ipv6)
+        return sockets
+
+    def _listener_threads(self):
+        threads = [self._listener_ipv4]
+        if self._listener_ipv6 is not None:
+            threads.append(self._listener_ipv6)
+        return threads
+
+    def _bind_address(self, scpihost):
+        return (scpihost, self._port)
+
+    def _accept(self, scpisocket):
+        return scpisocket.accept()
+
+    def _connection_name(self, address):
+        return "{0}:{1}".format(address[0], address[1])
+
+    def _shutdown_socket(self, sock):
         try:
             sock.shutdown(_socket.SHUT_RDWR)
-        except Exception as e:
-            _print_exc()
+        except Exception as exc:
+            self._debug("Socket shutdown exception: {0}", exc)
 
     def _is_ipv4_listener_alive(self):
         return self._listener_ipv4.is_alive()
 
     def _is_ipv6_listener_alive(self):
-        if hasattr(self, '_listener_ipv6'):
+        if self._listener_ipv6 is not None:
             return self._listener_ipv6.is_alive()
         return False
 
-    def __listener(self, scpisocket, scpihost):
+    def _listener(self, scpisocket, scpihost):
         try:
-            self.__prepare_listener(scpisocket, scpihost, 5)
-            self.__do_listen(scpisocket)
+            self._prepare_listener(scpisocket, scpihost, 5)
+            self._do_listen(scpisocket)
             self._debug("Listener thread finishing")
         except SystemExit as exc:
             self._debug("Received a SystemExit ({0})", exc)
@@ -263,17 +623,19 @@ class TcpListener(_Logger):
             self._debug("Received a GeneratorExit ({0})", exc)
             self.__del__()
 
-    def __prepare_listener(self, scpisocket, scpihost, maxretries):
+    def _prepare_listener(self, scpisocket, scpihost, maxretries):
         listening = False
         tries = 0
         seconds = 3
         while tries < maxretries:
             try:
-                scpisocket.bind((scpihost, self._port))
-                scpisocket.listen(self._max_clients)
-                self._debug("Listener thread up and running (port {0:d}, with "
-                            "a maximum of {1:d} connections in parallel).",
-                            self._port, self._max_clients)
+                scpisocket.bind(self._bind_address(scpihost))
+                scpisocket.listen(self._backlog)
+                self._debug("Listener thread up and running ({0}, with "
+                            "a maximum of {1:d} connections in parallel, "
+                            "backlog {2:d} and {3!r} admission).",
+                            self._bind_address(scpihost), self._max_clients,
+                            self._backlog, self._admission)
                 return True
             except Exception as exc:
                 tries += 1
@@ -281,23 +643,22 @@ class TcpListener(_Logger):
                             "(Retry in {0:d} seconds)".format(seconds)
                             if tries < maxretries else "(No more retries)",
                             exc)
-                _sleep(seconds)
+                if self._join_event.wait(seconds):
+                    break
         return False
 
-    def __do_listen(self, scpisocket):
+    def _do_listen(self, scpisocket):
         while not self._join_event.isSet():
             try:
-                connection, address = scpisocket.accept()
+                connection, address = self._accept(scpisocket)
             except Exception as e:
                 if self._join_event.isSet():
                     self._debug("Closing Listener")
-                    del scpisocket
                     return
                 # self._error("Socket Accept Exception: %s" % (e))
-                _sleep(3)
+                self._join_event.wait(3)
             else:
-                self.__launch_connection(address, connection)
-        scpisocket.close()
+                self._launch_connection(address, connection)
 
     def _is_listening_ipv4(self):
         if hasattr(self, '_socket_ipv4') and \
@@ -315,81 +676,250 @@ class TcpListener(_Logger):
     def active_connections(self):
         return len(self._connection_threads)
 
-    def __launch_connection(self, address, connection):
-        connectionName = "{0}:{1}".format(address[0], address[1])
+    @property
+    def waiting_connections(self):
+        return len(self._admission_queue)
+
+    @property
+    def rejected_connections(self):
+        return self._rejected_connections
+
+    @property
+    def queued_connections(self):
+        return self._queued_connections
+
+    @property
+    def evicted_connections(self):
+        return self._evicted_connections
+
+    @property
+    def reaped_connections(self):
+        return self._reaped_connections
+
+    def _launch_connection(self, address, connection):
+        connectionName = self._connection_name(address)
         try:
             self._debug("Connection request from {0} "
                         "(having {1:d} already active)",
                         connectionName, self.active_connections)
-            if connectionName in self._connection_threads and \
-                    self._connection_threads[connectionName].is_Alive():
-                self.error("New connection from {0} when it has already "
-                           "one. refusing the newer.", connectionName)
-            elif self.active_connections >= self._max_clients:
-                self._error("Reached the maximum number of allowed "
-                            "connections ({0:d})", self.active_connections)
-            else:
-                self._connection_threads[connectionName] = \
-                    _threading.Thread(name=connectionName,
-                                      target=self.__connection,
-                                      args=(address, connection))
-                self._debug("Connection for {0} created", connectionName)
-                self._connection_threads[connectionName].setDaemon(True)
-                self._connection_threads[connectionName].start()
+            with self._admission_lock:
+                if connectionName in self._connection_threads and \
+                        self._connection_threads[connectionName].is_alive():
+                    self._error("New connection from {0} when it has already "
+                                "one. refusing the newer.", connectionName)
+                    self._refuse_connection(connectionName, connection)
+                elif self.active_connections < self._max_clients:
+                    self._start_connection(address, connection)
+                elif self._admission == ADMISSION_QUEUE and \
+                        len(self._admission_queue) < self._queue_size:
+                    self._admission_queue.append((address, connection))
+                    self._queued_connections += 1
+                    self._info("Reached the maximum number of allowed "
+                               "connections ({0:d}), {1} waits in the queue "
+                               "(position {2:d})", self.active_connections,
+                               connectionName, len(self._admission_queue))
+                elif self._admission == ADMISSION_EVICT and \
+                        self._evict_oldest_idle():
+                    self._start_connection(address, connection)
+                else:
+                    self._error("Reached the maximum number of allowed "
+                                "connections ({0:d}), refusing {1}",
+                                self.active_connections, connectionName)
+                    self._refuse_connection(connectionName, connection)
         except Exception as exc:
             self._error("Cannot launch connection request from {0} due to: "
                         "{1}", connectionName, exc)
 
-    def __connection(self, address, connection):
-        connectionName = "{0}:{1}".format(address[0], address[1])
+    def _start_connection(self, address, connection):
+        connectionName = self._connection_name(address)
+        apply_socket_options(connection, self._socket_options)
+        self._connection_sockets[connectionName] = connection
+        self._connection_activity[connectionName] = _time()
+        self._connection_threads[connectionName] = \
+            _threading.Thread(name=connectionName,
+                              target=self._connection,
+                              args=(address, connection))
+        self._debug("Connection for {0} created", connectionName)
+        self._connection_threads[connectionName].setDaemon(True)
+        self._connection_threads[connectionName].start()
+
+    def _refuse_connection(self, connectionName, connection):
+        self._rejected_connections += 1
+        if self._metrics is not None:
+            self._metrics.count_rejected(self._name)
+        try:
+            connection.sendall(_REFUSAL_MESSAGE)
+            connection.shutdown(_socket.SHUT_RDWR)
+        except Exception as exc:
+            self._debug("Refusal to {0} not delivered: {1}",
+                        connectionName, exc)
+        connection.close()
+
+    def _evict_oldest_idle(self):
+        # a connection executing a command is not idle
+        idle = [name for name in self._connection_activity
+                if name not in self._connection_busy and
+                name not in self._connection_evicted]
+        if len(idle) == 0:
+            return False
+        oldest = min(idle, key=self._connection_activity.get)
+        idle = _time()-self._connection_activity.pop(oldest)
+        connection = self._connection_sockets.pop(oldest, None)
+        self._warning("Evicting {0} (idle for {1:.3f} s) to make room",
+                      oldest, idle)
+        self._evicted_connections += 1
+        # its thread releases its resources, like when it is reaped
+        self._connection_evicted.add(oldest)
+        if connection is not None:
+            self._shutdown_socket(connection)
+        # the evicted thread will pop itself from the active ones
+        self._connection_threads.pop(oldest, None)
+        return True
+
+    def _reap(self):
+        interval = max(self._idle_timeout/4., 0.01)
+        while not self._join_event.wait(interval):
+            now = _time()
+            with self._admission_lock:
+                stale = [(name, now-last) for name, last
+                         in list(self._connection_activity.items())
+                         if now-last > self._idle_timeout and
+                         name not in self._connection_busy]
+                for connectionName, idle in stale:
+                    self._warning("Reaping {0} (idle for {1:.3f} s)",
+                                  connectionName, idle)
+                    self._connection_reaped.add(connectionName)
+                    self._connection_activity.pop(connectionName)
+                    self._shutdown_socket(
+                        self._connection_sockets[connectionName])
+        self._debug("Reaper thread finishing")
+
+    def _release_connection(self, connectionName):
+        if connectionName in self._connection_reaped:
+            self._connection_reaped.discard(connectionName)
+            self._reaped_connections += 1
+        self._connection_evicted.discard(connectionName)
+        # closed by the client, reaped or evicted: a later connection has
+        # another name, so no one else can release what this one had
+        if self._release_cb is not None:
+            try:
+                self._release_cb(connectionName)
+            except Exception as exc:
+                self._error("Cannot release the resources of {0}: {1}",
+                            connectionName, exc)
+        with self._admission_lock:
+            self._connection_busy.discard(connectionName)
+            self._connection_threads.pop(connectionName, None)
+            self._connection_sockets.pop(connectionName, None)
+            self._connection_activity.pop(connectionName, None)
+            while len(self._admission_queue) > 0 and \
+                    self.active_connections < self._max_clients and \
+                    not self._join_event.isSet():
+                address, connection = self._admission_queue.popleft()
+                self._debug("Admitting {0}:{1} from the wait queue",
+                            address[0], address[1])
+                self._start_connection(address, connection)
+
+    def _connection(self, address, connection):
+        connectionName = self._connection_name(address)
         self._debug("Thread for {0} connection", connectionName)
         stream = connection.makefile('rwb', bufsize=0)
+        if self._read_timeout is not None:
+            stream = _TimedStream(connection, stream, self._read_timeout)
+        buffer, writer = None, None
+        if self._output_buffer is not None:
+            buffer = _OutputBuffer(stream, self._output_buffer)
+            writer = _threading.Thread(name="{0}Writer".format(connectionName),
+                                       target=buffer.drain)
+            writer.setDaemon(True)
+            writer.start()
+            self._connection_buffers[connectionName] = buffer
+        try:
+            self._serve_connection(connectionName, stream, buffer)
+        except Exception as exc:
+            if not self._join_event.isSet():
+                self._error("Connection {0} broken: {1}", connectionName, exc)
+        finally:
+            if buffer is not None:
+                buffer.close()
+                writer.join(_JOIN_TIMEOUT)
+                self._connection_buffers.pop(connectionName, None)
+            stream.close()
+            connection.close()
+            self._release_connection(connectionName)
+        self._debug("Ending connection: {0} (having {1} active left)",
+                    connectionName, self.active_connections)
+
+    def _serve_connection(self, connectionName, stream, buffer=None):
         remaining = b''
+        if buffer is None:
+            write = stream.write  # connection.send(ans)
+        else:
+            write = buffer.write
         while not self._join_event.isSet():
-            data = stream.readline()  # data = connection.recv(4096)
+            if buffer is not None and not buffer.wait_writable():
+                self._warning("Cannot send to {0}: {1}",
+                              connectionName, buffer.error)
+                return
+            try:
+                data = stream.readline()  # data = connection.recv(4096)
+            except _socket.timeout:
+                self._warning("Nothing received from {0} in {1} s, "
+                              "reaping it", connectionName,
+                              self._read_timeout)
+                self._connection_reaped.add(connectionName)
+                data = b''
+            except Exception as exc:
+                self._debug("Reception from {0} interrupted: {1}",
+                            connectionName, exc)
+                data = b''
+            self._connection_busy.add(connectionName)
             self._info("received from {0}: {1:d} bytes {2!r}",
                        connectionName, len(data), data)
             if len(self._connection_hooks) > 0:
-                for hook in self._connection_hooks:
-                    try:
-                        hook(connectionName, data)
-                    except Exception as exc:
-                        self._warning("Exception calling {0} hook: {1}",
-                                      hook, exc)
+                self._connection_hooks(connectionName, data)
+            if self._metrics is not None:
+                self._metrics.count_bytes(self._name, received=len(data))
             data = remaining + data
             if len(data) == 0:
                 self._warning("No data received, termination the connection")
-                stream.close()
-                connection.close()
-                break
+                return
             if self._callback is not None:
                 lines, remaining = splitter(data)
                 for line in lines:
                     ans = self._callback(line)
                     self._debug("scpi.input say {0!r}", ans)
-                    stream.write(ans)  # connection.send(ans)
+                    if self._metrics is not None:
+                        self._metrics.count_bytes(self._name, sent=len(ans))
+                    write(ans)
             else:
                 remaining = b''
-        stream.close()
-        self._connection_threads.pop(connectionName)
-        self._debug("Ending connection: {0} (having {1} active left)",
-                    connectionName, self.active_connections)
-
-    def add_connection_hook(self, hook):
-        if callable(hook):
-            self._connection_hooks.append(hook)
-        else:
-            raise TypeError("The hook must be a callable object")
+            self._connection_activity[connectionName] = _time()
+            self._connection_busy.discard(connectionName)
+        # closing the listener ends the loop before the connection is read
+        # empty: the hooks have to see the end of the connection anyway
+        if len(self._connection_hooks) > 0:
+            self._connection_hooks(connectionName, b'')
+
+    def add_connection_hook(self, hook, sync=False):
+        """
+Add a function to be called with (connection name, received data). Unless it
+is 'sync' it will be called from a background thread, so it doesn't delay
+the execution of the commands.
+        :param hook: callable
+        :param sync: bool
+        """
+        self._connection_hooks.add(hook, sync)
 
     @deprecated
     def addConnectionHook(self, *args):
         return self.add_connection_hook(*args)
 
     def remove_connection_hook(self, hook):
-        if self._connection_hooks.count(hook):
-            self._connection_hooks.pop(self._connection_hooks.index(hook))
-            return True
-        return False
+        return self._connection_hooks.remove(hook)
+
+    def hook_statistics(self):
+        return self._connection_hooks.statistics()
 
     @deprecated
     def removeConnectionHook(self, *args):
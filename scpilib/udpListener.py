@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .logger import Logger as _Logger
+    from .logger import deprecated
+    from .tcpListener import splitter
+    from .hooks import ConnectionHooks
+except Exception:
+    from logger import Logger as _Logger
+    from logger import deprecated
+    from tcpListener import splitter
+    from hooks import ConnectionHooks
+from collections import OrderedDict as _OrderedDict
+import socket as _socket
+import threading as _threading
+from time import time as _time
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["UdpListener"]
+
+
+_DATAGRAM_SIZE = 65535
+_MAX_SOURCES = 1024
+
+
+class UdpListener(_Logger):
+    """
+        Datagram service for fire-and-forget commands. Each datagram can have
+        many ';' separated commands (and many lines) that are dispatched
+        through the callback like the ones received by the TcpListener. There
+        is no connection and no answer, except when the datagram includes
+        queries: then the answer is sent back to the source.
+
+        The counters of the 'max_sources' that have sent datagrams more
+        recently are kept (as the clients use ephemeral ports, each of their
+        sockets is a new source).
+    """
+
+    _callback = None
+    _connection_hooks = None
+    _join_event = None
+
+    _local = None
+    _port = None
+
+    _with_ipv6_support = None
+    _sockets = None
+    _listeners = None
+
+    def __init__(self, name=None, callback=None, local=True, port=5025,
+                 ipv6=True, max_sources=None, *args, **kwargs):
+        super(UdpListener, self).__init__(*args, **kwargs)
+        self._name = name or "UdpListener"
+        self._callback = callback
+        self._connection_hooks = ConnectionHooks(self._name)
+        self._local = local
+        self._port = port
+        self._with_ipv6_support = ipv6
+        self._join_event = _threading.Event()
+        self._join_event.clear()
+        self._sockets = {}
+        self._listeners = {}
+        self._max_sources = max_sources or _MAX_SOURCES
+        self._sources = _OrderedDict()
+        self._sources_lock = _threading.Lock()
+        self.open()
+        self._debug("Listener thread prepared")
+
+    def __del__(self):
+        self.close()
+
+    def open(self):
+        self.build_socket(_socket.AF_INET,
+                          '127.0.0.1' if self._local else '0.0.0.0')
+        if self._with_ipv6_support:
+            try:
+                if not _socket.has_ipv6:
+                    raise AssertionError("IPv6 not supported by the platform")
+                self.build_socket(_socket.AF_INET6,
+                                  '::1' if self._local else '::')
+            except Exception as exc:
+                self._error("IPv6 will not be available due to: {0}", exc)
+
+    def close(self):
+        if self._join_event.isSet():
+            return
+        self._debug("{0} close received", self._name)
+        self._join_event.set()
+        for family, sock in self._sockets.items():
+            try:
+                # wake up the recvfrom() with an empty datagram
+                waker = _socket.socket(family, _socket.SOCK_DGRAM)
+                waker.sendto(b'', sock.getsockname()[:2])
+                waker.close()
+            except Exception as exc:
+                self._debug("Cannot wake up the {0} listener: {1}",
+                            family, exc)
+        for listener in self._listeners.values():
+            if listener.is_alive() and \
+                    listener is not _threading.current_thread():
+                listener.join(1)
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets = {}
+        self._connection_hooks.close()
+        self._debug("Everything is close, exiting...")
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def local(self):
+        return self._local
+
+    @property
+    def callback(self):
+        """
+            The callable the requests are given to. When it is replaced, the
+            connections already open use the new one from the next request.
+        """
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        self._callback = callback
+
+    def listen(self):
+        self._debug("Launching listener threads")
+        for listener in self._listeners.values():
+            listener.start()
+
+    def is_alive(self):
+        return any([listener.is_alive()
+                    for listener in self._listeners.values()])
+
+    def is_listening(self):
+        return len(self._sockets) > 0
+
+    def build_socket(self, family, host):
+        sock = _socket.socket(family, _socket.SOCK_DGRAM)
+        if family == _socket.AF_INET6:
+            sock.setsockopt(_socket.IPPROTO_IPV6, _socket.IPV6_V6ONLY, True)
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        sock.bind((host, self._port))
+        self._sockets[family] = sock
+        self._listeners[family] = _threading.Thread(
+            name="UdpListener{0}".format(
+                6 if family == _socket.AF_INET6 else 4),
+            target=self._listener, args=(sock,))
+        self._listeners[family].setDaemon(True)
+
+    def statistics(self):
+        """
+Per source counters: datagrams and commands received, answers sent, and the
+datagram rate (per second) between the first and the last received.
+        :return: dict
+        """
+        with self._sources_lock:
+            answer = {}
+            for source, counters in self._sources.items():
+                counters = dict(counters)
+                elapsed = counters['last'] - counters['first']
+                if elapsed > 0:
+                    counters['rate'] = (counters['datagrams']-1) / elapsed
+                else:
+                    counters['rate'] = 0.0
+                answer[source] = counters
+            return answer
+
+    def reset_statistics(self):
+        with self._sources_lock:
+            self._sources = _OrderedDict()
+
+    def _listener(self, sock):
+        while not self._join_event.isSet():
+            try:
+                data, address = sock.recvfrom(_DATAGRAM_SIZE)
+            except Exception as exc:
+                if self._join_event.isSet():
+                    break
+                self._error("Datagram reception exception: {0}", exc)
+                continue
+            if self._join_event.isSet():
+                break
+            self._datagram(sock, data, address)
+        self._debug("Listener thread finishing")
+
+    def _datagram(self, sock, data, address):
+        source = "{0}:{1}".format(address[0], address[1])
+        # the locker identifies the clients by the thread name
+        thread = _threading.current_thread()
+        name, thread.name = thread.name, source
+        try:
+            self._process_datagram(sock, data, address, source)
+        finally:
+            thread.name = name
+
+    def _process_datagram(self, sock, data, address, source):
+        lines, remaining = splitter(data + b'\n')
+        self._count(source, 'datagrams')
+        self._count(source, 'commands',
+                    sum([line.count(b';')+1 for line in lines]))
+        self._connection_hooks(source, data)
+        if self._callback is None:
+            return
+        for line in lines:
+            try:
+                answer = self._callback(line)
+            except Exception as exc:
+                # one command cannot stop the service of the others
+                self._error("Command {0!r} from {1} failed: {2}",
+                            line, source, exc)
+                continue
+            if b'?' in line and len(answer) > 0:
+                try:
+                    sock.sendto(answer, address)
+                    self._count(source, 'answers')
+                except Exception as exc:
+                    self._warning("Cannot answer {0}: {1}", source, exc)
+
+    def _count(self, source, counter, increment=1):
+        now = _time()
+        with self._sources_lock:
+            counters = self._sources.pop(source, None)
+            if counters is None:
+                counters = {'datagrams': 0, 'commands': 0, 'answers': 0,
+                            'first': now, 'last': now}
+                while len(self._sources) >= self._max_sources:
+                    # the least recently seen
+                    self._sources.popitem(last=False)
+            # (re)inserted as the most recently seen
+            self._sources[source] = counters
+            counters[counter] += increment
+            if counter == 'datagrams':
+                counters['last'] = now
+
+    def add_connection_hook(self, hook, sync=False):
+        """
+Add a function to be called with (connection name, received data). Unless it
+is 'sync' it will be called from a background thread, so it doesn't delay
+the execution of the commands.
+        :param hook: callable
+        :param sync: bool
+        """
+        self._connection_hooks.add(hook, sync)
+
+    @deprecated
+    def addConnectionHook(self, *args):
+        return self.add_connection_hook(*args)
+
+    def remove_connection_hook(self, hook):
+        return self._connection_hooks.remove(hook)
+
+    def hook_statistics(self):
+        return self._connection_hooks.statistics()
+
+    @deprecated
+    def removeConnectionHook(self, *args):
+        return self.remove_connection_hook(*args)
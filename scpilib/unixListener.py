@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+try:
+    from .tcpListener import TcpListener
+except Exception:
+    from tcpListener import TcpListener
+import errno as _errno
+import fcntl as _fcntl
+from itertools import count as _count
+import os as _os
+import socket as _socket
+import stat as _stat
+import threading as _threading
+
+__author__ = "Sergi Blanch-Torné"
+__email__ = "sblanch@cells.es"
+__copyright__ = "Copyright 2015, CELLS / ALBA Synchrotron"
+__license__ = "GPLv3+"
+
+__all__ = ["UnixSocketListener"]
+
+
+_UNIX_SOCKET_PATH = '/tmp/scpi.sock'
+
+
+class UnixSocketListener(TcpListener):
+    """
+        Listener for same host clients using a unix domain socket. It avoids
+        the loopback tcp stack, but the connection handling (admission,
+        hooks and line splitting) is the one from the TcpListener.
+
+        The listener holds a lock on a file next to the socket (with a
+        '.lock' suffix) while it uses the path. Without that lock, a socket
+        file in the path has been left by a process that has finished.
+    """
+
+    _path = None
+    _lock_file = None
+    _socket_unix = None
+    _listener_unix = None
+    _connection_counter = None
+
+    def __init__(self, name=None, callback=None, path=None, *args, **kwargs):
+        self._path = path or _UNIX_SOCKET_PATH
+        self._connection_counter = _count(1)
+        kwargs['local'] = True
+        kwargs['ipv6'] = False
+        super(UnixSocketListener, self).__init__(
+            name=name or "UnixSocketListener", callback=callback,
+            port=None, *args, **kwargs)
+
+    def open(self):
+        self.build_unix_socket()
+
+    def close(self):
+        # only the one that has built the socket can remove the file
+        owner = self._socket_unix is not None and \
+            not self._join_event.isSet()
+        super(UnixSocketListener, self).close()
+        self._socket_unix = None
+        if owner:
+            self._remove_socket_file()
+        if self._lock_file is not None:
+            # the lock file stays: removing it would race with the next one
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def is_listening(self):
+        if self._socket_unix is not None and \
+                hasattr(self._socket_unix, 'fileno'):
+            return bool(self._socket_unix.fileno())
+        return False
+
+    def build_unix_socket(self):
+        self._remove_stale_socket_file()
+        self._socket_unix = _socket.socket(_socket.AF_UNIX,
+                                           _socket.SOCK_STREAM)
+        self._listener_unix = _threading.Thread(name="ListenerUnix",
+                                                target=self._listener,
+                                                args=(self._socket_unix,
+                                                      self._path,))
+        self._listener_unix.setDaemon(True)
+
+    def _listening_sockets(self):
+        if self._socket_unix is None:
+            return []
+        return [self._socket_unix]
+
+    def _listener_threads(self):
+        if self._listener_unix is None:
+            return []
+        return [self._listener_unix]
+
+    def _bind_address(self, scpihost):
+        return self._path
+
+    def _accept(self, scpisocket):
+        # the peer of a unix socket is unnamed, number the connections to
+        # have a unique name for each of them
+        connection, address = scpisocket.accept()
+        return connection, (self._path, next(self._connection_counter))
+
+    def _remove_stale_socket_file(self):
+        # a socket left by a process that has finished has no one holding
+        # the lock, but if someone has it the socket is not ours to remove
+        if self._lock_file is not None:
+            return
+        lock_file = open(self._path + '.lock', 'a')
+        try:
+            _fcntl.flock(lock_file.fileno(), _fcntl.LOCK_EX | _fcntl.LOCK_NB)
+        except IOError as exc:
+            lock_file.close()
+            if exc.errno not in (_errno.EAGAIN, _errno.EACCES):
+                raise
+            raise IOError("{0} is in use by another listener"
+                          "".format(self._path))
+        self._lock_file = lock_file
+        if _os.path.exists(self._path):
+            self._debug("Removing the stale socket {0}", self._path)
+            self._remove_socket_file()
+
+    def _remove_socket_file(self):
+        try:
+            if _stat.S_ISSOCK(_os.stat(self._path).st_mode):
+                _os.unlink(self._path)
+        except OSError:
+            pass